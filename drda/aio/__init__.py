@@ -25,7 +25,7 @@ from drda.aio.connection import AsyncConnection
 from drda.aio.cursor import AsyncCursor
 
 
-async def connect(host, database, port, user=None, password=None, use_ssl=False, ssl_client_cert_path=None, timeout=None):
-    conn = AsyncConnection(host, database, port, user, password, use_ssl, ssl_client_cert_path, timeout)
+async def connect(host, database, port, user=None, password=None, use_ssl=False, ssl_client_cert_path=None, timeout=None, *, qryblksz=65535, maxblkext=-1, qryrowset=None, stmt_cache_size=32, autocommit=True, decimal_mode='decimal', datetime_mode='datetime', spill_size=None, row_factory=None, lob_mode='value', lob_inline_size=None):
+    conn = AsyncConnection(host, database, port, user, password, use_ssl, ssl_client_cert_path, timeout, qryblksz=qryblksz, maxblkext=maxblkext, qryrowset=qryrowset, stmt_cache_size=stmt_cache_size, autocommit=autocommit, decimal_mode=decimal_mode, datetime_mode=datetime_mode, spill_size=spill_size, row_factory=row_factory, lob_mode=lob_mode, lob_inline_size=lob_inline_size)
     await conn._initialize()
     return conn
@@ -21,6 +21,7 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 ##############################################################################
+from drda import utils
 from drda.cursor import Cursor
 
 
@@ -31,21 +32,42 @@ class AsyncCursor(Cursor):
     async def __aexit__(self, exc, value, traceback):
         await self.close()
 
+    async def _close_query(self):
+        if self._open_query:
+            await self.connection._close_query(self._open_query)
+            self._open_query = None
+
+    async def _fill_rows(self):
+        "Fetch the next query blocks when the buffered rows ran out"
+        while not self._rows and self._open_query:
+            self._rows = await self.connection._fetch_query(self._open_query)
+            if not self._open_query.is_open:
+                self._open_query = None
+
     async def execute(self, query, args=[]):
+        await self._close_query()
         self.query = query
+        self._rowcount = -1
         if query.strip().split()[0].upper() == 'SELECT':
-            self._rows, self.description = await self.connection._query(self.query, args)
+            self._rows, self.description, self._open_query = await self.connection._query(
+                self.query, args, self._query_options(), streaming=self.streaming,
+            )
         else:
-            await self.connection._execute(self.query, args)
+            self._rowcount = await self.connection._execute(self.query, args)
 
     async def executemany(self, query, seq_of_params):
-        for params in seq_of_params:
-            await self.execute(query, params)
+        if query.strip().split()[0].upper() == 'SELECT':
+            for params in seq_of_params:
+                await self.execute(query, params)
+            return
+        self.query = query
+        self._rowcount = await self.connection._executemany(self.query, seq_of_params)
 
     async def fetchone(self):
         from drda import OperationalError
         if not self.connection or not self.connection.is_connect():
             raise OperationalError(u"08003:Lost connection")
+        await self._fill_rows()
         if len(self._rows):
             return self._rows.popleft()
         return None
@@ -54,17 +76,110 @@ class AsyncCursor(Cursor):
         rs = []
         for i in range(size):
             r = await self.fetchone()
-            if not r:
+            if r is None:
                 break
             rs.append(r)
         return rs
 
     async def fetchall(self):
-        r = list(self._rows)
-        self._rows.clear()
+        rows = await self.fetchall_packed()
+        if isinstance(rows, utils.PackedRows):
+            r = list(rows)
+            rows.clear()    # release the query blocks and the temporary file
+            return r
+        return rows
+
+    async def fetchall_packed(self):
+        "Fetch all remaining rows. return utils.PackedRows with packed=True, list otherwise or for LOB queries"
+        r = self._rows
+        if not isinstance(r, utils.PackedRows):
+            r = list(r)
+        self._rows = []
+        while self._open_query:
+            await self._fill_rows()
+            if not self._rows:
+                continue
+            if isinstance(r, utils.PackedRows) and not isinstance(self._rows, utils.PackedRows):
+                r = list(r)
+            r.extend(self._rows)
+            self._rows = []
         return r
 
+    async def _fetch_query_columns(self, columns):
+        "Decode the next query blocks into columns"
+        query = self._open_query
+        if any(t in utils.LOB_TYPES for t, _ in query.qrydsc):
+            # LOB values are filled in from EXTDTA after the rows are decoded
+            utils.append_rows(columns, await self.connection._fetch_query(query))
+        else:
+            await self.connection._fetch_query(query, columns)
+        if not query.is_open:
+            self._open_query = None
+
+    async def fetch_columns(self):
+        "Fetch all remaining rows. return list of utils.Column"
+        columns = utils.new_columns(self.description)
+        while self._rows:
+            utils.append_row(columns, self._rows.popleft())
+        while self._open_query:
+            await self._fetch_query_columns(columns)
+        return columns
+
+    async def fetch_numpy(self):
+        "Fetch all remaining rows. return dict of column name and numpy array (masked array if nullable)"
+        columns = utils.NumpyColumns(self.description)
+        columns.append_rows(self._rows)
+        self._rows.clear()
+        while self._open_query:
+            await self._fetch_query_columns(columns)
+        return columns.arrays()
+
+    async def fetch_arrow(self):
+        "Fetch all remaining rows. return pyarrow.Table"
+        import pyarrow
+        columns = utils.NumpyColumns(self.description, unscaled_decimal=True)
+        columns.append_rows(self._rows)
+        self._rows.clear()
+        while self._open_query:
+            await self._fetch_query_columns(columns)
+        return pyarrow.Table.from_batches([columns.record_batch()])
+
+    async def arrow_batches(self, n=65536):
+        "Fetch remaining rows. yield pyarrow.RecordBatch of up to n rows"
+        while True:
+            columns = utils.NumpyColumns(self.description, unscaled_decimal=True)
+            columns.append_rows([self._rows.popleft() for _ in range(min(n, len(self._rows)))])
+            while len(columns) < n and self._open_query:
+                await self._fetch_query_columns(columns)
+            if not len(columns):
+                return
+            batch = columns.record_batch()
+            for i in range(0, len(batch), n):
+                yield batch.slice(i, n)
+
+    async def iter_column_batches(self, n):
+        "Fetch remaining rows in batches of n rows. yield list of utils.Column"
+        columns = utils.new_columns(self.description)
+        if not columns:
+            return
+        while True:
+            while self._rows and len(columns[0]) < n:
+                utils.append_row(columns, self._rows.popleft())
+            if len(columns[0]) < n and self._open_query:
+                await self._fetch_query_columns(columns)
+                continue
+            while len(columns[0]) > n:
+                batch, columns = zip(*[c.split(n) for c in columns])
+                columns = list(columns)
+                yield list(batch)
+            if not len(columns[0]):
+                return
+            yield list(columns)
+            columns = utils.new_columns(self.description)
+
     async def close(self):
+        if self.connection and self.connection.is_connect():
+            await self._close_query()
         self.connection = None
 
     def __aiter__(self):
@@ -72,6 +187,6 @@ class AsyncCursor(Cursor):
 
     async def __anext__(self):
         r = await self.fetchone()
-        if not r:
+        if r is None:
             raise StopAsyncIteration()
         return r
@@ -61,14 +61,11 @@ class AsyncSocketStream:
             sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
 
     async def recv(self, nbytes):
-        "Receive up to nbytes (may return less if the peer closed the connection)"
-        received = bytearray()
-        while len(received) < nbytes:
-            chunk = await self._reader.read(nbytes - len(received))
-            if not chunk:
-                break
-            received += chunk
-        return bytes(received)
+        "Receive nbytes (may return less if the peer closed the connection)"
+        try:
+            return await self._reader.readexactly(nbytes)
+        except asyncio.IncompleteReadError as e:
+            return e.partial
 
     async def send(self, b):
         self._writer.write(b)
@@ -223,3 +223,5 @@ PRPHRCLST = 0x1905
 XIDCNT = 0x1906
 RDBRLLBCK2 = 0xC004
 DYNDTAFMT = 0x214B
+SMLDTASZ = 0x214D
+MEDDTASZ = 0x214E
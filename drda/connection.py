@@ -21,7 +21,6 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 ##############################################################################
-import io
 import socket
 import ssl
 import platform
@@ -36,206 +35,290 @@ from drda import utils
 from drda.cursor import Cursor
 
 
-def _replace_binary_params(query, args, params_description):
-    binary_param_indices = {
-        i for i, d in enumerate(params_description)
-        if d[1] == consts.DB2_SQLTYPE_NBLOB and isinstance(args[i], (bytes, bytearray))
-    }
-    if not binary_param_indices:
-        return None
-
-    rewritten_query = []
-    rewritten_args = []
-    param_index = 0
-    in_string = False
-    i = 0
-    while i < len(query):
-        c = query[i]
-        if c == "'":
-            rewritten_query.append(c)
-            if in_string and i + 1 < len(query) and query[i + 1] == "'":
-                rewritten_query.append(query[i + 1])
-                i += 2
-                continue
-            in_string = not in_string
-        elif c == '?' and not in_string:
-            if param_index >= len(args):
-                return None
-            if param_index in binary_param_indices:
-                rewritten_query.append("BLOB(X'{}')".format(bytes(args[param_index]).hex()))
+# multi-row input is sent in SQLDTAs of about this many bytes
+_EXECUTEMANY_CHAIN_SIZE = 1048576
+
+
+def _append_multi_row_execute(chain, conn, stmt, fdodsc, fdodta_list):
+    "Append EXCSQLSTT sending the rows in one SQLDTA, continued over DSS segments if it is longer than a DSS"
+    chain.append(ddm.packEXCSQLSTT(conn.pkgid, conn.pkgcnstkn, stmt.pkgsn, conn.database, len(fdodta_list)), True)
+    chain.append(ddm.packSQLDTA_rows(fdodsc, fdodta_list))
+
+
+# SQLCODEs reporting the prepared statement no longer exists in its section
+_INVALID_STATEMENT_SQLCODES = (-514, -518)
+
+
+class _SectionAllocator:
+    "Hand out and recycle section numbers of the dynamic SQL package"
+    def __init__(self, first, last):
+        self._free = collections.deque(range(first, last + 1))
+
+    def __len__(self):
+        return len(self._free)
+
+    def allocate(self):
+        from drda import OperationalError
+        if not self._free:
+            raise OperationalError(0, 0, "no free section in package")
+        return self._free.popleft()
+
+    def release(self, pkgsn):
+        self._free.append(pkgsn)
+
+
+class _Statement:
+    "Statement prepared in a package section"
+    def __init__(self, query, pkgsn, params_description, description):
+        self.query = query
+        self.pkgsn = pkgsn
+        self.params_description = params_description
+        self.description = description
+        self.in_use = False     # the section must not be released while in use
+        self._params_encoders = {}
+
+    def params_encoder(self, endian):
+        "ddm.ParamEncoder of params_description in endian byte order, compiled on the first execution"
+        encoder = self._params_encoders.get(endian)
+        if encoder is None:
+            encoder = self._params_encoders[endian] = ddm.ParamEncoder(self.params_description, endian)
+        return encoder
+
+
+class _OpenQuery:
+    "Query left open on the server, its rows are fetched on demand"
+    def __init__(self, pkgsn, options, stmt=None):
+        self.pkgsn = pkgsn
+        self.options = options      # utils.QueryOptions
+        self.stmt = stmt            # prepared statement of the query, None if not cached
+        self.qryinsid = 0
+        self.cntqry_cur_id = 1
+        self.qrydsc = None
+        self.qrydta_rest = b''
+        self.field_modes = None
+        self.make_row = None        # function(list of values) -> row, by the row_factory
+        self.is_open = False
+
+
+class _Reply:
+    """
+    Reply to a request, shared by Connection and AsyncConnection which read its DSS objects.
+    add() handles each object, next_request() is called at the end of each reply chain
+    and result() returns what the reply has.
+
+    options: utils.QueryOptions of the query, how the rows are fetched and decoded.
+    With packed or spill_size of them, rows are returned as utils.PackedRows if the query has no LOB columns.
+    LOB values are returned by lob_mode as 'value' (bytes or str), 'file' (file-like objects, see utils.lob_reader())
+    or 'locator' (fetched from the server when they are read, see utils.LobLocator).
+    With query (_OpenQuery), the reply ends after the received query blocks and the query state is kept in it.
+    With columns (list of utils.Column or utils.NumpyColumns), rows are decoded into the columns instead of results.
+    result_description: result column descriptions if the response has none
+    commit: RDBCMM is chained to the request, its ENDUOWRM does not end the query
+    """
+    def __init__(
+        self, conn, options=None, continue_on_sqldard_only=False, pkgsn=None, query=None, columns=None,
+        result_description=None, commit=False,
+    ):
+        self.conn = conn
+        self.options = query.options if query else options or utils.QueryOptions()
+        self.continue_on_sqldard_only = continue_on_sqldard_only
+        self.pkgsn = pkgsn
+        self.query, self.columns = query, columns
+        self.result_description = result_description
+        self.commit = commit
+
+        self.results = collections.deque()
+        self.params_description = None
+        self.description = None
+        self.err = self.qrydsc = None
+        self.chained = True
+        self.err_msg = None
+        self.secmec = self.sectkn = None    # ACCSECRD
+
+        self.need_cntqry = False    # set by OPNQRYRM; survives subsequent read_dss calls
+        self.qryinsid = 0           # query instance ID from OPNQRYRM, needed for CNTQRY on LOB queries
+        self.cntqry_cur_id = 1      # correlation ID to use for CNTQRY (matches the OPNQRY request)
+        self.extdta_list = []       # accumulate EXTDTA objects for LOB columns
+        self.rowcount = -1          # sum of the row counts in SQLCARDs, -1 if none of them has one
+        self.qrydta_rest = b''      # a row continued in the next query block
+        self.field_modes = self.make_row = None
+        if query:
+            self.need_cntqry, self.qryinsid, self.cntqry_cur_id = query.is_open, query.qryinsid, query.cntqry_cur_id
+            self.qrydsc, self.qrydta_rest, self.field_modes = query.qrydsc, query.qrydta_rest, query.field_modes
+            self.make_row = query.make_row
+        self.new_lob_file = utils.new_lob_file if self.options.lob_mode == 'file' else None
+
+    def add(self, dss):
+        "Handle a DSS object of the reply, (dss_type, chained, correlation_id, code_point, obj) of ddm.read_dss()"
+        _, self.chained, correlation_id, code_point, obj = dss
+        conn = self.conn
+        if code_point == cp.SQLERRRM:
+            self.err_msg = ddm.parse_reply(obj).get(cp.SRVDGN)
+        elif code_point == cp.SQLCARD:
+            n = ddm.sqlcard_rowcount(obj, conn.endian)
+            if n is not None:
+                self.rowcount = max(self.rowcount, 0) + n
+            if self.err is None:
+                self.err, _ = ddm.parse_sqlcard(obj, conn.encoding, conn.endian)
+        elif code_point == cp.SQLDARD:
+            if obj[0] == 0xFF:
+                self.err, self.params_description = ddm.parse_sqldard(
+                    obj, 'utf-8', conn.endian
+                )
+            elif self.description is None:
+                # First SQLDARD (obj[0]=0x00): result column descriptions
+                self.err, self.description = ddm.parse_sqldard(
+                    obj, 'utf-8', conn.endian
+                )
+        elif code_point == cp.OPNQRYRM:
+            self.cntqry_cur_id = correlation_id  # must match the OPNQRY request's ID
+            qryinsid_bytes = ddm.parse_reply(obj).get(cp.QRYINSID, bytes(8))
+            self.qryinsid = int.from_bytes(qryinsid_bytes, 'big')
+            # Db2 always requires CNTQRY after OPNQRYRM.
+            self.need_cntqry = True
+        elif code_point == cp.ENDQRYRM or (code_point == cp.ENDUOWRM and not self.commit):
+            self.need_cntqry = False
+        elif code_point == cp.EXTDTA:
+            self.extdta_list.append(obj)
+        elif code_point == cp.QRYDSC:
+            ln = obj[0]
+            # kept in the open query, not as a view of the receive buffer
+            b = bytes(obj[1:ln])
+            assert b[:2] == b'\x76\xd0'
+            b = b[2:]
+            # [(DRDA_TYPE_xxxx, size_binary), ...]
+            self.qrydsc = [(c[0], c[1:]) for c in [b[i:i+3] for i in range(0, len(b), 3)]]
+            result_description = self.description or self.result_description or []
+            names = [d[0] for d in result_description]
+            options = self.options
+            self.field_modes = utils.field_modes(
+                self.qrydsc, names, options.decimal_mode, options.datetime_mode, conn.lob_inline_size is not None,
+            )
+            self.make_row = options.row_factory(result_description) if options.row_factory else None
+        elif code_point == cp.QRYDTA:
+            # the rows are decoded from one copy of the block, joined to the row continued from the previous one
+            obj = self.qrydta_rest + obj if self.qrydta_rest else bytes(obj)
+            qrydsc = self.qrydsc
+            has_lob = any(t in utils.LOB_TYPES for t, _ in qrydsc)
+            if self.columns is not None:
+                self.qrydta_rest = utils.parse_qrydta_columns(
+                    qrydsc, obj, conn.endian, self.columns, self.field_modes,
+                )
+            elif (self.options.packed or self.options.spill_size is not None) and not has_lob:
+                if not isinstance(self.results, utils.PackedRows):
+                    self.results = utils.PackedRows(
+                        qrydsc, conn.endian, self.field_modes, self.options.spill_size, self.make_row,
+                    )
+                self.qrydta_rest = self.results.append_qrydta(obj)
             else:
-                rewritten_query.append(c)
-                rewritten_args.append(args[param_index])
-            param_index += 1
-        else:
-            rewritten_query.append(c)
-        i += 1
-
-    if param_index != len(args):
+                # rows with LOB values are made after they are filled in from EXTDTA
+                self.qrydta_rest = utils.parse_qrydta(
+                    qrydsc, obj, conn.endian, self.results, self.field_modes, None if has_lob else self.make_row,
+                )
+        elif code_point == cp.ACCSECRD:
+            while len(obj):
+                ln = int.from_bytes(obj[:2], byteorder='big')
+                sub_cp = int.from_bytes(obj[2:4], byteorder='big')
+                v = obj[4:ln]
+                obj = obj[ln:]
+                if sub_cp == cp.SECMEC:
+                    self.secmec = int.from_bytes(v[:2], byteorder='big')
+                elif sub_cp == cp.SECTKN:
+                    self.sectkn = bytes(v)
+        elif code_point == cp.RDBNFNRM:
+            from drda import DatabaseError
+            raise DatabaseError(0, 0, "database not found")
+
+    def next_request(self):
+        """
+        At the end of a reply chain, return (request chain, correlation id) of CNTQRY to be sent for the rest of
+        the reply, (None, None) if the rest comes without a request, or None if the reply is complete.
+        """
+        if self.need_cntqry and self.query is None:
+            chain, self.qrydsc = self.conn._cntqry_chain(self.pkgsn, self.qryinsid, self.qrydsc, self.options)
+            return chain, self.cntqry_cur_id
+        if self.continue_on_sqldard_only and self.description is not None and self.qrydsc is None:
+            # The server sent SQLDARD(s) in chain 1 as the prepare response,
+            # and is already sending chain 2 (OPNQRYRM+QRYDSC) for the OPNQRY we
+            # included in the same request.  Keep reading without sending anything.
+            return None, None
         return None
-    return ''.join(rewritten_query), rewritten_args
+
+    def _fill_lobs(self):
+        "Fill in the LOB values of the rows from EXTDTA, as locators or as inline values"
+        conn, results, qrydsc, make_row = self.conn, self.results, self.qrydsc, self.make_row
+        lob_inline = conn.lob_inline_size is not None
+        lob_col_indices = [i for i, (t, _) in enumerate(qrydsc) if t in utils.LOB_TYPES]
+        extdta_idx = 0
+        for row_idx in range(len(results)):
+            row = list(results[row_idx])
+            for col_idx in lob_col_indices:
+                t, data = qrydsc[col_idx][0], row[col_idx]
+                if data is None:
+                    continue
+                if self.options.lob_mode == 'locator' and t not in utils.INLINE_LOB_TYPES:
+                    row[col_idx] = conn._lob_locator(data, t)
+                    continue
+                if not lob_inline or data is utils.EXTDTA_VALUE:
+                    # the data is in the next EXTDTA, otherwise it was returned in QRYDTA
+                    if extdta_idx >= len(self.extdta_list):
+                        continue
+                    data = self.extdta_list[extdta_idx]
+                    extdta_idx += 1
+                if self.new_lob_file:
+                    row[col_idx] = utils.lob_reader(data, t, conn.encoding)
+                else:
+                    row[col_idx] = utils.lob_value(data, t, conn.encoding)
+            results[row_idx] = make_row(row) if make_row else tuple(row)
+
+    def result(self):
+        "return rows, description and params_description of the complete reply, raise the error it has"
+        lob_inline = self.conn.lob_inline_size is not None
+        if (self.extdta_list or self.make_row or self.options.lob_mode == 'locator' or lob_inline) and self.qrydsc and \
+                self.results and any(t in utils.LOB_TYPES for t, _ in self.qrydsc):
+            self._fill_lobs()
+
+        self.conn._sqlcard_rowcount = self.rowcount
+        if self.err:
+            raise self.err
+        query = self.query
+        if query:
+            query.qryinsid, query.cntqry_cur_id = self.qryinsid, self.cntqry_cur_id
+            query.qrydsc, query.qrydta_rest, query.field_modes = self.qrydsc, self.qrydta_rest, self.field_modes
+            query.make_row = self.make_row
+            query.is_open = self.need_cntqry
+        return self.results, self.description, self.params_description
 
 
 class Connection:
-    def _parse_response(self, continue_on_sqldard_only=False):
-        results = collections.deque()
-        params_description = None
-        description = None
-        err = qrydsc = None
-        chained = True
-        err_msg = None
-
-        more_data = False
-        need_cntqry = False  # set by OPNQRYRM; survives subsequent read_dss calls
-        qryinsid = 0         # query instance ID from OPNQRYRM, needed for CNTQRY on LOB queries
-        cntqry_cur_id = 1    # correlation ID to use for CNTQRY (matches the OPNQRY request)
-        extdta_list = []     # accumulate EXTDTA objects for LOB columns
+    def _read_reply(self, **kwargs):
+        "Read the reply to the request sent. kwargs: see _Reply. return the _Reply"
+        reply = _Reply(self, **kwargs)
         while True:
-            while chained:
-                dss_type, chained, correlation_id, code_point, obj, more_data = ddm.read_dss(self.sock)
-                _X_chained = False
-                while more_data:
-                    # server is waiting for us to request more query data
-                    # may want to check code_point here
-                    ddm.write_request_dss(
-                        self.sock,
-                        ddm.packCNTQRY(
-                            self.pkgid, self.pkgcnstkn, self.pkgsn, self.database, self.qryblksz,
-                        ),
-                        1, False, True
-                    )
-                    _X_dss_type, _X_chained, _X_correlation_id, _X_xcode_point, extra_obj, more_data = ddm.read_dss(self.sock)
-                    obj += extra_obj
-                # Drain any chained packets (e.g. ENDQRYRM, SQLCARD) after the last page
-                while _X_chained:
-                    _X_dss_type, _X_chained, _X_correlation_id, _X_code_point, _drain_obj, _ = ddm.read_dss(self.sock)
-                    if _X_code_point == cp.ENDQRYRM:
-                        need_cntqry = False
-                    elif _X_code_point == cp.SQLCARD:
-                        if err is None:
-                            err, _ = ddm.parse_sqlcard(_drain_obj, self.encoding, self.endian)
-                if code_point == cp.SQLERRRM:
-                    err_msg = ddm.parse_reply(obj).get(cp.SRVDGN)
-                elif code_point == cp.SQLCARD:
-                    if err is None:
-                        err, _ = ddm.parse_sqlcard(obj, self.encoding, self.endian)
-                elif code_point == cp.SQLDARD:
-                    if obj[0] == 0xFF:
-                        err, params_description = ddm.parse_sqldard(
-                            obj, 'utf-8', self.endian
-                        )
-                    elif description is None:
-                        # First SQLDARD (obj[0]=0x00): result column descriptions
-                        err, description = ddm.parse_sqldard(
-                            obj, 'utf-8', self.endian
-                        )
-                elif code_point == cp.OPNQRYRM:
-                    cntqry_cur_id = correlation_id  # must match the OPNQRY request's ID
-                    qryinsid_bytes = ddm.parse_reply(obj).get(cp.QRYINSID, bytes(8))
-                    qryinsid = int.from_bytes(qryinsid_bytes, 'big')
-                    # Db2 always requires CNTQRY after OPNQRYRM.
-                    need_cntqry = True
-                elif code_point in (cp.ENDQRYRM, cp.ENDUOWRM):
-                    more_data = False
-                    need_cntqry = False
-                elif code_point == cp.EXTDTA:
-                    extdta_list.append(obj)
-                elif code_point == cp.QRYDSC:
-                    ln = obj[0]
-                    b = obj[1:ln]
-                    assert b[:2] == b'\x76\xd0'
-                    b = b[2:]
-                    # [(DRDA_TYPE_xxxx, size_binary), ...]
-                    qrydsc = [(c[0], c[1:]) for c in [b[i:i+3] for i in range(0, len(b), 3)]]
-                elif code_point == cp.QRYDTA:
-                    stream = io.BytesIO(obj)
-                    try:
-                        while b := utils.read_from_stream(stream, 2):
-                            if b[0] != 0xff:
-                                break
-                            r = []
-                            for t, ps in qrydsc:
-                                v = utils.read_field(t, ps, stream, self.endian)
-                                r.append(v)
-                            results.append(tuple(r))
-                    except Exception:
-                        pass
-
-            if need_cntqry:
-                cntqry_pkt = ddm.packCNTQRY(
-                    self.pkgid, self.pkgcnstkn, self.pkgsn, self.database, self.qryblksz,
-                    qryinsid=qryinsid,
-                )
-                ddm.write_request_dss(self.sock, cntqry_pkt, cntqry_cur_id, False, True)
-                chained = True  # must read the CNTQRY response
-            elif continue_on_sqldard_only and description is not None and qrydsc is None:
-                # The server sent SQLDARD(s) in chain 1 as the prepare response,
-                # and is already sending chain 2 (OPNQRYRM+QRYDSC) for the OPNQRY we
-                # included in the same request.  Keep reading without sending anything.
-                chained = True
-            else:
-                break
-
-        if extdta_list and qrydsc and results:
-            _inline_lob_types = (
-                utils.DRDA_TYPE_LOBBYTES, utils.DRDA_TYPE_NLOBBYTES,
-                utils.DRDA_TYPE_LOBCSBCS, utils.DRDA_TYPE_NLOBCSBCS,
-            )
-            _lob_types = (
-                utils.DRDA_TYPE_LOBLOC, utils.DRDA_TYPE_NLOBLOC,
-                utils.DRDA_TYPE_CLOBLOC, utils.DRDA_TYPE_NCLOBLOC,
-                utils.DRDA_TYPE_DBCSCLOBLOC, utils.DRDA_TYPE_NDBCSCLOBLOC,
-            ) + _inline_lob_types
-            _clob_types = (
-                utils.DRDA_TYPE_CLOBLOC, utils.DRDA_TYPE_NCLOBLOC,
-                utils.DRDA_TYPE_DBCSCLOBLOC, utils.DRDA_TYPE_NDBCSCLOBLOC,
-                utils.DRDA_TYPE_LOBCSBCS, utils.DRDA_TYPE_NLOBCSBCS,
-            )
-            lob_col_indices = [i for i, (t, _) in enumerate(qrydsc) if t in _lob_types]
-            extdta_idx = 0
-            for row_idx in range(len(results)):
-                row = list(results[row_idx])
-                for col_idx in lob_col_indices:
-                    if row[col_idx] is not None and extdta_idx < len(extdta_list):
-                        data = extdta_list[extdta_idx]
-                        if qrydsc[col_idx][0] in _inline_lob_types:
-                            # EXTDTA for inline LOBs has a leading status byte (0x00 = valid)
-                            data = data[1:]
-                        if qrydsc[col_idx][0] in _clob_types:
-                            if qrydsc[col_idx][0] in _inline_lob_types:
-                                data = data.decode('utf-8')
-                            else:
-                                data = data.decode(self.encoding)
-                        row[col_idx] = data
-                        extdta_idx += 1
-                results[row_idx] = tuple(row)
-
-        if err:
-            raise err
-        return results, description, params_description
-
-    def _parse_accsecrd(self):
-        secmec = sectkn = None
-        chained = True
-        while chained:
-            dss_type, chained, correlation_id, code_point, obj, more_data = ddm.read_dss(self.sock)
-            if code_point == cp.ACCSECRD:
-                while len(obj):
-                    ln = int.from_bytes(obj[:2], byteorder='big')
-                    sub_cp = int.from_bytes(obj[2:4], byteorder='big')
-                    v = obj[4:ln]
-                    obj = obj[ln:]
-                    if sub_cp == cp.SECMEC:
-                        secmec = int.from_bytes(v[:2], byteorder='big')
-                    elif sub_cp == cp.SECTKN:
-                        sectkn = v
-            elif code_point == cp.RDBNFNRM:
-                from drda import DatabaseError
-                raise DatabaseError(0, 0, "database not found")
-
-        return secmec, sectkn
-
-    def __init__(self, host, database, port, user, password, use_ssl, ssl_client_cert_path, timeout):
+            reply.add(ddm.read_dss(self._recv_buf, reply.new_lob_file))
+            if reply.chained:
+                continue
+            request = reply.next_request()
+            if request is None:
+                return reply
+            chain, cur_id = request
+            if chain:
+                ddm.write_request_chain(self.sock, chain, cur_id)
+
+    def _parse_response(self, **kwargs):
+        "Read the reply to the request sent. kwargs: see _Reply. return rows, description and params_description"
+        return self._read_reply(**kwargs).result()
+
+    def _request(self, chain, **kwargs):
+        "Send the request chain and read the reply. return _parse_response()"
+        ddm.write_request_chain(self.sock, chain)
+        return self._parse_response(**kwargs)
+
+    def _setup(
+        self, host, database, port, user, password, *, qryblksz, maxblkext, qryrowset, stmt_cache_size, autocommit,
+        decimal_mode, datetime_mode, spill_size, row_factory, lob_mode, lob_inline_size,
+    ):
+        "Check the arguments and set the attributes of a connection, before it connects"
         self.host = host
         self.database = (database + ' ' * 18)[:18]
         self.port = port
@@ -248,10 +331,98 @@ class Connection:
         self.prdid = 'SQL12010'
         self.pkgid = 'SYSSH200'
         self.pkgcnstkn = 'SYSLVL01'
-        self.pkgsn = 65
-        self.qryblksz = 65535
+        self.pkgsn = 65     # section for EXCSQLIMM
+        self._sections = _SectionAllocator(1, 64)   # sections for prepared statements and queries
+        if not consts.QRYBLKSZ_MIN <= qryblksz <= consts.QRYBLKSZ_MAX:
+            raise ValueError("qryblksz must be between {} and {}".format(consts.QRYBLKSZ_MIN, consts.QRYBLKSZ_MAX))
+        self.qryblksz = qryblksz
+        if not -1 <= maxblkext <= 32767:
+            raise ValueError("maxblkext must be between -1 (unlimited) and 32767")
+        if qryrowset is not None and not 1 <= qryrowset <= 32767:
+            raise ValueError("qryrowset must be between 1 and 32767")
+        self.maxblkext = maxblkext
+        self.qryrowset = qryrowset
+        self.stmt_cache_size = stmt_cache_size
+        self._stmt_cache = collections.OrderedDict()    # query -> _Statement (LRU order)
+        self.autocommit = autocommit
+        self._in_transaction = False    # autocommit is suspended by begin()
+        modes = decimal_mode.values() if isinstance(decimal_mode, dict) else [decimal_mode]
+        if any(m not in utils.DECIMAL_MODES for m in modes):
+            raise ValueError("decimal_mode must be one of {} or a dict of column name and them".format(utils.DECIMAL_MODES))
+        self.decimal_mode = decimal_mode
+        modes = datetime_mode.values() if isinstance(datetime_mode, dict) else [datetime_mode]
+        if any(m not in utils.DATETIME_MODES for m in modes):
+            raise ValueError("datetime_mode must be one of {} or a dict of column name and them".format(utils.DATETIME_MODES))
+        self.datetime_mode = datetime_mode
+        if spill_size is not None and spill_size < 0:
+            raise ValueError("spill_size must be a non-negative number of bytes")
+        self.spill_size = spill_size
+        self.row_factory = row_factory
+        if lob_mode not in utils.LOB_MODES:
+            raise ValueError("lob_mode must be one of {}".format(utils.LOB_MODES))
+        self.lob_mode = lob_mode
+        if lob_inline_size is not None and not 0 <= lob_inline_size <= 0x7FFFFFFF:
+            raise ValueError("lob_inline_size must be a non-negative number of bytes")
+        self.lob_inline_size = lob_inline_size
         self.private_key = secmec9.get_private()
 
+    def _accsec_public_key(self):
+        if self.secmec == consts.SECMEC_EUSRIDPWD:
+            return secmec9.calc_public(self.private_key).to_bytes(32, byteorder='big')
+        return None
+
+    def _accsec_chain(self):
+        "EXCSAT and ACCSEC request chain starting the connection"
+        chain = ddm.RequestChain()
+        chain.append(ddm.packEXCSAT(self, [
+            cp.AGENT, 10,
+            cp.SQLAM, 11,
+            cp.CMNTCPIP, 5,
+            cp.RDB, 12,
+            cp.SECMGR, 9,
+            cp.UNICODEMGR, 1208,
+        ]))
+        chain.append(ddm.packACCSEC(self.database, self.secmec, self._accsec_public_key()))
+        return chain
+
+    def _accrdb_chain(self, secmec, sectkn):
+        "SECCHK and ACCRDB request chain for the reply to ACCSEC, with ACCSEC again if the server chose secmec"
+        chain = ddm.RequestChain()
+        if secmec != self.secmec:
+            self.secmec = secmec
+            chain.append(ddm.packACCSEC(self.database, self.secmec, self._accsec_public_key()))
+        chain.append(ddm.packSECCHK(
+            secmec,
+            sectkn,
+            self.private_key,
+            self.database,
+            self.user,
+            self.password,
+            self.encoding
+        ))
+        chain.append(ddm.packACCRDB(self.prdid, self.database, self.encoding))
+        return chain
+
+    def _set_variables_chain(self):
+        lc_type = locale.getlocale()[0]
+        if lc_type is None:
+            lc_type = "en_US"
+        chain = ddm.RequestChain()
+        chain.append(ddm.packEXCSAT_MGRLVLLS([cp.CCSIDMGR, 1208]))
+        chain.append(ddm.packEXCSQLSET(self.pkgid, None, 1, self.database), True)
+        chain.append(ddm.packSQLSTT("SET CLIENT WRKSTNNAME '{}'".format(platform.node())), True)
+        chain.append(ddm.packSQLSTT("SET CURRENT LOCALE LC_CTYPE='{}'".format(lc_type)))
+        chain.append(ddm.packRDBCMM())
+        return chain
+
+    def __init__(self, host, database, port, user, password, use_ssl, ssl_client_cert_path, timeout, *, qryblksz=65535, maxblkext=-1, qryrowset=None, stmt_cache_size=32, autocommit=True, decimal_mode='decimal', datetime_mode='datetime', spill_size=None, row_factory=None, lob_mode='value', lob_inline_size=None):
+        self._setup(
+            host, database, port, user, password, qryblksz=qryblksz, maxblkext=maxblkext, qryrowset=qryrowset,
+            stmt_cache_size=stmt_cache_size, autocommit=autocommit, decimal_mode=decimal_mode,
+            datetime_mode=datetime_mode, spill_size=spill_size, row_factory=row_factory, lob_mode=lob_mode,
+            lob_inline_size=lob_inline_size,
+        )
+
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
         if timeout is not None:
@@ -267,68 +438,11 @@ class Connection:
             # Required by ssl.PROTOCOL_TLS_CLIENT (check_hostname=True).
             self.sock = context.wrap_socket(self.sock, server_hostname=self.host)
         self.sock.connect((self.host, self.port))
+        self._recv_buf = ddm.ReceiveBuffer(self.sock)
 
-        cur_id = 1
-        cur_id = ddm.write_request_dss(
-            self.sock,
-            ddm.packEXCSAT(self, [
-                cp.AGENT, 10,
-                cp.SQLAM, 11,
-                cp.CMNTCPIP, 5,
-                cp.RDB, 12,
-                cp.SECMGR, 9,
-                cp.UNICODEMGR, 1208,
-            ]),
-            cur_id, False, False
-        )
-
-        cur_id = ddm.write_request_dss(
-            self.sock,
-            ddm.packACCSEC(
-                self.database,
-                self.secmec,
-                secmec9.calc_public(self.private_key).to_bytes(32, byteorder='big')
-                if self.secmec == consts.SECMEC_EUSRIDPWD else None
-            ),
-            cur_id, False, True
-        )
-
-        secmec, sectkn = self._parse_accsecrd()
-
-        cur_id = 1
-        if secmec != self.secmec:
-            self.secmec = secmec
-            cur_id = ddm.write_request_dss(
-                self.sock,
-                ddm.packACCSEC(
-                    self.database,
-                    self.secmec,
-                    secmec9.calc_public(self.private_key).to_bytes(32, byteorder='big')
-                    if self.secmec == consts.SECMEC_EUSRIDPWD else None
-                ),
-                cur_id, False, False
-            )
-
-        cur_id = ddm.write_request_dss(
-            self.sock,
-            ddm.packSECCHK(
-                secmec,
-                sectkn,
-                self.private_key,
-                self.database,
-                self.user,
-                self.password,
-                self.encoding
-            ),
-            cur_id, False, False
-        )
-        cur_id = ddm.write_request_dss(
-            self.sock,
-            ddm.packACCRDB(self.prdid, self.database, self.encoding),
-            cur_id, False, True
-        )
-
-        self._parse_response()
+        ddm.write_request_chain(self.sock, self._accsec_chain())
+        reply = self._read_reply()
+        self._request(self._accrdb_chain(reply.secmec, reply.sectkn))
 
         self._set_variables()
 
@@ -339,200 +453,407 @@ class Connection:
         self.close()
 
     def _set_variables(self):
-        lc_type = locale.getlocale()[0]
-        if lc_type is None:
-            lc_type = "en_US"
-        cur_id = 1
-        cur_id = ddm.write_request_dss(
-            self.sock,
-            ddm.packEXCSAT_MGRLVLLS([cp.CCSIDMGR, 1208]),
-            cur_id, False, False
-        )
-        cur_id = ddm.write_request_dss(
-            self.sock,
-            ddm.packEXCSQLSET(self.pkgid, None, 1, self.database),
-            cur_id, True, False
-        )
-        cur_id = ddm.write_request_dss(
-            self.sock,
-            ddm.packSQLSTT("SET CLIENT WRKSTNNAME '{}'".format(platform.node())),
-            cur_id, True, False
-        )
-        cur_id = ddm.write_request_dss(
-            self.sock,
-            ddm.packSQLSTT("SET CURRENT LOCALE LC_CTYPE='{}'".format(lc_type)),
-            cur_id, False, False
-        )
-        cur_id = ddm.write_request_dss(
-            self.sock,
-            ddm.packRDBCMM(),
-            cur_id, False, True
-        )
-        self._parse_response()
+        self._request(self._set_variables_chain())
 
-    def _execute(self, query, args):
-        if args:
-            cur_id = 1
-            cur_id = ddm.write_request_dss(
-                self.sock,
-                ddm.packPRPSQLSTT(self.pkgid, self.pkgcnstkn, self.pkgsn, self.database),
-                cur_id, True, False
-            )
-            cur_id = ddm.write_request_dss(
-                self.sock,
-                ddm.packSQLSTT(query),
-                cur_id, False, False
-            )
-            cur_id = ddm.write_request_dss(
-                self.sock,
-                ddm.packDSCSQLSTT(self.pkgid, self.pkgcnstkn, self.pkgsn, self.database),
-                cur_id, False, True
-            )
-            _, _, params_description = self._parse_response()
+    def _commit_each_statement(self):
+        return self.autocommit and not self._in_transaction
 
-            replaced = _replace_binary_params(query, args, params_description)
-            if replaced:
-                return self._execute(*replaced)
+    def _allocate_section(self):
+        "Allocate a section, evicting least recently used statements if all are in use"
+        while not len(self._sections):
+            stmt = next((stmt for stmt in self._stmt_cache.values() if not stmt.in_use), None)
+            if stmt is None:
+                break
+            self._uncache_statement(stmt)
+        return self._sections.allocate()
+
+    def _cached_statement(self, query):
+        stmt = self._stmt_cache.get(query)
+        if stmt:
+            self._stmt_cache.move_to_end(query)
+        return stmt
+
+    def _cache_statement(self, stmt):
+        if self.stmt_cache_size <= 0:
+            return
+        if stmt.query in self._stmt_cache:
+            self._uncache_statement(self._stmt_cache[stmt.query])
+        while len(self._stmt_cache) >= self.stmt_cache_size:
+            self._uncache_statement(next(iter(self._stmt_cache.values())))
+        self._stmt_cache[stmt.query] = stmt
+
+    def _uncache_statement(self, stmt):
+        if self._stmt_cache.get(stmt.query) is stmt:
+            del self._stmt_cache[stmt.query]
+            if not stmt.in_use:
+                self._sections.release(stmt.pkgsn)
+
+    def _release_statement(self, stmt):
+        "Statement is no longer in use. Release its section unless it is kept in the cache"
+        if not stmt.in_use:
+            return
+        stmt.in_use = False
+        if self._stmt_cache.get(stmt.query) is not stmt:
+            self._sections.release(stmt.pkgsn)
+
+    def _use_cached_statement(self, query):
+        "the cached statement of query marked in use, None if it is not cached or already in use"
+        stmt = self._cached_statement(query)
+        if stmt and not stmt.in_use:
+            stmt.in_use = True
+            return stmt
+        return None
 
-            cur_id = 1
-            cur_id = ddm.write_request_dss(
-                self.sock,
-                ddm.packEXCSQLSTT(self.pkgid, self.pkgcnstkn, self.pkgsn, self.database),
-                cur_id, True, False
-            )
-            cur_id = ddm.write_request_dss(
-                self.sock,
-                ddm.packSQLDTA(params_description, args, self.endian),
-                cur_id, False, False
-            )
+    def _prepare_chain(self, query, pkgsn):
+        chain = ddm.RequestChain()
+        chain.append(ddm.packPRPSQLSTT(self.pkgid, self.pkgcnstkn, pkgsn, self.database), True)
+        chain.append(ddm.packSQLSTT(query))
+        chain.append(ddm.packDSCSQLSTT(self.pkgid, self.pkgcnstkn, pkgsn, self.database))
+        return chain
+
+    def _new_statement(self, query, pkgsn, description, params_description):
+        "Statement prepared in section pkgsn, in use and cached"
+        stmt = _Statement(query, pkgsn, params_description, description)
+        stmt.in_use = True
+        self._cache_statement(stmt)
+        return stmt
+
+    def _prepare(self, query):
+        "Prepare and describe query. return statement and whether it came from the cache"
+        stmt = self._use_cached_statement(query)
+        if stmt:
+            return stmt, True
+        pkgsn = self._allocate_section()
+        try:
+            _, description, params_description = self._request(self._prepare_chain(query, pkgsn))
+        except Exception:
+            self._sections.release(pkgsn)
+            raise
+        return self._new_statement(query, pkgsn, description, params_description), False
+
+    def _drop_invalidated(self, e, stmt, cached):
+        """
+        True if the cached statement was invalidated on the server (OperationalError e),
+        then it is uncached and its section is released to prepare the query again
+        """
+        if not cached or e.sqlcode not in _INVALID_STATEMENT_SQLCODES:
+            return False
+        self._uncache_statement(stmt)
+        self._release_statement(stmt)
+        return True
+
+    def _execute_chain(self, stmt, args):
+        chain = ddm.RequestChain()
+        chain.append(ddm.packEXCSQLSTT(self.pkgid, self.pkgcnstkn, stmt.pkgsn, self.database), True)
+        ddm.append_sqldta(chain, stmt.params_description, args, self.endian, stmt.params_encoder(self.endian))
+        if self._commit_each_statement():
+            chain.append(ddm.packRDBCMM())
+        return chain
+
+    def _execute_immediate_chain(self, query):
+        chain = ddm.RequestChain()
+        chain.append(ddm.packEXCSQLIMM(self.pkgid, self.pkgcnstkn, self.pkgsn, self.database), True)
+        chain.append(ddm.packSQLSTT(query))
+        if self._commit_each_statement():
+            chain.append(ddm.packRDBCMM())
+        return chain
 
-            cur_id = 1
-            cur_id = ddm.write_request_dss(
-                self.sock,
-                ddm.packRDBCMM(),
-                cur_id, False, True
-            )
-            self._parse_response()
+    def _execute(self, query, args):
+        from drda import OperationalError
+        if args:
+            stmt, cached = self._prepare(query)
+            try:
+                try:
+                    self._request(self._execute_chain(stmt, args))
+                except OperationalError as e:
+                    if not self._drop_invalidated(e, stmt, cached):
+                        raise
+                    # prepared statement was invalidated on the server, prepare it again and retry once
+                    stmt, _ = self._prepare(query)
+                    self._request(self._execute_chain(stmt, args))
+            finally:
+                self._release_statement(stmt)
         else:
-            cur_id = 1
-            cur_id = ddm.write_request_dss(
-                self.sock,
-                ddm.packEXCSQLIMM(
-                    self.pkgid,
-                    self.pkgcnstkn,
-                    self.pkgsn,
-                    self.database
-                ),
-                cur_id, True, False
-            )
-            cur_id = ddm.write_request_dss(
-                self.sock,
-                ddm.packSQLSTT(query),
-                cur_id, False, False
-            )
-            cur_id = ddm.write_request_dss(
-                self.sock,
-                ddm.packRDBCMM(),
-                cur_id, False, True
-            )
-            self._parse_response()
-
-    def _query(self, query, args):
+            self._request(self._execute_immediate_chain(query))
+        return self._sqlcard_rowcount
+
+    def _execute_batch_chain(self, stmt, fdodta_list, args):
+        "request chain of a batch of _executemany_batches()"
+        if args is not None:
+            return self._execute_chain(stmt, args)
+        chain = ddm.RequestChain()
+        _append_multi_row_execute(chain, self, stmt, stmt.params_encoder(self.endian).fdodsc, fdodta_list)
+        return chain
+
+    def _execute_batch(self, query, stmt, cached, fdodta_list, args):
+        """
+        Execute a batch of _executemany_batches() on the prepared statement.
+        return the statement, prepared again if it was invalidated, and the row count
+        """
+        from drda import OperationalError
+        try:
+            self._request(self._execute_batch_chain(stmt, fdodta_list, args))
+        except OperationalError as e:
+            if not self._drop_invalidated(e, stmt, cached):
+                raise
+            # prepared statement was invalidated on the server, prepare it again and retry once
+            stmt, _ = self._prepare(query)
+            try:
+                self._request(self._execute_batch_chain(stmt, fdodta_list, args))
+            except Exception:
+                self._release_statement(stmt)
+                raise
+        return stmt, self._sqlcard_rowcount
+
+    def _executemany_batches(self, stmt, seq_of_params):
+        """
+        Plan of executemany on stmt. yield (fdodta_list, None) of rows sent as multi-row input in one SQLDTA,
+        or (None, args) of a row executed alone
+        """
+        encoder = stmt.params_encoder(self.endian)
+        fdodta_list = []
+        size = 0
+        for args in seq_of_params:
+            if not args or ddm.has_lob_params(stmt.params_description, args):
+                # can't be sent as multi-row input
+                if fdodta_list:
+                    yield fdodta_list, None
+                    fdodta_list, size = [], 0
+                yield None, args
+                continue
+            fdodta = encoder.fdodta(args)
+            fdodta_list.append(fdodta)
+            size += len(fdodta)
+            if size >= _EXECUTEMANY_CHAIN_SIZE:
+                yield fdodta_list, None
+                fdodta_list, size = [], 0
+        if fdodta_list:
+            yield fdodta_list, None
+
+    def _executemany(self, query, seq_of_params):
+        "Prepare once and execute with multi-row input. committed once at the end. return the row count"
+        commit = self._commit_each_statement()
+        in_transaction, self._in_transaction = self._in_transaction, True
+        rowcount = 0
+        try:
+            stmt, cached = self._prepare(query)
+            try:
+                for fdodta_list, args in self._executemany_batches(stmt, seq_of_params):
+                    stmt, n = self._execute_batch(query, stmt, cached, fdodta_list, args)
+                    cached = False
+                    rowcount += max(n, 0)
+            finally:
+                self._release_statement(stmt)
+        except Exception:
+            self._in_transaction = in_transaction
+            if commit:
+                self.rollback()
+            raise
+        self._in_transaction = in_transaction
+        if commit:
+            self.commit()
+        return rowcount
+
+    def _query_commit(self, options, commit):
+        "whether the query is committed"
+        from drda import ProgrammingError
+        if options.lob_mode == 'locator' and self._commit_each_statement():
+            raise ProgrammingError(0, 0, "lob_mode='locator' needs a transaction, use autocommit=False or begin()")
+        return commit and self._commit_each_statement()
+
+    def _opnqry_chain(self, stmt, args, options, commit):
+        "OPNQRY of prepared statement with the parameters. with commit, RDBCMM is chained to it"
+        chain = ddm.RequestChain()
+        chain.append(ddm.packOPNQRY_with_params(
+            self.pkgid, self.pkgcnstkn, stmt.pkgsn, self.database, self.qryblksz, options.maxblkext, options.qryrowset,
+            self.lob_inline_size,
+        ), True)
+        ddm.append_sqldta(chain, stmt.params_description, args, self.endian, stmt.params_encoder(self.endian))
+        if commit:
+            # the cursor of the package is held over the commit
+            chain.append(ddm.packRDBCMM())
+        return chain
+
+    def _prepare_opnqry_chain(self, query, pkgsn, options):
+        # Send all three together so Db2 includes EXTDTA (LOB data) in the
+        # same response chain.  Sending OPNQRY separately causes Db2 to omit
+        # EXTDTA, resulting in empty BLOB/CLOB/XML values.
+        chain = ddm.RequestChain()
+        chain.append(ddm.packPRPSQLSTT(self.pkgid, self.pkgcnstkn, pkgsn, self.database), True)
+        chain.append(ddm.packSQLSTT(query))
+        chain.append(ddm.packOPNQRY(
+            self.pkgid, self.pkgcnstkn, pkgsn, self.database, self.qryblksz, options.maxblkext, options.qryrowset,
+            self.lob_inline_size,
+        ))
+        return chain
+
+    def _open_prepared_query(self, stmt, args, options, streaming, commit):
+        "OPNQRY of the prepared statement. return rows and the query, left open on the server if streaming"
+        open_query = _OpenQuery(stmt.pkgsn, options, stmt)
+        rows, _, _ = self._request(
+            self._opnqry_chain(stmt, args, options, commit),
+            options=options, pkgsn=stmt.pkgsn, query=open_query if streaming else None,
+            result_description=stmt.description, commit=commit,
+        )
+        return rows, open_query
+
+    def _query(self, query, args, options=None, streaming=False, commit=True):
+        """
+        return rows, description and the open query to fetch the rest of rows from (streaming only).
+        options: utils.QueryOptions
+        commit=False: the statement is not committed even with autocommit
+        """
+        from drda import OperationalError
+        options = options or utils.QueryOptions()
+        commit = self._query_commit(options, commit)
         if args:
-            cur_id = 1
-            cur_id = ddm.write_request_dss(
-                self.sock,
-                ddm.packPRPSQLSTT(self.pkgid, self.pkgcnstkn, self.pkgsn, self.database),
-                cur_id, True, False
-            )
-            cur_id = ddm.write_request_dss(
-                self.sock,
-                ddm.packSQLSTT(query),
-                cur_id, False, False
-            )
-            cur_id = ddm.write_request_dss(
-                self.sock,
-                ddm.packDSCSQLSTT(self.pkgid, self.pkgcnstkn, self.pkgsn, self.database),
-                cur_id, False, True
-            )
-            _, description, params_description = self._parse_response()
-
-            replaced = _replace_binary_params(query, args, params_description)
-            if replaced:
-                return self._query(*replaced)
-
-            sqldta = ddm.packSQLDTA(params_description, args, self.endian)
-
-            cur_id = 1
-            cur_id = ddm.write_request_dss(
-                self.sock,
-                ddm.packOPNQRY_with_params(
-                    self.pkgid, self.pkgcnstkn, self.pkgsn, self.database, self.qryblksz,
-                ),
-                cur_id, True, False
-            )
-            cur_id = ddm.write_request_dss(
-                self.sock,
-                sqldta,
-                cur_id, False, True
-            )
-            rows, _, _ = self._parse_response()
-
-            cur_id = 1
-            cur_id = ddm.write_request_dss(
-                self.sock,
-                ddm.packRDBCMM(),
-                cur_id, False, True
-            )
-            _, _, _ = self._parse_response()
-
-            return rows, description
+            stmt, cached = self._prepare(query)
+            open_query = None
+            # the commit is chained to the query unless it is left open
+            chain_commit = commit and not streaming
+            try:
+                try:
+                    rows, open_query = self._open_prepared_query(stmt, args, options, streaming, chain_commit)
+                except OperationalError as e:
+                    if not self._drop_invalidated(e, stmt, cached):
+                        raise
+                    # prepared statement was invalidated on the server, prepare it again and retry once
+                    stmt, _ = self._prepare(query)
+                    rows, open_query = self._open_prepared_query(stmt, args, options, streaming, chain_commit)
+            finally:
+                if not (open_query and open_query.is_open):
+                    self._release_statement(stmt)
+            if open_query.is_open:
+                return rows, stmt.description, open_query
+            if commit and not chain_commit:
+                # streaming query ended in the first reply
+                self.commit()
+            return rows, stmt.description, None
         else:
-            # Send all three together so Db2 includes EXTDTA (LOB data) in the
-            # same response chain.  Sending OPNQRY separately causes Db2 to omit
-            # EXTDTA, resulting in empty BLOB/CLOB/XML values.
-            # continue_on_sqldard_only=True handles the rare case where Db2 sends
-            # SQLDARD(s) in a separate chain before OPNQRYRM+QRYDSC.
-            cur_id = 1
-            cur_id = ddm.write_request_dss(
-                self.sock,
-                ddm.packPRPSQLSTT(self.pkgid, self.pkgcnstkn, self.pkgsn, self.database),
-                cur_id, True, False
-            )
-            cur_id = ddm.write_request_dss(
-                self.sock,
-                ddm.packSQLSTT(query),
-                cur_id, False, False
-            )
-            cur_id = ddm.write_request_dss(
-                self.sock,
-                ddm.packOPNQRY(self.pkgid, self.pkgcnstkn, self.pkgsn, self.database, self.qryblksz),
-                cur_id, False, True
-            )
-            rows, description, _ = self._parse_response(continue_on_sqldard_only=True)
-            return rows, description
+            pkgsn = self._allocate_section()
+            open_query = _OpenQuery(pkgsn, options)
+            try:
+                # continue_on_sqldard_only=True handles the rare case where Db2 sends
+                # SQLDARD(s) in a separate chain before OPNQRYRM+QRYDSC.
+                rows, description, _ = self._request(
+                    self._prepare_opnqry_chain(query, pkgsn, options),
+                    options=options, continue_on_sqldard_only=True, pkgsn=pkgsn,
+                    query=open_query if streaming else None,
+                )
+            finally:
+                if not open_query.is_open:
+                    self._sections.release(pkgsn)
+            return rows, description, open_query if open_query.is_open else None
+
+    def _release_query(self, query):
+        if query.stmt:
+            self._release_statement(query.stmt)
+        else:
+            self._sections.release(query.pkgsn)
+
+    def _cntqry_chain(self, pkgsn, qryinsid, qrydsc, options):
+        """
+        return CNTQRY request chain and qrydsc of the rows it returns. options: utils.QueryOptions
+        With lob_mode='locator', OUTOVR is sent with the first CNTQRY to return locators instead of LOB values.
+        """
+        chain = ddm.RequestChain()
+        cntqry_pkt = ddm.packCNTQRY(
+            self.pkgid, self.pkgcnstkn, pkgsn, self.database, self.qryblksz,
+            qryinsid=qryinsid, maxblkext=options.maxblkext, qryrowset=options.qryrowset,
+        )
+        if options.lob_mode == 'locator' and qrydsc and any(t in utils.INLINE_LOB_TYPES for t, _ in qrydsc):
+            qrydsc = utils.locator_qrydsc(qrydsc)
+            chain.append(cntqry_pkt, True)
+            chain.append(ddm.packOUTOVR(qrydsc))
+        else:
+            chain.append(cntqry_pkt)
+        return chain, qrydsc
+
+    def _fetch_query_chain(self, query):
+        "CNTQRY request chain for the next query blocks of the open query"
+        chain, query.qrydsc = self._cntqry_chain(query.pkgsn, query.qryinsid, query.qrydsc, query.options)
+        return chain
+
+    def _query_ended(self, query):
+        "Release the query which ended on the server. return True if its statement is to be committed"
+        self._release_query(query)
+        return query.stmt is not None and self._commit_each_statement()
+
+    def _close_query_chain(self, query):
+        chain = ddm.RequestChain()
+        chain.append(ddm.packCLSQRY(self.pkgid, self.pkgcnstkn, query.pkgsn, self.database, query.qryinsid))
+        if query.stmt and self._commit_each_statement():
+            chain.append(ddm.packRDBCMM())
+        return chain
+
+    def _close_chain(self):
+        chain = ddm.RequestChain()
+        if self.autocommit:
+            # work after begin() is committed too, like every statement
+            chain.append(ddm.packRDBCMM())
+        else:
+            # uncommitted work is discarded
+            chain.append(ddm.packRDBRLLBCK())
+        return chain
+
+    def _lob_locator(self, locator, t):
+        return utils.lob_locator(self, locator, t, self.encoding)
+
+    def _lob_length(self, lob):
+        "length in bytes of the LOB value of utils.LobLocator"
+        rows, _, _ = self._query(utils.lob_length_sql(lob.type), [lob], commit=False)
+        return rows[0][0]
+
+    def _lob_substr(self, lob, pos, n):
+        "n bytes from pos of the LOB value of utils.LobLocator"
+        rows, _, _ = self._query(utils.lob_substr_sql(lob.type), [lob, pos + 1, n], commit=False)
+        return rows[0][0]
+
+    def _fetch_query(self, query, columns=None):
+        "Fetch the next query blocks of the open query. return rows, or decode them into columns"
+        ddm.write_request_chain(self.sock, self._fetch_query_chain(query), query.cntqry_cur_id)
+        try:
+            rows, _, _ = self._parse_response(query=query, columns=columns)
+        except Exception:
+            query.is_open = False
+            self._release_query(query)
+            raise
+        if not query.is_open and self._query_ended(query):
+            self.commit()
+        return rows
+
+    def _close_query(self, query):
+        "Close the query before all rows are fetched"
+        if not query.is_open:
+            return
+        query.is_open = False
+        try:
+            self._request(self._close_query_chain(query))
+        finally:
+            self._release_query(query)
 
     def is_connect(self):
         return bool(self.sock)
 
-    def cursor(self):
-        return Cursor(self)
+    def cursor(self, streaming=False, packed=False):
+        return Cursor(self, streaming, packed)
 
     def begin(self):
-        self._execute("START TRANSACTION", [])
+        "Suspend autocommit until the next commit() or rollback()"
+        self._in_transaction = True
 
     def commit(self):
-        self._execute("COMMIT", [])
+        chain = ddm.RequestChain()
+        chain.append(ddm.packRDBCMM())
+        self._request(chain)
+        self._in_transaction = False
 
     def rollback(self):
-        self._execute("ROLLBACK", [])
+        chain = ddm.RequestChain()
+        chain.append(ddm.packRDBRLLBCK())
+        self._request(chain)
+        self._in_transaction = False
 
     def close(self):
-        cur_id = 1
-        cur_id = ddm.write_request_dss(
-            self.sock,
-            ddm.packRDBCMM(),
-            cur_id, False, True
-        )
-        self._parse_response()
+        self._request(self._close_chain())
         self.sock.close()
@@ -108,3 +108,7 @@ SECMEC_USRENCPWD = 7
 SECMEC_USRSSBPWD = 8
 SECMEC_EUSRIDPWD = 9
 SECMEC_EUSRIDNWPWD = 10
+
+# DRDA query block size limits (QRYBLKSZ)
+QRYBLKSZ_MIN = 512
+QRYBLKSZ_MAX = 10485760
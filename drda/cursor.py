@@ -22,15 +22,36 @@
 # SOFTWARE.
 ##############################################################################
 
+from drda import utils
+
 
 class Cursor:
-    def __init__(self, connection):
+    def __init__(self, connection, streaming=False, packed=False):
         self.connection = connection
         self.description = []
         self._rows = []
+        # streaming: rows are fetched from the server as they are consumed
+        self.streaming = streaming
+        # packed: rows are kept as received and decoded on access (utils.PackedRows)
+        self.packed = packed
+        self._open_query = None
         self._rowcount = -1
         self.arraysize = 1
         self.query = None
+        # prefetch: extra query blocks and rows per OPNQRY/CNTQRY round trip
+        self.maxblkext = connection.maxblkext
+        self.qryrowset = connection.qryrowset
+        # DECIMAL values as 'decimal', 'int' (unscaled) or 'float', or a dict of column name and them
+        self.decimal_mode = connection.decimal_mode
+        # DATE/TIME/TIMESTAMP values as 'datetime', 'str' or 'epoch', or a dict of column name and them
+        self.datetime_mode = connection.datetime_mode
+        # rows buffered over spill_size bytes are moved to a temporary file (None: no limit)
+        self.spill_size = connection.spill_size
+        # function(description) -> function(list of values) -> row, tuples if None (see utils.named_row())
+        self.row_factory = connection.row_factory
+        # LOB values as 'value' (bytes or str), 'file' (file-like objects) or 'locator'
+        # (fetched when they are read, needs a transaction: autocommit=False or begin())
+        self.lob_mode = connection.lob_mode
 
     def __enter__(self):
         return self
@@ -52,24 +73,48 @@ class Cursor:
     def setoutputsize(size, column=None):
         pass
 
+    def _query_options(self):
+        return utils.QueryOptions(
+            self.maxblkext, self.qryrowset, self.decimal_mode, self.datetime_mode,
+            self.packed, self.spill_size, self.row_factory, self.lob_mode,
+        )
+
+    def _close_query(self):
+        if self._open_query:
+            self.connection._close_query(self._open_query)
+            self._open_query = None
+
+    def _fill_rows(self):
+        "Fetch the next query blocks when the buffered rows ran out"
+        while not self._rows and self._open_query:
+            self._rows = self.connection._fetch_query(self._open_query)
+            if not self._open_query.is_open:
+                self._open_query = None
+
     def execute(self, query, args=[]):
+        self._close_query()
         self.query = query
+        self._rowcount = -1
         if query.strip().split()[0].upper() == 'SELECT':
-            self._rows, self.description = self.connection._query(self.query, args)
+            self._rows, self.description, self._open_query = self.connection._query(
+                self.query, args, self._query_options(), streaming=self.streaming,
+            )
         else:
-            self.connection._execute(self.query, args)
+            self._rowcount = self.connection._execute(self.query, args)
 
     def executemany(self, query, seq_of_params):
-        rowcount = 0
-        for params in seq_of_params:
-            self.execute(query, params)
-            rowcount += self._rowcount
-        self._rowcount = rowcount
+        if query.strip().split()[0].upper() == 'SELECT':
+            for params in seq_of_params:
+                self.execute(query, params)
+            return
+        self.query = query
+        self._rowcount = self.connection._executemany(self.query, seq_of_params)
 
     def fetchone(self):
         from drda import OperationalError
         if not self.connection or not self.connection.is_connect():
             raise OperationalError(u"08003:Lost connection")
+        self._fill_rows()
         if len(self._rows):
             return self._rows.popleft()
         return None
@@ -78,17 +123,110 @@ class Cursor:
         rs = []
         for i in range(size):
             r = self.fetchone()
-            if not r:
+            if r is None:
                 break
             rs.append(r)
         return rs
 
     def fetchall(self):
-        r = list(self._rows)
-        self._rows.clear()
+        rows = self.fetchall_packed()
+        if isinstance(rows, utils.PackedRows):
+            r = list(rows)
+            rows.clear()    # release the query blocks and the temporary file
+            return r
+        return rows
+
+    def fetchall_packed(self):
+        "Fetch all remaining rows. return utils.PackedRows with packed=True, list otherwise or for LOB queries"
+        r = self._rows
+        if not isinstance(r, utils.PackedRows):
+            r = list(r)
+        self._rows = []
+        while self._open_query:
+            self._fill_rows()
+            if not self._rows:
+                continue
+            if isinstance(r, utils.PackedRows) and not isinstance(self._rows, utils.PackedRows):
+                r = list(r)
+            r.extend(self._rows)
+            self._rows = []
         return r
 
+    def _fetch_query_columns(self, columns):
+        "Decode the next query blocks into columns"
+        query = self._open_query
+        if any(t in utils.LOB_TYPES for t, _ in query.qrydsc):
+            # LOB values are filled in from EXTDTA after the rows are decoded
+            utils.append_rows(columns, self.connection._fetch_query(query))
+        else:
+            self.connection._fetch_query(query, columns)
+        if not query.is_open:
+            self._open_query = None
+
+    def fetch_columns(self):
+        "Fetch all remaining rows. return list of utils.Column"
+        columns = utils.new_columns(self.description)
+        while self._rows:
+            utils.append_row(columns, self._rows.popleft())
+        while self._open_query:
+            self._fetch_query_columns(columns)
+        return columns
+
+    def fetch_numpy(self):
+        "Fetch all remaining rows. return dict of column name and numpy array (masked array if nullable)"
+        columns = utils.NumpyColumns(self.description)
+        columns.append_rows(self._rows)
+        self._rows.clear()
+        while self._open_query:
+            self._fetch_query_columns(columns)
+        return columns.arrays()
+
+    def fetch_arrow(self):
+        "Fetch all remaining rows. return pyarrow.Table"
+        import pyarrow
+        columns = utils.NumpyColumns(self.description, unscaled_decimal=True)
+        columns.append_rows(self._rows)
+        self._rows.clear()
+        while self._open_query:
+            self._fetch_query_columns(columns)
+        return pyarrow.Table.from_batches([columns.record_batch()])
+
+    def arrow_batches(self, n=65536):
+        "Fetch remaining rows. yield pyarrow.RecordBatch of up to n rows"
+        while True:
+            columns = utils.NumpyColumns(self.description, unscaled_decimal=True)
+            columns.append_rows([self._rows.popleft() for _ in range(min(n, len(self._rows)))])
+            while len(columns) < n and self._open_query:
+                self._fetch_query_columns(columns)
+            if not len(columns):
+                return
+            batch = columns.record_batch()
+            for i in range(0, len(batch), n):
+                yield batch.slice(i, n)
+
+    def iter_column_batches(self, n):
+        "Fetch remaining rows in batches of n rows. yield list of utils.Column"
+        columns = utils.new_columns(self.description)
+        if not columns:
+            return
+        while True:
+            while self._rows and len(columns[0]) < n:
+                utils.append_row(columns, self._rows.popleft())
+            if len(columns[0]) < n and self._open_query:
+                self._fetch_query_columns(columns)
+                continue
+            while len(columns[0]) > n:
+                batch, columns = zip(*[c.split(n) for c in columns])
+                columns = list(columns)
+                yield list(batch)
+            if not len(columns[0]):
+                return
+            yield list(columns)
+            columns = utils.new_columns(self.description)
+
     def close(self):
+        if self.connection and self.connection.is_connect():
+            self._close_query()
         self.connection = None
 
     @property
@@ -104,6 +242,6 @@ class Cursor:
 
     def __next__(self):
         r = self.fetchone()
-        if not r:
+        if r is None:
             raise StopIteration()
         return r
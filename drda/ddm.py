@@ -24,30 +24,53 @@
 import platform
 import binascii
 import decimal
+import io
 import struct
 import drda
 from drda import codepoint as cp
 from drda import consts
 from drda import secmec9
 
-
-def _recv_from_sock(sock, nbytes, max_attempts=16):
-    n = nbytes
-    attempts = 0
-    received = bytearray() # mutable
-    while n > 0 and attempts < max_attempts:
-        bs = sock.recv(n)
-        if len(bs) > 0:
-            received += bs
-            n -= len(bs)
-            attempts = 0
-        else:
-            attempts += 1
-    return received
+_DSS_HEADER = struct.Struct('>HBBH')    # length, 0xD0, flag, correlation id
+_DSS_REPLY_HEADER = struct.Struct('>HBBHHH')    # DSS header + object length, code point
+
+
+class ReceiveBuffer:
+    """
+    Buffered socket reader. read() returns memoryview slices of the buffer.
+    A slice keeps the whole buffer alive, so what outlives the reply is copied out of it.
+    """
+    def __init__(self, sock, bufsize=65536):
+        self.sock = sock
+        self.bufsize = bufsize
+        self._buf = memoryview(bytearray(bufsize))
+        self._pos = 0   # start of unread data
+        self._end = 0   # end of received data
+
+    def _fill(self, nbytes):
+        if self._pos + nbytes > len(self._buf):
+            # Not enough room left. Move unread data to a new buffer, slices
+            # handed out before keep referencing the old one.
+            buf = memoryview(bytearray(max(self.bufsize, nbytes)))
+            n = self._end - self._pos
+            buf[:n] = self._buf[self._pos:self._end]
+            self._buf, self._pos, self._end = buf, 0, n
+        while self._end - self._pos < nbytes:
+            n = self.sock.recv_into(self._buf[self._end:])
+            if n == 0:
+                raise ConnectionError("connection closed by peer")
+            self._end += n
+
+    def read(self, nbytes):
+        "Read nbytes. return memoryview"
+        self._fill(nbytes)
+        v = self._buf[self._pos:self._pos+nbytes]
+        self._pos += nbytes
+        return v
 
 
 def _send_to_sock(sock, b):
-    sock.send(b)
+    sock.sendall(b)
 
 
 def _pack_null_string(v, enc):
@@ -66,6 +89,10 @@ def _pack_uint(code_point, v, size):
     return _pack_binary(code_point, v.to_bytes(size, byteorder='big'))
 
 
+def _pack_int(code_point, v, size):
+    return _pack_binary(code_point, v.to_bytes(size, byteorder='big', signed=True))
+
+
 def _pack_str(code_point, v, enc):
     return _pack_binary(code_point, v.encode(enc))
 
@@ -74,7 +101,7 @@ def parse_string(b):
     "parse VCM or VCS"
     ln = int.from_bytes(b[:2], byteorder='big')
     if ln:
-        data = b[2:2+ln]
+        data = bytes(b[2:2+ln])
         try:
             s = data.decode('utf-8')
         except UnicodeDecodeError:
@@ -97,9 +124,17 @@ def parse_name(b):
     return s1 or s2, b
 
 
+def _object_header(code_point, ln):
+    "length and code point of a DDM object of ln bytes, with an extended length field if it is longer than 32767"
+    if ln + 4 <= 0x7FFF:
+        return (ln+4).to_bytes(2, byteorder='big') + code_point.to_bytes(2, byteorder='big')
+    n = 4 if ln <= 0x7FFFFFFF else 8
+    return (0x8004 + n).to_bytes(2, byteorder='big') + code_point.to_bytes(2, byteorder='big') + ln.to_bytes(n, byteorder='big')
+
+
 def pack_dss_object(code_point, o):
     "pack to DSS packet"
-    return (len(o)+4).to_bytes(2, byteorder='big') + code_point.to_bytes(2, byteorder='big') + o
+    return _object_header(code_point, len(o)) + o
 
 
 def parse_reply(obj):
@@ -129,7 +164,7 @@ def parse_sqlcard(obj, enc, endian):
 
     rest = obj[36+18:]
     ln = int.from_bytes(rest[:2], byteorder='big')
-    sqlrdbname = rest[2:2+ln].decode('utf-8')
+    sqlrdbname = bytes(rest[2:2+ln]).decode('utf-8')
     rest = rest[2+ln:]
 
     ln = int.from_bytes(rest[:2], byteorder='big')
@@ -140,11 +175,11 @@ def parse_sqlcard(obj, enc, endian):
     sqlerrmsg_s = rest[2:2+ln]
     rest = rest[2+ln:]
 
-    raw_message = sqlerrmsg_m or sqlerrmsg_s
+    raw_message = bytes(sqlerrmsg_m or sqlerrmsg_s)
     try:
-        sqlstate = obj[5:10].decode('ascii')
-    except (UnicodeDecodeError, AttributeError):
-        sqlstate = str(obj[5:10])
+        sqlstate = bytes(obj[5:10]).decode('ascii')
+    except UnicodeDecodeError:
+        sqlstate = str(bytes(obj[5:10]))
 
     if raw_message:
         try:
@@ -167,6 +202,13 @@ def parse_sqlcard(obj, enc, endian):
     return err, rest
 
 
+def sqlcard_rowcount(obj, endian):
+    "number of rows the statement affected (SQLERRD3) in SQLCARD, None if the SQLCA is null"
+    if obj[0] == 0xff:
+        return None
+    return int.from_bytes(obj[27:31], byteorder=endian, signed=True)
+
+
 def _parse_column_db2(b, endian, has_name):
     precision = int.from_bytes(b[:2], byteorder=endian)
     scale = int.from_bytes(b[2:4], byteorder=endian)
@@ -211,63 +253,254 @@ def parse_sqldard(obj, enc, endian):
     return err, description
 
 
-def read_dss(sock):
-    "Read one DSS packet from socket"
-    b = _recv_from_sock(sock, 6)
-
-    if len(b) != 6 or b[2] != 0xD0:
+def parse_dss_header(b):
+    "Parse DSS header and object length, code point"
+    if len(b) != 10 or b[2] != 0xD0:
         raise ConnectionError(f"invalid DSS packet from socket:{binascii.hexlify(b).decode('utf-8')}")
-
-    dss_ln = int.from_bytes(b[:2], byteorder='big')
-    dss_type = b[3] & 0b1111
-    chained = b[3] & 0b01000000
-    correlation_id = int.from_bytes(b[4:6],  byteorder='big')
-    obj_ln = int.from_bytes(_recv_from_sock(sock, 2), byteorder='big')
-    code_point = int.from_bytes(_recv_from_sock(sock, 2), byteorder='big')
-    more_data = False
-
-    if dss_ln == 0xFFFF:
-        assert code_point == 0x241B     # QRYDTA
-        assert obj_ln == 32772      # 0x8004 protocol magic
-        obj = _recv_from_sock(sock, 32757)   # 0x7fff - 6 - 4
-        # !! assumes there is only 1 additional "page".. not sure what controls this
-        # !! worried it depends on QRYBLKSZ (which is 65535 below)
-        next_ln = int.from_bytes(_recv_from_sock(sock, 2), byteorder='big')
-        extra = _recv_from_sock(sock, next_ln-2)
-        obj += extra
-        if next_ln == 0x7ffe:
-            more_data = True
+    dss_ln, _, flag, correlation_id, obj_ln, code_point = _DSS_REPLY_HEADER.unpack(b)
+    dss_type = flag & 0b1111
+    chained = flag & 0b01000000
+    return dss_ln, dss_type, chained, correlation_id, obj_ln, code_point
+
+
+def _extended_length_object(obj, obj_ln):
+    "Strip extended length field of an object longer than 32767 bytes"
+    n = (obj_ln & 0x7FFF) - 4     # size of the extended length field
+    if n == 0:
+        # length is not specified: the object lasts to the end of the DSS
+        return obj
+    ln = int.from_bytes(obj[:n], byteorder='big')
+    return obj[n:n+ln]
+
+
+class _ObjectSpool:
+    "Writes an object longer than 32767 bytes to a file, segment by segment"
+    def __init__(self, f, obj_ln):
+        self.f = f
+        self.n = (obj_ln & 0x7FFF) - 4 if obj_ln & 0x8000 else 0    # size of the extended length field
+        self.rest = None    # bytes of the object to be written, None if the object lasts to the end of the DSS
+
+    def write(self, page):
+        if self.n:
+            self.rest = int.from_bytes(page[:self.n], byteorder='big')
+            page = page[self.n:]
+            self.n = 0
+        if self.rest is not None:
+            page = page[:self.rest]
+            self.rest -= len(page)
+        self.f.write(page)
+
+    def close(self):
+        self.f.seek(0)
+        return self.f
+
+
+def dss_reader(new_file=None):
+    """
+    Generator parsing one DSS packet, shared by the sync and async readers.
+    It yields the number of bytes to be read next and is sent them, and returns
+    (dss_type, chained, correlation_id, code_point, obj).
+    With new_file (function returning a binary file), EXTDTA longer than a DSS segment is written
+    to the file and it is returned as the object.
+    """
+    dss_ln, dss_type, chained, correlation_id, obj_ln, code_point = parse_dss_header((yield 10))
+
+    if dss_ln & 0x8000:
+        # continued in segments of 2 bytes length and data
+        spool = _ObjectSpool(new_file(), obj_ln) if new_file and code_point == cp.EXTDTA else None
+        pages = []
+        write = spool.write if spool else pages.append
+        write((yield 0x7FFF - 10))
+        continued = True
+        while continued:
+            ln = int.from_bytes((yield 2), byteorder='big')
+            continued = ln & 0x8000
+            write((yield (0x7FFF if continued else ln) - 2))
+        if spool:
+            return dss_type, chained, correlation_id, code_point, spool.close()
+        obj = memoryview(b''.join(pages))
     else:
-        obj = _recv_from_sock(sock, obj_ln - 4)
-        if (len(obj) != dss_ln - 10) or (obj_ln != dss_ln - 6):
-            raise ConnectionError("invalid DSS packet from socket")
-        assert len(obj) == (obj_ln - 4)
+        obj = yield dss_ln - 10
 
-    return dss_type, chained, correlation_id, code_point, obj, more_data
+    if obj_ln & 0x8000:
+        obj = _extended_length_object(obj, obj_ln)
+    elif obj_ln != dss_ln - 6:
+        raise ConnectionError("invalid DSS packet from socket")
 
+    return dss_type, chained, correlation_id, code_point, obj
 
-def write_request_dss(sock, o, cur_id, next_dss_has_same_id, last_packet):
-    "Write request DSS packets"
-    code_point = int.from_bytes(o[2:4], byteorder='big')
-    _send_to_sock(sock, (len(o)+6).to_bytes(2, byteorder='big'))
-    if code_point in (cp.SQLSTT, cp.SQLATTR, cp.SQLDTA, cp.EXTDTA):
+
+def read_dss(buf, new_file=None):
+    "Read one DSS packet from ReceiveBuffer. new_file: see dss_reader()"
+    reader = dss_reader(new_file)
+    n = next(reader)
+    try:
+        while True:
+            n = reader.send(buf.read(n))
+    except StopIteration as e:
+        return e.value
+
+
+def _request_dss_flag(o, next_dss_has_same_id, last_packet):
+    code_point = cp.EXTDTA if isinstance(o, LobParam) else int.from_bytes(o[2:4], byteorder='big')
+    if code_point in (cp.SQLSTT, cp.SQLATTR, cp.SQLDTA, cp.EXTDTA, cp.OUTOVR):
         flag = 3    # DSS object
     else:
         flag = 1    # DSS request
     if not last_packet:
         flag |= 0b01000000
     if next_dss_has_same_id:
-        next_id = cur_id
         flag |= 0b00010000
-    else:
-        next_id = cur_id + 1
-    _send_to_sock(sock, bytes([0xD0, flag]))
-    _send_to_sock(sock, cur_id.to_bytes(2, byteorder='big'))
-    _send_to_sock(sock, o)
-    cur_id = next_id
+    return flag
+
+
+_DSS_OBJECT_MAX = 0x7FFF - 6     # object in one DSS, a longer one is continued in segments
+_SEGMENT_DATA_MAX = 0x7FFF - 2   # data of a DSS continuation segment
+
+
+def _pack_dss(o, flag, cur_id):
+    "DSS packet of object o, in continued segments of 2 bytes length and data if it is longer than a DSS"
+    if len(o) <= _DSS_OBJECT_MAX:
+        return _DSS_HEADER.pack(len(o)+6, 0xD0, flag, cur_id) + o
+    buf = bytearray(_DSS_HEADER.pack(0xFFFF, 0xD0, flag, cur_id))
+    buf += o[:_DSS_OBJECT_MAX]
+    pos = _DSS_OBJECT_MAX
+    while pos < len(o):
+        n = min(len(o) - pos, _SEGMENT_DATA_MAX)
+        buf += (0xFFFF if pos + n < len(o) else n + 2).to_bytes(2, byteorder='big')
+        buf += o[pos:pos+n]
+        pos += n
+    return buf
+
+
+def pack_request_dss(o, cur_id, next_dss_has_same_id, last_packet):
+    "Pack one request DSS packet. return packet bytes and next correlation id"
+    flag = _request_dss_flag(o, next_dss_has_same_id, last_packet)
+    next_id = cur_id if next_dss_has_same_id else cur_id + 1
+    return _pack_dss(o, flag, cur_id), next_id
+
+
+def write_request_dss(sock, o, cur_id, next_dss_has_same_id, last_packet):
+    "Write request DSS packets"
+    b, cur_id = pack_request_dss(o, cur_id, next_dss_has_same_id, last_packet)
+    _send_to_sock(sock, b)
     return cur_id
 
 
+class LobParam:
+    """
+    LOB parameter value, sent as EXTDTA after the SQLDTA.
+    v is bytes-like, str (encoded to UTF-8) or a readable file object.
+    Files which are not seekable or are text files are spooled to a temporary file to get their size.
+    """
+    def __init__(self, v):
+        if isinstance(v, str):
+            v = v.encode('utf-8')
+        if isinstance(v, (bytes, bytearray, memoryview)):
+            self.data = memoryview(v).cast('B')
+            self.size = len(self.data)
+            return
+        if isinstance(v, io.TextIOBase) or not v.seekable():
+            from drda import utils
+            f = utils.new_lob_file()
+            while True:
+                chunk = v.read(_LOB_CHUNK_SIZE)
+                if not chunk:
+                    break
+                f.write(chunk.encode('utf-8') if isinstance(chunk, str) else chunk)
+            f.seek(0)
+            v = f
+        pos = v.tell()
+        self.size = v.seek(0, io.SEEK_END) - pos
+        v.seek(pos)
+        self.data = v
+
+    def read(self, n):
+        "next n bytes of the value"
+        if isinstance(self.data, memoryview):
+            b, self.data = self.data[:n], self.data[n:]
+        else:
+            b = self.data.read(n)
+        if len(b) != n:
+            raise ValueError("LOB parameter is shorter than its size")
+        return b
+
+
+_LOB_CHUNK_SIZE = _SEGMENT_DATA_MAX
+
+
+def _pack_extdta_segments(lob, flag, cur_id):
+    "DSS segments of EXTDTA of a nullable LOB parameter, read from the LobParam on demand"
+    size = lob.size + 1     # a leading null indicator
+    head = _object_header(cp.EXTDTA, size) + b'\x00'
+    if len(head) + lob.size <= _DSS_OBJECT_MAX:
+        yield _DSS_HEADER.pack(len(head) + lob.size + 6, 0xD0, flag, cur_id) + head + lob.read(lob.size)
+        return
+    # an extended length object in continued DSS segments
+    rest = len(head) - 1 + size
+    yield _DSS_HEADER.pack(0xFFFF, 0xD0, flag, cur_id) + head + lob.read(_DSS_OBJECT_MAX - len(head))
+    rest -= _DSS_OBJECT_MAX
+    while rest:
+        n = min(rest, _SEGMENT_DATA_MAX)
+        rest -= n
+        yield (0xFFFF if rest else n + 2).to_bytes(2, byteorder='big') + lob.read(n)
+
+
+class RequestChain:
+    """
+    Chained request DSS packets, packed into one buffer and sent with one write.
+    LobParam objects are sent as EXTDTA segments read on demand, in buffers of about bufsize bytes.
+    """
+    bufsize = 1048576
+
+    def __init__(self):
+        self.objects = []   # [(DDM object or LobParam, next_dss_has_same_id), ...]
+
+    def append(self, o, next_dss_has_same_id=False):
+        self.objects.append((o, next_dss_has_same_id))
+
+    def pack(self, cur_id=1):
+        buf = bytearray(sum(len(o) + 6 for o, _ in self.objects))
+        pos = 0
+        last = len(self.objects) - 1
+        for i, (o, next_dss_has_same_id) in enumerate(self.objects):
+            flag = _request_dss_flag(o, next_dss_has_same_id, i == last)
+            _DSS_HEADER.pack_into(buf, pos, len(o)+6, 0xD0, flag, cur_id)
+            buf[pos+6:pos+6+len(o)] = o
+            pos += len(o) + 6
+            if not next_dss_has_same_id:
+                cur_id += 1
+        return buf
+
+    def buffers(self, cur_id=1):
+        "packed DSS packets to be sent. one buffer if there is no LobParam"
+        if not any(isinstance(o, LobParam) or len(o) > _DSS_OBJECT_MAX for o, _ in self.objects):
+            yield self.pack(cur_id)
+            return
+        buf = bytearray()
+        last = len(self.objects) - 1
+        for i, (o, next_dss_has_same_id) in enumerate(self.objects):
+            if isinstance(o, LobParam):
+                flag = _request_dss_flag(o, next_dss_has_same_id, i == last)
+                for segment in _pack_extdta_segments(o, flag, cur_id):
+                    buf += segment
+                    if len(buf) >= self.bufsize:
+                        yield buf
+                        buf = bytearray()
+            else:
+                flag = _request_dss_flag(o, next_dss_has_same_id, i == last)
+                buf += _pack_dss(o, flag, cur_id)
+            if not next_dss_has_same_id:
+                cur_id += 1
+        yield buf
+
+
+def write_request_chain(sock, chain, cur_id=1):
+    "Write all request DSS packets of the chain at once, LOB parameters in buffers of chain.bufsize"
+    for b in chain.buffers(cur_id):
+        _send_to_sock(sock, b)
+
+
 def packEXCSAT(conn, mgrlvlls):
     b = b''
     for p in mgrlvlls:
@@ -338,6 +571,10 @@ def packRDBCMM():
     return pack_dss_object(cp.RDBCMM, bytes())
 
 
+def packRDBRLLBCK():
+    return pack_dss_object(cp.RDBRLLBCK, bytes())
+
+
 def _packPKGNAMCSN(database, pkgid, pkgcnstkn, pkgsn):
     b = ("%-18s%-18s%-18s" % (database, "NULLID", pkgid)).encode('utf-8')
     if pkgcnstkn is None:
@@ -350,12 +587,12 @@ def _packPKGNAMCSN(database, pkgid, pkgcnstkn, pkgsn):
     )
 
 
-def packEXCSQLSTT(pkgid, pkgcnstkn, pkgsn, database):
-    return pack_dss_object(
-        cp.EXCSQLSTT,
-        _packPKGNAMCSN(database, pkgid, pkgcnstkn, pkgsn) +
-        _pack_binary(cp.RDBCMTOK, bytes([241]))
-    )
+def packEXCSQLSTT(pkgid, pkgcnstkn, pkgsn, database, nbrrow=None):
+    b = _packPKGNAMCSN(database, pkgid, pkgcnstkn, pkgsn) + _pack_binary(cp.RDBCMTOK, bytes([241]))
+    if nbrrow is not None:
+        # multi-row input: number of rows in the SQLDTA
+        b += _pack_uint(cp.NBRROW, nbrrow, 4)
+    return pack_dss_object(cp.EXCSQLSTT, b)
 
 
 def packEXCSQLIMM(pkgid, pkgcnstkn, pkgsn, database):
@@ -413,7 +650,8 @@ def _fdodsc(description):
     elif sqltype == consts.DB2_SQLTYPE_NBOOLEAN:
         return bytes([0xBF, 0x00, 0x01])
     elif sqltype == consts.DB2_SQLTYPE_NBLOB:
-        return bytes([0xC9, 0x80, 0x02])
+        # LOB bytes, the value is sent in EXTDTA and FDODTA has its 4 bytes length
+        return bytes([0xC9, 0x80, 0x04])
     elif sqltype in (consts.DB2_SQLTYPE_BINARY, consts.DB2_SQLTYPE_NBINARY):
         return bytes([0x27, (sqllength >> 8) & 0xff, sqllength & 0xff])
     elif sqltype in (consts.DB2_SQLTYPE_VARBINARY, consts.DB2_SQLTYPE_NVARBINARY):
@@ -421,7 +659,12 @@ def _fdodsc(description):
     elif sqltype in (consts.DB2_SQLTYPE_XML, consts.DB2_SQLTYPE_NXML):
         return binascii.unhexlify(b'393fff')
     elif sqltype == consts.DB2_SQLTYPE_NCLOB:
-        return binascii.unhexlify(b'393fff')
+        # LOB mixed byte characters (UTF-8) in EXTDTA
+        return bytes([0xCF, 0x80, 0x04])
+    elif sqltype == consts.DB2_SQLTYPE_NBLOB_LOCATOR:
+        return bytes([0x19, 0x00, 0x04])
+    elif sqltype == consts.DB2_SQLTYPE_NCLOB_LOCATOR:
+        return bytes([0x1B, 0x00, 0x04])
     elif sqltype == consts.DB2_SQLTYPE_NDECFLOAT:
         return bytes([0xBB, 0x00, sqllength])
     elif sqltype == consts.DB2_SQLTYPE_NROWID:
@@ -489,9 +732,12 @@ def _fdodta(description, v, endian='little'):
         return b'\x00' + len(v).to_bytes(2, byteorder='big') + v.encode('utf_16_be')
     elif sqltype == consts.DB2_SQLTYPE_NBOOLEAN:
         return b'\x00' + bytes([1 if v else 0])
-    elif sqltype == consts.DB2_SQLTYPE_NBLOB:
-        v = bytes(v)
-        return b'\x00' + len(v).to_bytes(2, byteorder='big')
+    elif sqltype in (consts.DB2_SQLTYPE_NBLOB_LOCATOR, consts.DB2_SQLTYPE_NCLOB_LOCATOR):
+        return b'\x00' + _lob_locator(v).locator
+    elif sqltype in _LOB_PARAM_TYPES:
+        if not isinstance(v, LobParam):
+            v = LobParam(v)
+        return b'\x00' + v.size.to_bytes(4, byteorder='big')
     elif sqltype in (consts.DB2_SQLTYPE_BINARY, consts.DB2_SQLTYPE_NBINARY):
         v = bytes(v)
         v = (v + b'\x00' * sqllength)[:sqllength]
@@ -502,9 +748,6 @@ def _fdodta(description, v, endian='little'):
     elif sqltype in (consts.DB2_SQLTYPE_XML, consts.DB2_SQLTYPE_NXML):
         v = str(v)
         return b'\x00' + len(v).to_bytes(2, byteorder='big') + v.encode('utf_16_be')
-    elif sqltype == consts.DB2_SQLTYPE_NCLOB:
-        v = str(v)
-        return b'\x00' + len(v).to_bytes(2, byteorder='big') + v.encode('utf_16_be')
     elif sqltype == consts.DB2_SQLTYPE_NDECFLOAT:
         from .utils import _encode_dfp
         return b'\x00' + _encode_dfp(v, sqllength)
@@ -515,64 +758,238 @@ def _fdodta(description, v, endian='little'):
         raise ValueError("_fdodta():Unknown type {}".format(sqltype))
 
 
-def packSQLDTA(params_desc, params, endian):
-    ln = len(params)
-    assert ln == len(params_desc)
+def _struct_encoder(fmt, convert):
+    pack = struct.Struct(fmt).pack
 
-    fdodsc = bytes([(1 + ln) * 3]) + binascii.unhexlify(b'76d0')
-    fdodta = b''
+    def encode(buf, v):
+        if v is None:
+            buf.append(0xff)
+        else:
+            buf.append(0)
+            buf += pack(convert(v))
+    return encode
+
+
+def _str_encoder(buf, v):
+    if v is None:
+        buf.append(0xff)
+        return
+    buf.append(0)
+    if isinstance(v, (bytes, bytearray)):
+        buf += len(v).to_bytes(2, byteorder='big')
+        buf += v
+    else:
+        v = str(v)
+        buf += len(v).to_bytes(2, byteorder='big')
+        buf += v.encode('utf_16_be')
+
+
+def _fdodta_encoder(description, endian):
+    """
+    function(buf, v) appending FDODTA of a parameter value to bytearray buf.
+    The same bytes as _fdodta(), the common types without the type dispatch
+    """
+    _, sqltype, sqllength, _, _, _, _ = description
+    fmt = '>' if endian == 'big' else '<'
+    if sqltype == consts.DB2_SQLTYPE_NINTEGER:
+        return _struct_encoder(fmt + 'i', int)
+    elif sqltype == consts.DB2_SQLTYPE_NSMALL:
+        return _struct_encoder(fmt + 'h', int)
+    elif sqltype == consts.DB2_SQLTYPE_NBIGINT:
+        return _struct_encoder(fmt + 'q', int)
+    elif sqltype == consts.DB2_SQLTYPE_NFLOAT and sqllength in (4, 8):
+        return _struct_encoder(fmt + ('f' if sqllength == 4 else 'd'), float)
+    elif sqltype in (consts.DB2_SQLTYPE_NVARCHAR, consts.DB2_SQLTYPE_NCHAR):
+        return _str_encoder
+
+    def encode(buf, v):
+        buf += _fdodta(description, v, endian)
+    return encode
+
+
+class ParamEncoder:
+    """
+    Parameter encoder of a prepared statement, compiled once from its params_description.
+    fdodsc is the packed FDODSC, fdodta() and sqldta() pack the values of one row in endian byte order.
+    """
+    def __init__(self, params_desc, endian):
+        self.params_desc = params_desc
+        self.endian = endian
+        self.fdodsc = packFDODSC(params_desc)
+        self._encoders = [_fdodta_encoder(d, endian) for d in params_desc]
+
+    def _pack_fdodta(self, buf, params):
+        "append FDODTA of params to buf"
+        assert len(params) == len(self._encoders)
+        start = len(buf)
+        buf += bytes(5)     # DDM header and a pad byte
+        for encode, v in zip(self._encoders, params):
+            encode(buf, v)
+        n = len(buf) - start - 5
+        if (len(self.fdodsc) + n) % 2:
+            n += 1          # prepend the pad byte: existing behavior for variable-length types
+        else:
+            del buf[start]
+        buf[start:start+4] = _object_header(cp.FDODTA, n)
+
+    def fdodta(self, params):
+        "FDODTA of one row"
+        buf = bytearray()
+        self._pack_fdodta(buf, params)
+        return buf
+
+    def sqldta(self, params):
+        "SQLDTA of one row"
+        buf = bytearray(4)
+        buf += self.fdodsc
+        self._pack_fdodta(buf, params)
+        buf[0:4] = _object_header(cp.SQLDTA, len(buf) - 4)
+        return buf
+
+
+def packFDODSC(params_desc):
+    fdodsc = bytes([(1 + len(params_desc)) * 3]) + binascii.unhexlify(b'76d0')
+    for d in params_desc:
+        fdodsc += _fdodsc(d)
+    fdodsc += binascii.unhexlify(b'0671e4d00001')
+    return pack_dss_object(cp.FDODSC, fdodsc)
 
-    for i in range(ln):
-        dsc_bytes = _fdodsc(params_desc[i])
-        dta_bytes = _fdodta(params_desc[i], params[i])
-        fdodsc += dsc_bytes
-        fdodta += dta_bytes
 
+def packFDODTA(params_desc, params, endian, fdodsc):
+    "FDODTA of one row. fdodsc is the packed FDODSC the row is sent with"
+    assert len(params) == len(params_desc)
+    fdodta = b''.join([_fdodta(d, v, endian) for d, v in zip(params_desc, params)])
     if (len(fdodsc) + len(fdodta)) % 2:
         fdodta = b'\x00' + fdodta   # prepend: existing behavior for variable-length types
+    return pack_dss_object(cp.FDODTA, fdodta)
 
-    fdodsc += binascii.unhexlify(b'0671e4d00001')
 
-    return pack_dss_object(
-        cp.SQLDTA,
-        pack_dss_object(cp.FDODSC, fdodsc) +
-        pack_dss_object(cp.FDODTA, fdodta)
-    )
+def packSQLDTA_rows(fdodsc, fdodta_list):
+    "SQLDTA of multi-row input. one FDODTA for each row"
+    return pack_dss_object(cp.SQLDTA, fdodsc + b''.join(fdodta_list))
+
+
+def packSQLDTA(params_desc, params, endian):
+    return ParamEncoder(params_desc, endian).sqldta(params)
+
+
+def packOUTOVR(qrydsc):
+    "OUTOVR to override the output format of the query to qrydsc [(DRDA_TYPE_xxxx, size_binary), ...]"
+    b = bytes([(1 + len(qrydsc)) * 3]) + binascii.unhexlify(b'76d0')
+    b += b''.join(bytes([t]) + bytes(ps) for t, ps in qrydsc)
+    b += binascii.unhexlify(b'0671e4d00001')
+    return pack_dss_object(cp.OUTOVR, b)
 
 
 def packEXTDTA(data):
     return pack_dss_object(cp.EXTDTA, bytes(data))
 
 
-def packOPNQRY_with_params(pkgid, pkgcnstkn, pkgsn, database, qryblksz):
+_LOB_PARAM_TYPES = (consts.DB2_SQLTYPE_NBLOB, consts.DB2_SQLTYPE_NCLOB)
+
+
+def has_lob_params(params_desc, params):
+    "True if params have LOB values, which are sent in EXTDTA or as locators"
+    return any(d[1] in _LOB_PARAM_TYPES and v is not None for d, v in zip(params_desc, params))
+
+
+def _lob_locator(v):
+    "utils.LobLocator (or AsyncLobLocator) of v, or of the text file it is in. None if v is not a locator"
+    from .utils import LobLocator, AsyncLobLocator
+    if isinstance(v, io.TextIOWrapper):
+        v = getattr(v.buffer, 'raw', None)
+    return v if isinstance(v, (LobLocator, AsyncLobLocator)) else None
+
+
+def _locator_description(d, lob):
+    from .utils import CLOB_TYPES
+    sqltype = consts.DB2_SQLTYPE_NCLOB_LOCATOR if lob.type in CLOB_TYPES else consts.DB2_SQLTYPE_NBLOB_LOCATOR
+    return (d[0], sqltype, 4, d[3], 0, 0, d[6])
+
+
+def append_sqldta(chain, params_desc, params, endian, encoder=None):
+    """
+    Append SQLDTA of params and EXTDTA of their LOB values to chain.
+    LOB locators are sent as locator parameters.
+    encoder: ParamEncoder of params_desc and endian
+    """
+    if any(d[1] in _LOB_PARAM_TYPES and _lob_locator(v) for d, v in zip(params_desc, params)):
+        params_desc = [
+            _locator_description(d, _lob_locator(v)) if d[1] in _LOB_PARAM_TYPES and _lob_locator(v) else d
+            for d, v in zip(params_desc, params)
+        ]
+        encoder = None
+    params = [
+        LobParam(v) if d[1] in _LOB_PARAM_TYPES and v is not None and not isinstance(v, LobParam) else v
+        for d, v in zip(params_desc, params)
+    ]
+    lobs = [v for v in params if isinstance(v, LobParam)]
+    encoder = encoder or ParamEncoder(params_desc, endian)
+    chain.append(encoder.sqldta(params), bool(lobs))
+    for i, lob in enumerate(lobs):
+        chain.append(lob, i < len(lobs) - 1)
+
+
+def _pack_prefetch(maxblkext, qryrowset):
+    "MAXBLKEXT (extra query blocks per request) and QRYROWSET (rows per request)"
+    b = _pack_int(cp.MAXBLKEXT, maxblkext, 2)
+    # QRYROWSET of a non-scrollable cursor is optional for the server, send it only when it is asked for
+    if qryrowset is not None:
+        b += _pack_uint(cp.QRYROWSET, qryrowset, 4)
+    return b
+
+
+def _pack_dyndtafmt(smldtasz):
+    """
+    DYNDTAFMT (dynamic data format), and with smldtasz, the maximum size of LOB values returned in QRYDTA.
+    Larger LOB values are returned in EXTDTA, never as progressive references.
+    """
+    b = _pack_binary(cp.DYNDTAFMT, bytes([0xf1]))
+    if smldtasz is not None:
+        b += _pack_uint(cp.SMLDTASZ, smldtasz, 4) + _pack_uint(cp.MEDDTASZ, 0x7FFFFFFF, 4)
+    return b
+
+
+def packOPNQRY_with_params(pkgid, pkgcnstkn, pkgsn, database, qryblksz, maxblkext=-1, qryrowset=None, smldtasz=None):
     return pack_dss_object(
         cp.OPNQRY,
         _packPKGNAMCSN(database, pkgid, pkgcnstkn, pkgsn) +
         _pack_uint(cp.QRYBLKSZ, qryblksz, 4) +
-        _pack_uint(cp.MAXBLKEXT, qryblksz, 2) +
+        _pack_prefetch(maxblkext, qryrowset) +
         _pack_binary(cp.QRYCLSIMP, bytes([0x01])) +
-        _pack_binary(cp.DYNDTAFMT, bytes([0xf1]))
+        _pack_dyndtafmt(smldtasz)
     )
 
 
-def packOPNQRY(pkgid, pkgcnstkn, pkgsn, database, qryblksz):
+def packOPNQRY(pkgid, pkgcnstkn, pkgsn, database, qryblksz, maxblkext=-1, qryrowset=None, smldtasz=None):
     return pack_dss_object(
         cp.OPNQRY,
         _packPKGNAMCSN(database, pkgid, pkgcnstkn, pkgsn) +
         _pack_uint(cp.QRYBLKSZ, qryblksz, 4) +
-        _pack_uint(cp.MAXBLKEXT, qryblksz, 2) +
-        _pack_binary(cp.QRYCLSIMP, bytes([0x01]))
+        _pack_prefetch(maxblkext, qryrowset) +
+        _pack_binary(cp.QRYCLSIMP, bytes([0x01])) +
+        (_pack_dyndtafmt(smldtasz) if smldtasz is not None else b'')
     )
 
 
-def packCNTQRY(pkgid, pkgcnstkn, pkgsn, database, qryblksz, qryinsid=0, rtnextdta=0x02):
-    return pack_dss_object(
-        cp.CNTQRY,
+def packCNTQRY(pkgid, pkgcnstkn, pkgsn, database, qryblksz, qryinsid=0, rtnextdta=0x02, maxblkext=None, qryrowset=None):
+    b = (
         _packPKGNAMCSN(database, pkgid, pkgcnstkn, pkgsn) +
         _pack_uint(cp.QRYBLKSZ, qryblksz, 4) +
         _pack_uint(cp.QRYINSID, qryinsid, 8) +
         _pack_binary(cp.RTNEXTDTA, bytes([rtnextdta]))
     )
+    if maxblkext is not None:
+        b += _pack_prefetch(maxblkext, qryrowset)
+    return pack_dss_object(cp.CNTQRY, b)
+
+
+def packCLSQRY(pkgid, pkgcnstkn, pkgsn, database, qryinsid=0):
+    return pack_dss_object(
+        cp.CLSQRY,
+        _packPKGNAMCSN(database, pkgid, pkgcnstkn, pkgsn) +
+        _pack_uint(cp.QRYINSID, qryinsid, 8)
+    )
 
 
 def packSQLSTT(sql):
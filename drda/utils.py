@@ -22,10 +22,16 @@
 # SOFTWARE.
 ##############################################################################
 
-import binascii
+import array
+import bisect
+import codecs
 import decimal
 import datetime
+import io
 import struct
+import operator
+
+from drda import consts
 
 DRDA_TYPE_INTEGER = 0x02
 DRDA_TYPE_NINTEGER = 0x03
@@ -116,6 +122,22 @@ DRDA_TYPE_NLOBBYTES = 0xC9   # inline BLOB (nullable)
 DRDA_TYPE_LOBCSBCS = 0xCE   # inline CLOB single-byte char (non-nullable)
 DRDA_TYPE_NLOBCSBCS = 0xCF  # inline CLOB single-byte char (nullable)
 
+# LOB columns, their data is delivered via EXTDTA
+INLINE_LOB_TYPES = (
+    DRDA_TYPE_LOBBYTES, DRDA_TYPE_NLOBBYTES,
+    DRDA_TYPE_LOBCSBCS, DRDA_TYPE_NLOBCSBCS,
+)
+LOB_TYPES = (
+    DRDA_TYPE_LOBLOC, DRDA_TYPE_NLOBLOC,
+    DRDA_TYPE_CLOBLOC, DRDA_TYPE_NCLOBLOC,
+    DRDA_TYPE_DBCSCLOBLOC, DRDA_TYPE_NDBCSCLOBLOC,
+) + INLINE_LOB_TYPES
+CLOB_TYPES = (
+    DRDA_TYPE_CLOBLOC, DRDA_TYPE_NCLOBLOC,
+    DRDA_TYPE_DBCSCLOBLOC, DRDA_TYPE_NDBCSCLOBLOC,
+    DRDA_TYPE_LOBCSBCS, DRDA_TYPE_NLOBCSBCS,
+)
+
 
 def _dpd_decode(dpd):
     """Decode a 10-bit DPD (Densely Packed Decimal) value to 3 decimal digits."""
@@ -161,13 +183,18 @@ def _dpd_encode(d2, d1, d0):
         return ((v2 & 1) << 7) | (1 << 6) | (1 << 5) | ((v1 & 1) << 4) | (1 << 3) | (1 << 2) | (1 << 1) | (v0 & 1)
 
 
+# 10 bit DPD value -> 3 digits number, and the inverse
+_DPD_TO_INT = [d2 * 100 + d1 * 10 + d0 for d2, d1, d0 in map(_dpd_decode, range(1024))]
+_INT_TO_DPD = [_dpd_encode(n // 100, n // 10 % 10, n % 10) for n in range(1000)]
+
+# bytes: (exponent bias, number of DPD groups, exponent continuation bits)
+_DFP_FORMATS = {8: (398, 5, 8), 16: (6176, 11, 12)}
+
+
 def _decode_dfp(data):
     """Decode IEEE 754-2008 DPD decimal floating-point bytes to Python Decimal."""
     n_bytes = len(data)
-    if n_bytes == 8:
-        bias, n_dpd_groups, exp_cont_bits = 398, 5, 8
-    else:  # 16 bytes (DECFLOAT(34))
-        bias, n_dpd_groups, exp_cont_bits = 6176, 11, 12
+    bias, n_dpd_groups, exp_cont_bits = _DFP_FORMATS.get(n_bytes, _DFP_FORMATS[16])
     coeff_cont_bits = n_dpd_groups * 10
     total_bits = n_bytes * 8
     w = int.from_bytes(data, 'big')
@@ -176,195 +203,1427 @@ def _decode_dfp(data):
     E = (w >> coeff_cont_bits) & ((1 << exp_cont_bits) - 1)
     T = w & ((1 << coeff_cont_bits) - 1)
     # Special: Infinity and NaN
-    if G >= 0x1C:
-        if G & 0x02:  # G[1]=1 → NaN
+    if G >= 0x1E:  # G="1111x"
+        if G & 0x01:  # G[0]=1 → NaN
             return decimal.Decimal('NaN')
         return decimal.Decimal('-Infinity') if sign else decimal.Decimal('Infinity')
     # Extract leading digit and biased exponent
-    if G >= 0x18:  # G[4:3]="11", G[2]="0": large leading digit (8 or 9)
-        biased_exp = ((G & 0x03) << exp_cont_bits) | E
-        leading_digit = 8 + ((G >> 2) & 1)
+    if G >= 0x18:  # G[4:3]="11": G[2:1]=exp top bits, large leading digit (8 or 9)
+        biased_exp = (((G >> 1) & 0x03) << exp_cont_bits) | E
+        leading_digit = 8 + (G & 1)
     else:
         biased_exp = ((G >> 3) << exp_cont_bits) | E
         leading_digit = G & 0x07
-    # Decode DPD groups (MSB group first) to get continuation digits
-    digits = [leading_digit]
-    for i in range(n_dpd_groups - 1, -1, -1):
-        d2, d1, d0 = _dpd_decode((T >> (i * 10)) & 0x3FF)
-        digits.extend([d2, d1, d0])
-    exp = biased_exp - bias
-    return decimal.Decimal((sign, tuple(digits), exp))
+    # Coefficient from DPD groups (LSB group first) by the table,
+    # the zero groups of a short coefficient are skipped
+    coefficient = 0
+    scale = 1
+    while T:
+        coefficient += _DPD_TO_INT[T & 0x3FF] * scale
+        T >>= 10
+        scale *= 1000
+    if leading_digit:
+        coefficient += leading_digit * 1000 ** n_dpd_groups
+    return decimal.Decimal('%s%dE%d' % ('-' if sign else '', coefficient, biased_exp - bias))
 
 
 def _encode_dfp(v, n_bytes):
     """Encode Python Decimal to IEEE 754-2008 DPD decimal floating-point bytes."""
-    if n_bytes == 8:
-        bias, n_dpd_groups, exp_cont_bits, max_digits = 398, 5, 8, 16
-    else:  # 16 bytes (DECFLOAT(34))
-        bias, n_dpd_groups, exp_cont_bits, max_digits = 6176, 11, 12, 34
+    bias, n_dpd_groups, exp_cont_bits = _DFP_FORMATS.get(n_bytes, _DFP_FORMATS[16])
     coeff_cont_bits = n_dpd_groups * 10
     total_bits = n_bytes * 8
     sign, digits, exp = v.as_tuple()
     if v.is_infinite():
-        w = (sign << (total_bits - 1)) | (0x1C << (total_bits - 6))
+        w = (sign << (total_bits - 1)) | (0x1E << (total_bits - 6))
         return w.to_bytes(n_bytes, 'big')
     if v.is_nan():
-        w = (sign << (total_bits - 1)) | (0x1E << (total_bits - 6))
+        w = (sign << (total_bits - 1)) | (0x1F << (total_bits - 6))
         return w.to_bytes(n_bytes, 'big')
-    # Pad digits with leading zeros to max_digits length
-    n_cont_digits = n_dpd_groups * 3
-    padded = (0,) * (max_digits - len(digits)) + tuple(digits)
-    leading_digit = padded[0]
-    cont_digits = padded[1:]
-    # Pad cont_digits to n_cont_digits (in case digits was shorter than max_digits - 1)
-    cont_digits = (0,) * (n_cont_digits - len(cont_digits)) + cont_digits
+    # Encode continuation digits as DPD groups (LSB group first) by the table,
+    # a short coefficient stops at its last group
+    coefficient = int(decimal.Decimal((0, digits, 0)))
+    T = 0
+    shift = 0
+    while coefficient and shift < coeff_cont_bits:
+        coefficient, n = divmod(coefficient, 1000)
+        T |= _INT_TO_DPD[n] << shift
+        shift += 10
+    leading_digit = coefficient
     biased_exp = exp + bias
     if leading_digit >= 8:
-        # Large leading digit form: G[4:3]="11", G[2]=leading_digit-8, G[1:0]=exp top bits
-        G = 0x18 | ((leading_digit - 8) << 2) | (biased_exp >> exp_cont_bits)
+        # Large leading digit form: G[4:3]="11", G[2:1]=exp top bits, G[0]=leading_digit-8
+        G = 0x18 | ((biased_exp >> exp_cont_bits) << 1) | (leading_digit - 8)
     else:
         G = ((biased_exp >> exp_cont_bits) << 3) | leading_digit
     E = biased_exp & ((1 << exp_cont_bits) - 1)
-    # Encode continuation digits as DPD groups (MSB group first)
-    T = 0
-    for i in range(n_dpd_groups):
-        T = (T << 10) | _dpd_encode(cont_digits[i * 3], cont_digits[i * 3 + 1], cont_digits[i * 3 + 2])
     w = (sign << (total_bits - 1)) | (G << (total_bits - 6)) | (E << coeff_cont_bits) | T
     return w.to_bytes(n_bytes, 'big')
 
 
-def read_from_stream(stream, nbytes):
-    return stream.read(nbytes)
+_DECIMAL_TYPES = frozenset([DRDA_TYPE_DECIMAL, DRDA_TYPE_NDECIMAL])
+_DATETIME_TYPES = frozenset([
+    DRDA_TYPE_DATE, DRDA_TYPE_NDATE, DRDA_TYPE_TIME, DRDA_TYPE_NTIME, DRDA_TYPE_TIMESTAMP, DRDA_TYPE_NTIMESTAMP,
+])
+
+_NULLABLE_TYPES = frozenset([
+    DRDA_TYPE_NINTEGER, DRDA_TYPE_NSMALL, DRDA_TYPE_N1BYTE_INT, DRDA_TYPE_NFLOAT16,
+    DRDA_TYPE_NFLOAT8, DRDA_TYPE_NFLOAT4, DRDA_TYPE_NDECIMAL, DRDA_TYPE_NNUMERIC_CHAR,
+    DRDA_TYPE_NRSET_LOC, DRDA_TYPE_NINTEGER8, DRDA_TYPE_NLOBLOC, DRDA_TYPE_NCLOBLOC,
+    DRDA_TYPE_NDBCSCLOBLOC, DRDA_TYPE_NROWID, DRDA_TYPE_NDATE, DRDA_TYPE_NTIME,
+    DRDA_TYPE_NTIMESTAMP, DRDA_TYPE_NFIXBYTE, DRDA_TYPE_NVARBYTE, DRDA_TYPE_NLONGVARBYTE,
+    DRDA_TYPE_NTERMBYTE, DRDA_TYPE_NNTERMBYTE, DRDA_TYPE_NCSTR, DRDA_TYPE_NCHAR,
+    DRDA_TYPE_NVARCHAR, DRDA_TYPE_NLONG, DRDA_TYPE_NGRAPHIC, DRDA_TYPE_NVARGRAPH,
+    DRDA_TYPE_NLONGRAPH, DRDA_TYPE_NMIX, DRDA_TYPE_NVARMIX, DRDA_TYPE_NLONGMIX,
+    DRDA_TYPE_NCSTRMIX, DRDA_TYPE_NPSCLBYTE, DRDA_TYPE_NLSTR, DRDA_TYPE_NLSTRMIX,
+    DRDA_TYPE_NSDATALINK, DRDA_TYPE_NMDATALINK, DRDA_TYPE_NBOOLEAN, DRDA_TYPE_NDECFLOAT,
+    DRDA_TYPE_NLOBBYTES, DRDA_TYPE_NLOBCSBCS, DRDA_TYPE_NVARBINARY, DRDA_TYPE_NFIXBYTES,
+])
+
+
+def _fixed_field(ln, convert):
+    def decode(buf, pos):
+        end = pos + ln
+        if end > len(buf):
+            raise EOFError()
+        return convert(buf[pos:end]), end
+    return decode
+
+
+def _prefixed_field(size, convert):
+    "field prefixed by its length in size bytes"
+    def decode(buf, pos):
+        start = pos + size
+        if start > len(buf):
+            raise EOFError()
+        end = start + int.from_bytes(buf[pos:start], byteorder='big')
+        if end > len(buf):
+            raise EOFError()
+        return convert(buf[start:end]), end
+    return decode
+
+
+def _struct_field(st):
+    def decode(buf, pos):
+        end = pos + st.size
+        if end > len(buf):
+            raise EOFError()
+        return st.unpack_from(buf, pos)[0], end
+    return decode
+
+
+def _nullable_field(decode_value):
+    def decode(buf, pos):
+        if pos >= len(buf):
+            raise EOFError()
+        if buf[pos] == 0xFF:
+            return None, pos + 1
+        return decode_value(buf, pos + 1)
+    return decode
+
+
+# data format of a LOB value in QRYDTA with the dynamic data format (lob_inline_size)
+_LOB_DATA_INLINE = 0x01     # 4 bytes length and the data follow
+_LOB_DATA_EXTDTA = 0x02     # the data is in EXTDTA
 
-def read_field(t, ps, stream, endian):
+EXTDTA_VALUE = object()     # value of a LOB field which is sent in EXTDTA
+
+
+def _inline_lob_field(buf, pos):
     """
-    read one field value from bytes.
-    return value, rest bytes
-    t: type
-    ps:  precision and scale or length
-    stream: input bytes stream
-    """
-    if t in (
-        DRDA_TYPE_NINTEGER, DRDA_TYPE_NSMALL, DRDA_TYPE_N1BYTE_INT, DRDA_TYPE_NFLOAT16,
-        DRDA_TYPE_NFLOAT8, DRDA_TYPE_NFLOAT4, DRDA_TYPE_NDECIMAL, DRDA_TYPE_NNUMERIC_CHAR,
-        DRDA_TYPE_NRSET_LOC, DRDA_TYPE_NINTEGER8, DRDA_TYPE_NLOBLOC, DRDA_TYPE_NCLOBLOC,
-        DRDA_TYPE_NDBCSCLOBLOC, DRDA_TYPE_NROWID, DRDA_TYPE_NDATE, DRDA_TYPE_NTIME,
-        DRDA_TYPE_NTIMESTAMP, DRDA_TYPE_NFIXBYTE, DRDA_TYPE_NVARBYTE, DRDA_TYPE_NLONGVARBYTE,
-        DRDA_TYPE_NTERMBYTE, DRDA_TYPE_NNTERMBYTE, DRDA_TYPE_NCSTR, DRDA_TYPE_NCHAR,
-        DRDA_TYPE_NVARCHAR, DRDA_TYPE_NLONG, DRDA_TYPE_NGRAPHIC, DRDA_TYPE_NVARGRAPH,
-        DRDA_TYPE_NLONGRAPH, DRDA_TYPE_NMIX, DRDA_TYPE_NVARMIX, DRDA_TYPE_NLONGMIX,
-        DRDA_TYPE_NCSTRMIX, DRDA_TYPE_NPSCLBYTE, DRDA_TYPE_NLSTR, DRDA_TYPE_NLSTRMIX,
-        DRDA_TYPE_NSDATALINK, DRDA_TYPE_NMDATALINK, DRDA_TYPE_NBOOLEAN, DRDA_TYPE_NDECFLOAT,
-        DRDA_TYPE_NLOBBYTES, DRDA_TYPE_NLOBCSBCS, DRDA_TYPE_NVARBINARY, DRDA_TYPE_NFIXBYTES,
-    ):
-        if read_from_stream(stream, 1) == b'\xFF':
-            return None
+    LOB field of the dynamic data format. The value is the data with a leading status byte
+    like EXTDTA of inline LOBs, or EXTDTA_VALUE if the data is sent in EXTDTA
+    """
+    if pos >= len(buf):
+        raise EOFError()
+    if buf[pos] == _LOB_DATA_EXTDTA:
+        return EXTDTA_VALUE, pos + 1
+    elif buf[pos] != _LOB_DATA_INLINE:
+        raise ValueError("Unsupported LOB data format(%s)" % hex(buf[pos]))
+    start = pos + 5
+    if start > len(buf):
+        raise EOFError()
+    end = start + int.from_bytes(buf[pos+1:start], byteorder='big')
+    if end > len(buf):
+        raise EOFError()
+    return b'\x00' + bytes(buf[start:end]), end
+
+
+def _unknown_field(t):
+    def decode(buf, pos):
+        raise ValueError("UnknownType(%s)" % hex(t))
+    return decode
+
+
+def _decode_str(b):
+    return b.decode('utf-8')
+
+
+def _decode_str_rstrip(b):
+    return b.decode('utf-8').rstrip(' ')
+
+
+DECIMAL_MODES = ('decimal', 'int', 'float')
+
+# sign of packed decimal by the hex digit of the last nibble, others are positive
+_PACKED_DECIMAL_SIGNS = {'b': '-', 'd': '-'}
+
+
+def _decimal_decoder(s, mode='decimal'):
+    """
+    decoder of packed decimal with scale s.
+    mode 'decimal' returns decimal.Decimal, 'int' the unscaled int (value * 10 ** s) and 'float' float.
+    """
+    # bytes.hex() gives a digit for each nibble, and the value is parsed at once from
+    # the signed digits with the exponent
+    signs = _PACKED_DECIMAL_SIGNS
+    if mode == 'int':
+        def decode(b):
+            h = b.hex()
+            return int(signs.get(h[-1], '') + h[:-1])
+    else:
+        convert = float if mode == 'float' else decimal.Decimal
+        exponent = 'E-%d' % s
+
+        def decode(b):
+            h = b.hex()
+            return convert(signs.get(h[-1], '') + h[:-1] + exponent)
+    return decode
+
+
+def field_modes(qrydsc, names, decimal_mode=None, datetime_mode=None, lob_inline=False):
+    """
+    mode of each QRYDSC field to decode DECIMAL and DATE/TIME/TIMESTAMP values,
+    None if all of them are decoded to the default types.
+    decimal_mode is one of DECIMAL_MODES, datetime_mode is one of DATETIME_MODES,
+    or a dict of column name and one of them.
+    names: column names
+    lob_inline: LOB fields are in the dynamic data format ('inline' mode, see _inline_lob_field())
+    """
+    def column_modes(mode):
+        if isinstance(mode, dict):
+            return [mode.get(names[i]) if i < len(names) else None for i in range(len(qrydsc))]
+        return [mode] * len(qrydsc)
+
+    modes = tuple(
+        d if t in _DECIMAL_TYPES else dt if t in _DATETIME_TYPES else
+        'inline' if lob_inline and t in INLINE_LOB_TYPES else None
+        for (t, _), d, dt in zip(qrydsc, column_modes(decimal_mode), column_modes(datetime_mode))
+    )
+    modes = tuple(None if m in ('decimal', 'datetime') else m for m in modes)
+    if not any(modes):
+        return None
+    return modes
+
+
+def _as_decimal(v, scale):
+    "DECIMAL value decoded in any decimal mode as decimal.Decimal"
+    if isinstance(v, int):
+        return decimal.Decimal(v).scaleb(-scale)
+    elif isinstance(v, float):
+        return decimal.Decimal(repr(v))
+    return v
+
+
+DATETIME_MODES = ('datetime', 'str', 'epoch')
+
+_EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
+
+def _decode_timestamp(b):
+    # Format: YYYY-MM-DD-HH.MM.SS[.FFFFFFFFFFFF] at fixed positions,
+    # fromisoformat() takes the fractional seconds to microseconds
+    b = b.rstrip()
+    return datetime.datetime.fromisoformat((b[:10] + b'T' + b[11:13] + b':' + b[14:16] + b':' + b[17:]).decode('ascii'))
+
+
+def _decode_date(b):
+    # Format: YYYY-MM-DD
+    return datetime.date.fromisoformat(b.decode('ascii'))
+
+
+def _decode_time(b):
+    # Format: HH.MM.SS or HH:MM:SS
+    return datetime.time(int(b[0:2]), int(b[3:5]), int(b[6:8]))
+
+
+def _decode_timestamp_epoch(b):
+    "microseconds since 1970-01-01 00:00:00"
+    days = datetime.date(int(b[0:4]), int(b[5:7]), int(b[8:10])).toordinal() - _EPOCH_ORDINAL
+    seconds = ((days * 24 + int(b[11:13])) * 60 + int(b[14:16])) * 60 + int(b[17:19])
+    return seconds * 1000000 + int(b[20:26].rstrip().ljust(6, b'0'))
+
+
+def _decode_date_epoch(b):
+    "days since 1970-01-01"
+    return datetime.date(int(b[0:4]), int(b[5:7]), int(b[8:10])).toordinal() - _EPOCH_ORDINAL
+
+
+def _decode_time_epoch(b):
+    "seconds since midnight"
+    return (int(b[0:2]) * 60 + int(b[3:5])) * 60 + int(b[6:8])
+
+
+def _decode_ascii_rstrip(b):
+    return b.decode('ascii').rstrip()
+
+
+_DATETIME_DECODERS = {
+    # (type, mode): decoder
+    (DRDA_TYPE_TIMESTAMP, 'str'): _decode_ascii_rstrip,
+    (DRDA_TYPE_TIMESTAMP, 'epoch'): _decode_timestamp_epoch,
+    (DRDA_TYPE_DATE, 'str'): _decode_ascii_rstrip,
+    (DRDA_TYPE_DATE, 'epoch'): _decode_date_epoch,
+    (DRDA_TYPE_TIME, 'str'): _decode_ascii_rstrip,
+    (DRDA_TYPE_TIME, 'epoch'): _decode_time_epoch,
+}
+
+
+def _cached_decoder(decode, size=4096):
+    "decoder memoizing the values of up to size distinct bytes"
+    cache = {}
+
+    def decode_cached(b):
+        v = cache.get(b)
+        if v is None:
+            if len(cache) >= size:
+                cache.clear()
+            v = cache[b] = decode(b)
+        return v
+    return decode_cached
+
+
+def _datetime_decoder(t, mode):
+    "decoder of DATE, TIME or TIMESTAMP"
+    t &= ~1     # not nullable type
+    if mode:
+        return _DATETIME_DECODERS[t, mode]
+    if t == DRDA_TYPE_DATE:
+        # the same dates and times are repeated in many rows
+        return _cached_decoder(_decode_date)
+    elif t == DRDA_TYPE_TIME:
+        return _cached_decoder(_decode_time)
+    return _decode_timestamp
+
+
+def _decode_bool(b):
+    return True if int.from_bytes(b, byteorder='big') else False
 
-    if t in (DRDA_TYPE_MIX, DRDA_TYPE_NMIX):
-        ln = int.from_bytes(ps, byteorder='big')
-        v = read_from_stream(stream, ln).decode('utf-8').rstrip(' ')
-    elif t in (DRDA_TYPE_CHAR, DRDA_TYPE_NCHAR):
-        ln = int.from_bytes(ps, byteorder='big')
-        v = read_from_stream(stream, ln).decode('utf-8').rstrip(' ')
-    elif t in (DRDA_TYPE_ROWID, DRDA_TYPE_NROWID):
-        ln = int.from_bytes(ps, byteorder='big')
-        v = bytes(read_from_stream(stream, ln))
+
+_INT_FORMATS = {1: 'b', 2: 'h', 4: 'i', 8: 'q'}
+
+
+def _fixed_width_field(t, ps, endian, mode=None):
+    """
+    struct format code and converter (None if the unpacked value is used as is)
+    of a fixed width field. None if the field is variable width.
+    mode: decimal or datetime mode of the field (see field_modes())
+    """
+    ln = int.from_bytes(ps, byteorder='big')
+    if t in (DRDA_TYPE_MIX, DRDA_TYPE_NMIX, DRDA_TYPE_CHAR, DRDA_TYPE_NCHAR,
+             DRDA_TYPE_VARGRAPH, DRDA_TYPE_NVARGRAPH, DRDA_TYPE_GRAPHIC, DRDA_TYPE_NGRAPHIC):
+        return '%ds' % ln, _decode_str_rstrip
+    elif t in (DRDA_TYPE_ROWID, DRDA_TYPE_NROWID, DRDA_TYPE_LOBLOC, DRDA_TYPE_NLOBLOC,
+               DRDA_TYPE_CLOBLOC, DRDA_TYPE_NCLOBLOC, DRDA_TYPE_DBCSCLOBLOC, DRDA_TYPE_NDBCSCLOBLOC):
+        return '%ds' % ln, None
     elif t in (DRDA_TYPE_FIXBYTE, DRDA_TYPE_NFIXBYTE, DRDA_TYPE_FIXBYTES, DRDA_TYPE_NFIXBYTES):
-        ln = int.from_bytes(ps, byteorder='big') & 0x7FFF
-        v = bytes(read_from_stream(stream, ln))
-    elif t in (DRDA_TYPE_VARBINARY, DRDA_TYPE_NVARBINARY):
-        ln = int.from_bytes(read_from_stream(stream, 2), byteorder='big')
-        v = bytes(read_from_stream(stream, ln))
-    elif t in (DRDA_TYPE_VARBYTE, DRDA_TYPE_NVARBYTE):
-        ln = int.from_bytes(read_from_stream(stream, 2), byteorder='big')
-        v = bytes(read_from_stream(stream, ln))
-    elif t in (DRDA_TYPE_LONGVARBYTE, DRDA_TYPE_NLONGVARBYTE):
-        ln = int.from_bytes(read_from_stream(stream, 4), byteorder='big')
-        v = bytes(read_from_stream(stream, ln))
-    elif t in (DRDA_TYPE_LOBLOC, DRDA_TYPE_NLOBLOC, DRDA_TYPE_CLOBLOC, DRDA_TYPE_NCLOBLOC,
-               DRDA_TYPE_DBCSCLOBLOC, DRDA_TYPE_NDBCSCLOBLOC):
-        ln = int.from_bytes(ps, byteorder='big')
-        v = bytes(read_from_stream(stream, ln))
+        return '%ds' % (ln & 0x7FFF), None
     elif t in (DRDA_TYPE_DECFLOAT, DRDA_TYPE_NDECFLOAT):
-        ln = int.from_bytes(ps, byteorder='big')
-        v = _decode_dfp(read_from_stream(stream, ln))
-    elif t in (
-        DRDA_TYPE_VARMIX, DRDA_TYPE_NVARMIX,
-        DRDA_TYPE_LONGMIX, DRDA_TYPE_NLONGMIX,
-        DRDA_TYPE_VARCHAR, DRDA_TYPE_NVARCHAR, DRDA_TYPE_LONG, DRDA_TYPE_NLONG,
-    ):
-        ln = int.from_bytes(read_from_stream(stream, 2), byteorder='big')
-        v = read_from_stream(stream, ln).decode('utf-8')
+        return '%ds' % ln, _decode_dfp
     elif t in (
             DRDA_TYPE_SMALL, DRDA_TYPE_NSMALL, DRDA_TYPE_NINTEGER8,
             DRDA_TYPE_INTEGER8, DRDA_TYPE_INTEGER, DRDA_TYPE_NINTEGER):
-        ln = int.from_bytes(ps, byteorder='big')
-        v = int.from_bytes(read_from_stream(stream, ln), byteorder=endian, signed=True)
-    elif t == DRDA_TYPE_NDECIMAL:
+        if ln in _INT_FORMATS:
+            return _INT_FORMATS[ln], None
+        return '%ds' % ln, lambda b: int.from_bytes(b, byteorder=endian, signed=True)
+    elif t in _DECIMAL_TYPES:
         (p, s) = (ps[0], ps[1])
-        ln = p + 1
-        if ln % 2:
-            ln += 1
-        ln //= 2
-        digits_sign = binascii.b2a_hex(read_from_stream(stream, ln)).decode('ascii')
-        sign = 0 if digits_sign[-1] == 'c' else 1
-        v = decimal.Decimal(digits_sign[:-1])
-        v = decimal.Decimal((sign, v.as_tuple()[1], -s))
-    elif t in (DRDA_TYPE_TIMESTAMP, DRDA_TYPE_NTIMESTAMP):
-        ln = int.from_bytes(ps, byteorder='big')
-        v = read_from_stream(stream, ln).decode('utf-8').rstrip()
-        # Format: YYYY-MM-DD-HH.MM.SS[.FFFFFFFFFFFF] (19 chars base + optional fractional)
-        if len(v) > 19:
-            date_part = v[:19]
-            frac = v[20:]  # skip the '.' separator at index 19
-            # Truncate or pad fractional seconds to 6 digits (microseconds)
-            frac6 = frac[:6].ljust(6, '0')
-            dt = datetime.datetime.strptime(date_part, "%Y-%m-%d-%H.%M.%S")
-            v = dt.replace(microsecond=int(frac6))
-        else:
-            v = datetime.datetime.strptime(v, "%Y-%m-%d-%H.%M.%S")
-    elif t in (DRDA_TYPE_DATE, DRDA_TYPE_NDATE):
-        ln = int.from_bytes(ps, byteorder='big')
-        v = read_from_stream(stream, ln).decode('utf-8')
-        v = datetime.datetime.strptime(v, "%Y-%m-%d")
-        v = datetime.date(v.year, v.month, v.day)
-    elif t in (DRDA_TYPE_TIME, DRDA_TYPE_NTIME):
-        ln = int.from_bytes(ps, byteorder='big')
-        v = read_from_stream(stream, ln).decode('utf-8')
-        try:
-            v = datetime.datetime.strptime(v, "%H:%M:%S")
-        except ValueError:
-            v = datetime.datetime.strptime(v, "%H.%M.%S")
-        v = datetime.time(v.hour, v.minute, v.second)
-    elif t in (DRDA_TYPE_VARGRAPH, DRDA_TYPE_NVARGRAPH):
-        ln = int.from_bytes(ps, byteorder='big')
-        v = read_from_stream(stream, ln).decode('utf-8').rstrip(' ')
-    elif t in (DRDA_TYPE_GRAPHIC, DRDA_TYPE_NGRAPHIC):
-        ln = int.from_bytes(ps, byteorder='big')
-        v = read_from_stream(stream, ln).decode('utf-8').rstrip(' ')
-    elif t in (DRDA_TYPE_NFLOAT4, DRDA_TYPE_FLOAT4):
-        ln = int.from_bytes(ps, byteorder='big')
-        v = struct.unpack(">f" if endian == 'big' else "<f", read_from_stream(stream, ln))[0]
-    elif t in (DRDA_TYPE_NFLOAT8, DRDA_TYPE_FLOAT8):
-        ln = int.from_bytes(ps, byteorder='big')
-        v = struct.unpack(">d" if endian == 'big' else "<d", read_from_stream(stream, ln))[0]
+        return '%ds' % ((p + 2) // 2), _decimal_decoder(s, mode or 'decimal')
+    elif t in _DATETIME_TYPES:
+        return '%ds' % ln, _datetime_decoder(t, mode)
+    elif t in (DRDA_TYPE_NFLOAT4, DRDA_TYPE_FLOAT4) and ln == 4:
+        return 'f', None
+    elif t in (DRDA_TYPE_NFLOAT8, DRDA_TYPE_FLOAT8) and ln == 8:
+        return 'd', None
     elif t in (DRDA_TYPE_BOOLEAN, DRDA_TYPE_NBOOLEAN):
-        ln = int.from_bytes(ps, byteorder='big')
-        v = True if int.from_bytes(read_from_stream(stream, ln), byteorder='big') else False
+        return '%ds' % ln, _decode_bool
+    elif t in INLINE_LOB_TYPES and mode == 'inline':
+        # variable width, see _inline_lob_field()
+        return None
     elif t in (DRDA_TYPE_LOBBYTES, DRDA_TYPE_NLOBBYTES):
         # LOB data is delivered via EXTDTA; QRYDTA contains a placeholder.
-        # ps encodes the placeholder size (high bit = nullable, already handled above).
-        ln = int.from_bytes(ps, byteorder='big') & 0x7FFF
-        read_from_stream(stream, ln)  # consume placeholder bytes
-        return b''  # sentinel; replaced by EXTDTA data in connection._parse_response
+        # ps encodes the placeholder size (high bit = nullable).
+        # b'' is a sentinel; replaced by EXTDTA data in connection._parse_response
+        return '%ds' % (ln & 0x7FFF), lambda b: b''
     elif t in (DRDA_TYPE_LOBCSBCS, DRDA_TYPE_NLOBCSBCS):
         # Same as above but for character LOBs (CLOB).
-        ln = int.from_bytes(ps, byteorder='big') & 0x7FFF
-        read_from_stream(stream, ln)  # consume placeholder bytes
-        return ''   # sentinel; replaced by EXTDTA data in connection._parse_response
+        return '%ds' % (ln & 0x7FFF), lambda b: ''
+    return None
+
+
+def _variable_width_field(t):
+    """
+    size of the length prefix and converter of a variable width field.
+    None if the field is not variable width.
+    """
+    if t in (DRDA_TYPE_VARBINARY, DRDA_TYPE_NVARBINARY, DRDA_TYPE_VARBYTE, DRDA_TYPE_NVARBYTE):
+        return 2, bytes
+    elif t in (DRDA_TYPE_LONGVARBYTE, DRDA_TYPE_NLONGVARBYTE):
+        return 4, bytes
+    elif t in (
+        DRDA_TYPE_VARMIX, DRDA_TYPE_NVARMIX,
+        DRDA_TYPE_LONGMIX, DRDA_TYPE_NLONGMIX,
+        DRDA_TYPE_VARCHAR, DRDA_TYPE_NVARCHAR, DRDA_TYPE_LONG, DRDA_TYPE_NLONG,
+    ):
+        return 2, _decode_str
+    return None
+
+
+def _field_decoder(t, ps, endian, mode=None):
+    """
+    decoder of one field value.
+    return function(buf, pos) -> (value, next pos)
+    t: type
+    ps:  precision and scale or length
+    """
+    fixed = _fixed_width_field(t, ps, endian, mode)
+    variable = _variable_width_field(t)
+    if fixed:
+        code, convert = fixed
+        st = struct.Struct(('>' if endian == 'big' else '<') + code)
+        decode = _struct_field(st) if convert is None else _fixed_field(st.size, convert)
+    elif t in INLINE_LOB_TYPES and mode == 'inline':
+        decode = _inline_lob_field
+    elif variable:
+        decode = _prefixed_field(*variable)
     else:
-        raise ValueError("UnknownType(%s)" % hex(t))
-    return v
+        decode = _unknown_field(t)
+    if t in _NULLABLE_TYPES:
+        decode = _nullable_field(decode)
+    return decode
+
+
+def _skip_fixed_field(size):
+    def skip(buf, pos):
+        end = pos + size
+        if end > len(buf):
+            raise EOFError()
+        return end
+    return skip
+
+
+def _skip_prefixed_field(size):
+    def skip(buf, pos):
+        start = pos + size
+        if start > len(buf):
+            raise EOFError()
+        return start + int.from_bytes(buf[pos:start], byteorder='big')
+    return skip
+
+
+def _skip_nullable_field(skip_value):
+    def skip(buf, pos):
+        if pos >= len(buf):
+            raise EOFError()
+        if buf[pos] == 0xFF:
+            return pos + 1
+        return skip_value(buf, pos + 1)
+    return skip
+
+
+def _compile_row_skipper(qrydsc, endian):
+    """
+    function(buf, pos) -> next pos, which finds the end of a row without decoding the values
+    """
+    steps = []      # size of fixed width fields without null indicator, or function to skip a field
+    for t, ps in qrydsc:
+        fixed = _fixed_width_field(t, ps, endian)
+        variable = _variable_width_field(t)
+        if fixed:
+            size = struct.calcsize('<' + fixed[0])
+            if t not in _NULLABLE_TYPES:
+                if steps and isinstance(steps[-1], int):
+                    steps[-1] += size
+                else:
+                    steps.append(size)
+                continue
+            skip = _skip_fixed_field(size)
+        elif variable:
+            skip = _skip_prefixed_field(variable[0])
+        else:
+            skip = _unknown_field(t)
+        if t in _NULLABLE_TYPES:
+            skip = _skip_nullable_field(skip)
+        steps.append(skip)
+
+    def skip_row(buf, pos):
+        for step in steps:
+            if step.__class__ is int:
+                pos += step
+            else:
+                pos = step(buf, pos)
+        if pos > len(buf):
+            raise EOFError()
+        return pos
+    return skip_row
+
+
+def _compile_row_decoder(qrydsc, endian, modes=None, make_row=None):
+    "make_row: function(list of values) -> row, tuple if None"
+    modes = modes or (None, ) * len(qrydsc)
+    decoders = [_field_decoder(t, ps, endian, m) for (t, ps), m in zip(qrydsc, modes)]
+    make_row = make_row or tuple
+
+    def decode_row(buf, pos):
+        row = []
+        append = row.append
+        for decode in decoders:
+            v, pos = decode(buf, pos)
+            append(v)
+        return make_row(row), pos
+    return decode_row
+
+
+def _items_getter(indices):
+    "function returning the items at indices of a sequence as a tuple"
+    if len(indices) == 1:
+        i = indices[0]
+        return lambda v: (v[i],)
+    return operator.itemgetter(*indices)
+
+
+def _fixed_row_layout(qrydsc, endian, modes=None):
+    """
+    layout of a row without nulls, when all fields are fixed width.
+    return (struct of the row, indices of null indicators and field values in unpacked values,
+    [(index of field, converter), ...]) or None
+    """
+    codes = ['B', 'x']      # row header 0xFF00
+    n_items = 1
+    indicators = []
+    values = []
+    conversions = []
+    for (t, ps), mode in zip(qrydsc, modes or (None, ) * len(qrydsc)):
+        fixed = _fixed_width_field(t, ps, endian, mode)
+        if fixed is None:
+            return None
+        code, convert = fixed
+        if t in _NULLABLE_TYPES:
+            indicators.append(n_items)
+            codes.append('B')
+            n_items += 1
+        if convert is not None:
+            conversions.append((len(values), convert))
+        values.append(n_items)
+        codes.append(code)
+        n_items += 1
+    st = struct.Struct(('>' if endian == 'big' else '<') + ''.join(codes))
+    return st, indicators, values, conversions
+
+
+def _compile_qrydta_decoder(qrydsc, endian, modes=None, make_row=None):
+    decode_row = _compile_row_decoder(qrydsc, endian, modes, make_row)
+
+    def decode_rows(b, results, pos=0):
+        while True:
+            if pos + 2 > len(b):
+                return b[pos:]
+            if b[pos] != 0xff:
+                break
+            try:
+                r, end = decode_row(b, pos + 2)
+            except EOFError:
+                return b[pos:]
+            results.append(r)
+            pos = end
+        return b''
+
+    layout = _fixed_row_layout(qrydsc, endian, modes)
+    if layout is None:
+        return decode_rows
+    st, indicators, values, conversions = layout
+    size = st.size
+    get_indicators = _items_getter(indicators) if indicators else lambda v: ()
+    get_values = _items_getter(values)
+    make_row = make_row or tuple
+
+    def to_row(vals):
+        if vals[0] != 0xFF or 0xFF in get_indicators(vals):
+            return None
+        if not conversions:
+            return get_values(vals) if make_row is tuple else make_row(get_values(vals))
+        row = list(get_values(vals))
+        for i, convert in conversions:
+            row[i] = convert(row[i])
+        return make_row(row)
+
+    def decode_fixed_rows(b, results):
+        pos = 0
+        while True:
+            # unpack the run of rows without nulls at once
+            whole = (len(b) - pos) // size * size
+            if whole:
+                for vals in st.iter_unpack(memoryview(b)[pos:pos + whole]):
+                    r = to_row(vals)
+                    if r is None:
+                        break
+                    results.append(r)
+                    pos += size
+            # a row with nulls, the end of rows or a row continued in the next block
+            if pos + 2 > len(b):
+                return b[pos:]
+            if b[pos] != 0xff:
+                return b''
+            try:
+                r, pos = decode_row(b, pos + 2)
+            except EOFError:
+                return b[pos:]
+            results.append(r)
+    return decode_fixed_rows
+
+
+def _named_row_repr(self):
+    return 'NamedRow(%s)' % ', '.join('%s=%r' % (name, v) for name, v in zip(self._fields, self))
+
+
+def _named_row_asdict(self):
+    return dict(zip(self._fields, self))
+
+
+_named_rows = {}    # column names -> NamedRow class
+
+
+def named_row(description):
+    """
+    row_factory of rows with the values by the column names as attributes.
+    return a tuple subclass for the column names of description, created once for each names.
+    """
+    names = tuple(d[0] for d in description)
+    cls = _named_rows.get(names)
+    if cls is None:
+        attrs = {'__slots__': (), '_fields': names, '__repr__': _named_row_repr, '_asdict': _named_row_asdict}
+        for i, name in enumerate(names):
+            if name.isidentifier() and not name.startswith('_') and name not in attrs and not hasattr(tuple, name):
+                attrs[name] = property(operator.itemgetter(i))
+        if len(_named_rows) >= 256:
+            _named_rows.clear()
+        cls = _named_rows[names] = type('NamedRow', (tuple, ), attrs)
+    return cls
+
+
+class Column:
+    """
+    Values of a result column.
+    values is an array.array for integer and float columns, a list for others.
+    nulls has one byte for each row, 1 if the value is NULL (0 or None in values).
+    """
+    def __init__(self, name, typecode=None):
+        self.name = name
+        self.typecode = typecode
+        self.values = array.array(typecode) if typecode else []
+        self.nulls = bytearray()
+
+    def __len__(self):
+        return len(self.nulls)
+
+    def __repr__(self):
+        return "Column(%r, %r)" % (self.name, self.to_list())
+
+    def append(self, v):
+        if v is None:
+            self.nulls.append(1)
+            self.values.append(0 if self.typecode else None)
+        else:
+            self.nulls.append(0)
+            self.values.append(v)
+
+    def extend(self, values):
+        "append values without NULL"
+        self.values.extend(values)
+        self.nulls.extend(bytes(len(values)))
+
+    def split(self, n):
+        "return columns of the first n values and the rest"
+        head, tail = Column(self.name, self.typecode), Column(self.name, self.typecode)
+        head.values, tail.values = self.values[:n], self.values[n:]
+        head.nulls, tail.nulls = self.nulls[:n], self.nulls[n:]
+        return head, tail
+
+    def to_list(self):
+        return [None if null else v for v, null in zip(self.values, self.nulls)]
+
+
+_COLUMN_TYPECODES = {
+    consts.DB2_SQLTYPE_SMALL: 'h', consts.DB2_SQLTYPE_NSMALL: 'h',
+    consts.DB2_SQLTYPE_INTEGER: 'i', consts.DB2_SQLTYPE_NINTEGER: 'i',
+    consts.DB2_SQLTYPE_BIGINT: 'q', consts.DB2_SQLTYPE_NBIGINT: 'q',
+}
+
+
+def new_columns(description):
+    "empty columns for cursor.description"
+    columns = []
+    for d in description:
+        name, sqltype, _, internal_size = d[:4]
+        if sqltype in (consts.DB2_SQLTYPE_FLOAT, consts.DB2_SQLTYPE_NFLOAT):
+            typecode = 'f' if internal_size == 4 else 'd'
+        else:
+            typecode = _COLUMN_TYPECODES.get(sqltype)
+        columns.append(Column(name, typecode))
+    return columns
+
+
+def append_row(columns, row):
+    for c, v in zip(columns, row):
+        c.append(v)
+
+
+def append_rows(columns, rows):
+    "append row tuples to columns (list of Column or NumpyColumns)"
+    if isinstance(columns, NumpyColumns):
+        columns.append_rows(rows)
+    else:
+        for r in rows:
+            append_row(columns, r)
+
+
+def _compile_column_decoder(qrydsc, endian, modes=None):
+    decode_row = _compile_row_decoder(qrydsc, endian, modes)
+    layout = _fixed_row_layout(qrydsc, endian, modes)
+    if layout is None:
+        st = None
+    else:
+        st, indicators, values, conversions = layout
+        size = st.size
+        get_indicators = _items_getter(indicators) if indicators else lambda v: ()
+        conversions = dict(conversions)
+
+    def decode_columns(b, columns):
+        pos = 0
+        while True:
+            if st is not None and len(b) - pos >= size:
+                # transpose the run of rows without nulls
+                run = []
+                for vals in st.iter_unpack(memoryview(b)[pos:pos + (len(b) - pos) // size * size]):
+                    if vals[0] != 0xFF or 0xFF in get_indicators(vals):
+                        break
+                    run.append(vals)
+                if run:
+                    items = list(zip(*run))
+                    converted = [
+                        list(map(conversions[i], items[j])) if i in conversions else items[j]
+                        for i, j in enumerate(values)
+                    ]
+                    for c, v in zip(columns, converted):
+                        c.extend(v)
+                    pos += len(run) * size
+            # a row with nulls, the end of rows or a row continued in the next block
+            if pos + 2 > len(b):
+                return b[pos:]
+            if b[pos] != 0xff:
+                return b''
+            try:
+                r, pos = decode_row(b, pos + 2)
+            except EOFError:
+                return b[pos:]
+            append_row(columns, r)
+    return decode_columns
+
+
+_NUMPY_DTYPES = {
+    consts.DB2_SQLTYPE_SMALL: 'int16', consts.DB2_SQLTYPE_NSMALL: 'int16',
+    consts.DB2_SQLTYPE_INTEGER: 'int32', consts.DB2_SQLTYPE_NINTEGER: 'int32',
+    consts.DB2_SQLTYPE_BIGINT: 'int64', consts.DB2_SQLTYPE_NBIGINT: 'int64',
+    consts.DB2_SQLTYPE_DATE: 'datetime64[D]', consts.DB2_SQLTYPE_NDATE: 'datetime64[D]',
+    consts.DB2_SQLTYPE_TIMESTAMP: 'datetime64[us]', consts.DB2_SQLTYPE_NTIMESTAMP: 'datetime64[us]',
+    consts.DB2_SQLTYPE_BOOLEAN: 'bool', consts.DB2_SQLTYPE_NBOOLEAN: 'bool',
+}
+
+
+def _is_unscaled_decimal(d):
+    "DECIMAL column of cursor.description item d whose unscaled value fits in int64"
+    return d[1] in (consts.DB2_SQLTYPE_DECIMAL, consts.DB2_SQLTYPE_NDECIMAL) and d[4] <= 18
+
+
+def numpy_dtype(d, unscaled_decimal=False):
+    """
+    numpy dtype name of a cursor.description item.
+    DECIMAL(p, s) (p <= 18) is int64 of the unscaled value if unscaled_decimal.
+    """
+    name, sqltype, _, internal_size = d[:4]
+    if sqltype in (consts.DB2_SQLTYPE_FLOAT, consts.DB2_SQLTYPE_NFLOAT):
+        return 'float32' if internal_size == 4 else 'float64'
+    if unscaled_decimal and _is_unscaled_decimal(d):
+        return 'int64'
+    return _NUMPY_DTYPES.get(sqltype, 'object')
+
+
+class NumpyColumns:
+    """
+    Values of result columns in numpy arrays.
+    The arrays are preallocated and grown as rows arrive.
+    """
+    def __init__(self, description, capacity=1024, unscaled_decimal=False):
+        import numpy
+        self.numpy = numpy
+        self.description = description
+        self.unscaled_decimal = unscaled_decimal
+        self.names = [d[0] for d in description]
+        self.nullable = [bool(d[1] & 1) for d in description]   # odd SQL types are nullable
+        self.scales = [d[5] if unscaled_decimal and _is_unscaled_decimal(d) else None for d in description]
+        self.values = [numpy.empty(capacity, numpy_dtype(d, unscaled_decimal)) for d in description]
+        self.masks = [numpy.zeros(capacity, numpy.bool_) for d in description]
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def reserve(self, n):
+        "make room for n more rows"
+        capacity = len(self.masks[0])
+        if self.size + n <= capacity:
+            return
+        capacity = max(capacity * 2, self.size + n)
+        for i, (v, m) in enumerate(zip(self.values, self.masks)):
+            self.values[i] = self.numpy.empty(capacity, v.dtype)
+            self.values[i][:self.size] = v[:self.size]
+            self.masks[i] = self.numpy.zeros(capacity, self.numpy.bool_)
+            self.masks[i][:self.size] = m[:self.size]
+
+    def extend(self, arrays, n):
+        "append n rows without NULL given as one array (or list) for each column"
+        self.reserve(n)
+        for v, a in zip(self.values, arrays):
+            v[self.size:self.size + n] = a
+        self.size += n
+
+    def append_rows(self, rows):
+        "append row tuples"
+        n = len(rows)
+        if not n:
+            return
+        self.reserve(n)
+        for v, m, scale, values in zip(self.values, self.masks, self.scales, zip(*rows)):
+            if scale is not None:
+                values = [None if x is None else int(_as_decimal(x, scale).scaleb(scale)) for x in values]
+            elif v.dtype.kind == 'M' and v.dtype != 'datetime64[D]':
+                # TIMESTAMP decoded in 'str' datetime mode
+                values = [_decode_timestamp(x.encode('ascii')) if isinstance(x, str) else x for x in values]
+            if None in values:
+                m[self.size:self.size + n] = [x is None for x in values]
+                fill = None if v.dtype.hasobject else self.numpy.zeros((), v.dtype)[()]
+                values = [fill if x is None else x for x in values]
+            v[self.size:self.size + n] = values
+        self.size += n
+
+    def arrays(self):
+        "dict of column name and numpy array, masked array if the column is nullable"
+        numpy = self.numpy
+        results = {}
+        for name, nullable, v, m in zip(self.names, self.nullable, self.values, self.masks):
+            v, m = v[:self.size].copy(), m[:self.size].copy()
+            results[name] = numpy.ma.masked_array(v, m) if nullable else v
+        return results
+
+    def record_batch(self):
+        "pyarrow.RecordBatch of the rows"
+        import pyarrow
+        numpy = self.numpy
+        arrays = []
+        for d, v, m, scale in zip(self.description, self.values, self.masks, self.scales):
+            v, m = v[:self.size], m[:self.size]
+            mask = m if m.any() else None
+            if scale is not None:
+                # decimal128 is the 16 bytes little endian two's complement of the unscaled value
+                data = numpy.empty((self.size, 2), '<i8')
+                data[:, 0] = v
+                data[:, 1] = v >> 63
+                validity = None
+                if mask is not None:
+                    validity = pyarrow.py_buffer(numpy.packbits(~mask, bitorder='little'))
+                arrays.append(pyarrow.Array.from_buffers(
+                    pyarrow.decimal128(d[4], scale), self.size,
+                    [validity, pyarrow.py_buffer(data)], int(m.sum())
+                ))
+            elif d[1] in (consts.DB2_SQLTYPE_DECIMAL, consts.DB2_SQLTYPE_NDECIMAL):
+                v = [None if x is None else _as_decimal(x, d[5]) for x in v]
+                arrays.append(pyarrow.array(v, pyarrow.decimal128(d[4], d[5]), mask=mask))
+            else:
+                arrays.append(pyarrow.array(v, mask=mask))
+        return pyarrow.RecordBatch.from_arrays(arrays, names=self.names)
+
+
+_NUMPY_FIELD_FORMATS = {'b': 'i1', 'h': 'i2', 'i': 'i4', 'q': 'i8', 'f': 'f4', 'd': 'f8'}
+
+
+def _numpy_field_converter(t, ps, code, convert, unscaled_decimal):
+    "function converting a field of the numpy row records to an array or list"
+    import numpy
+    if code in _NUMPY_FIELD_FORMATS:
+        return lambda a: a
+    elif unscaled_decimal and t in _DECIMAL_TYPES and ps[0] <= 18:
+        ln = (ps[0] + 2) // 2
+        weights = 10 ** numpy.arange(ln * 2 - 2, -1, -1, dtype=numpy.int64)
+
+        def to_unscaled(a):
+            # packed decimal: a digit in each nibble and the sign in the last nibble
+            b = numpy.ascontiguousarray(a).view('u1').reshape(len(a), ln)
+            nibbles = numpy.empty((len(a), ln * 2), numpy.int64)
+            nibbles[:, 0::2] = b >> 4
+            nibbles[:, 1::2] = b & 0x0F
+            v = nibbles[:, :-1] @ weights
+            return numpy.where(numpy.isin(nibbles[:, -1], (0x0B, 0x0D)), -v, v)
+        return to_unscaled
+    elif t in (DRDA_TYPE_DATE, DRDA_TYPE_NDATE):
+        return lambda a: numpy.ascontiguousarray(a).view('S%d' % a.dtype.itemsize).astype('datetime64[D]')
+    elif t in (DRDA_TYPE_TIMESTAMP, DRDA_TYPE_NTIMESTAMP):
+        def to_datetime64(a):
+            # YYYY-MM-DD-HH.MM.SS.FFFFFF -> YYYY-MM-DDTHH:MM:SS.FFFFFF
+            b = numpy.ascontiguousarray(a).view('u1').reshape(len(a), -1)[:, :26].copy()
+            b[:, 10] = ord('T')
+            b[:, 13] = b[:, 16] = ord(':')
+            return b.view('S%d' % b.shape[1]).ravel().astype('datetime64[us]')
+        return to_datetime64
+    elif convert is None:
+        return lambda a: a.tolist()
+    return lambda a: list(map(convert, a.tolist()))
+
+
+def _compile_numpy_decoder(qrydsc, endian, modes=None, unscaled_decimal=False):
+    import numpy
+    decode_rows = _compile_qrydta_decoder(qrydsc, endian, modes)
+    decode_row = _compile_row_decoder(qrydsc, endian, modes)
+    modes = modes or (None, ) * len(qrydsc)
+
+    names = ['header', 'pad']
+    formats = ['u1', 'V1']
+    indicators = []
+    fields = []
+    for i, (t, ps) in enumerate(qrydsc):
+        fixed = _fixed_width_field(t, ps, endian, modes[i])
+        if fixed is None or t in LOB_TYPES:
+            fixed = None
+            break
+        code, convert = fixed
+        if t in _NULLABLE_TYPES:
+            indicators.append('null%d' % i)
+            names.append(indicators[-1])
+            formats.append('u1')
+        names.append('value%d' % i)
+        if code in _NUMPY_FIELD_FORMATS:
+            formats.append(('>' if endian == 'big' else '<') + _NUMPY_FIELD_FORMATS[code])
+        else:
+            formats.append('V%d' % struct.calcsize(code))
+        fields.append((names[-1], _numpy_field_converter(t, ps, code, convert, unscaled_decimal)))
+
+    if fixed is None:
+        def decode_tuples(b, columns):
+            rows = []
+            rest = decode_rows(b, rows)
+            columns.append_rows(rows)
+            return rest
+        return decode_tuples
+
+    record = numpy.dtype({'names': names, 'formats': formats})
+    size = record.itemsize
+
+    def decode_records(b, columns):
+        pos = 0
+        rows = []       # rows with nulls
+        while True:
+            n = (len(b) - pos) // size
+            if n:
+                # take the run of rows without nulls as strided views of the block
+                records = numpy.frombuffer(b, record, n, pos)
+                invalid = records['header'] != 0xFF
+                for name in indicators:
+                    invalid |= records[name] == 0xFF
+                k = int(invalid.argmax()) if invalid.any() else n
+                if k:
+                    records = records[:k]
+                    arrays = [convert(records[name]) for name, convert in fields]
+                    columns.append_rows(rows)
+                    rows = []
+                    columns.extend(arrays, k)
+                    pos += k * size
+            # a row with nulls, the end of rows or a row continued in the next block
+            if pos + 2 > len(b) or b[pos] != 0xff:
+                break
+            try:
+                r, end = decode_row(b, pos + 2)
+            except EOFError:
+                break
+            rows.append(r)
+            pos = end
+        columns.append_rows(rows)
+        if pos + 2 > len(b) or b[pos] == 0xff:
+            return b[pos:]
+        return b''
+    return decode_records
+
+
+class _PackedCodec:
+    """
+    Decoder of QRYDTA into PackedRows.
+    It appends the offsets of rows in QRYDTA bytes, and decodes a row or a field when it is accessed.
+    """
+    def __init__(self, qrydsc, endian, modes=None, make_row=None):
+        self.qrydsc = qrydsc
+        self.endian = endian
+        self.modes = modes or (None, ) * len(qrydsc)
+        self.skip_row = _compile_row_skipper(qrydsc, endian)
+        self.decode_row = _compile_row_decoder(qrydsc, endian, modes, make_row)
+        self._field_getters = {}
+
+    def __call__(self, b, offsets):
+        "append the offsets of rows in b to offsets. return bytes of the row continued in the next query block"
+        skip_row = self.skip_row
+        pos = 0
+        while True:
+            if pos + 2 > len(b):
+                return b[pos:]
+            if b[pos] != 0xff:
+                return b''
+            try:
+                end = skip_row(b, pos + 2)
+            except EOFError:
+                return b[pos:]
+            offsets.append(pos)
+            pos = end
+
+    def field_getter(self, i):
+        "function(buf, row position) -> value of the i-th field"
+        getter = self._field_getters.get(i)
+        if getter is None:
+            skip_fields = _compile_row_skipper(self.qrydsc[:i], self.endian)
+            t, ps = self.qrydsc[i]
+            decode = _field_decoder(t, ps, self.endian, self.modes[i])
+
+            def getter(buf, pos):
+                return decode(buf, skip_fields(buf, pos + 2))[0]
+            self._field_getters[i] = getter
+        return getter
+
+
+class PackedRows:
+    """
+    Result rows kept as the QRYDTA bytes and the row offsets in them.
+    A row is decoded when it is accessed, and column(i) decodes only the values of a column.
+    With spill_size, the QRYDTA bytes are moved to a temporary file when they exceed spill_size bytes,
+    and they are read through mmap.
+    Rows of queries with LOB columns are not kept in PackedRows, so they are never spilled.
+    make_row: function(list of values) -> row (see named_row()), tuple if None
+    """
+    def __init__(self, qrydsc, endian, modes=None, spill_size=None, make_row=None):
+        self._codec = qrydta_decoder(qrydsc, endian, 'packed', modes, make_row)
+        self.spill_size = spill_size
+        self._blocks = []                       # QRYDTA bytes
+        self._block_index = array.array('I')    # block of each row
+        self._offsets = array.array('I')        # offset of each row in its block
+        self._start = 0                         # rows before it were popped
+        self._size = 0                          # bytes of the blocks
+        self._file = None                       # temporary file of the spilled blocks
+        self._starts = array.array('Q')         # offset of each spilled block in the file
+        self._mmap = None
+
+    def append_qrydta(self, b):
+        "append rows in QRYDTA bytes. return bytes of the last row if it continues in the next query block"
+        n = len(self._offsets)
+        rest = self._codec(b, self._offsets)
+        if len(self._offsets) > n:
+            self._append_block(b, len(self._offsets) - n)
+        return rest
+
+    def _append_block(self, b, n):
+        "append the block of the last n rows"
+        self._block_index.extend([len(self._blocks) + len(self._starts)] * n)
+        if self._file is not None:
+            self._starts.append(self._size)
+            self._file.write(b)
+        else:
+            self._blocks.append(b)
+        self._size += len(b)
+        if self._file is None and self.spill_size is not None and self._size > self.spill_size:
+            self._spill()
+
+    def _spill(self):
+        import tempfile
+        self._file = tempfile.TemporaryFile()
+        pos = 0
+        for b in self._blocks:
+            self._starts.append(pos)
+            self._file.write(b)
+            pos += len(b)
+        self._blocks = []
+
+    def _buffer(self):
+        "mmap of the spilled blocks, mapped again when blocks were appended to the file"
+        if self._mmap is None or len(self._mmap) < self._size:
+            import mmap
+            self._file.flush()
+            if self._mmap is not None:
+                try:
+                    self._mmap.close()
+                except BufferError:
+                    pass    # a view of it is still in use, unmapped when it is released
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._mmap
+
+    def _block(self, j):
+        if self._file is None:
+            return self._blocks[j]
+        end = self._starts[j + 1] if j + 1 < len(self._starts) else self._size
+        return self._buffer()[self._starts[j]:end]
+
+    def _locate(self, i):
+        "buffer and position of the i-th row"
+        if self._file is None:
+            return self._blocks[self._block_index[i]], self._offsets[i]
+        return self._buffer(), self._starts[self._block_index[i]] + self._offsets[i]
+
+    def _row(self, i):
+        buf, pos = self._locate(i)
+        return self._codec.decode_row(buf, pos + 2)[0]
+
+    @property
+    def spilled(self):
+        "True if the rows are kept in a temporary file"
+        return self._file is not None
+
+    def __len__(self):
+        return len(self._offsets) - self._start
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("PackedRows index out of range")
+        return self._row(self._start + i)
+
+    def __iter__(self):
+        for i in range(self._start, len(self._offsets)):
+            yield self._row(i)
+
+    def __repr__(self):
+        return "PackedRows(%d rows)" % len(self)
+
+    def popleft(self):
+        if not len(self):
+            raise IndexError("pop from an empty PackedRows")
+        self._start += 1
+        return self._row(self._start - 1)
+
+    def clear(self):
+        "remove all rows and the temporary file"
+        if self._mmap is not None:
+            self._mmap.close()
+        if self._file is not None:
+            self._file.close()
+        self._blocks = []
+        self._block_index = array.array('I')
+        self._offsets = array.array('I')
+        self._start = 0
+        self._size = 0
+        self._file = None
+        self._starts = array.array('Q')
+        self._mmap = None
+
+    def extend(self, rows):
+        "append the rows of another PackedRows of the same query"
+        index = rows._block_index
+        i = rows._start
+        while i < len(index):
+            # rows of a block are contiguous
+            end = bisect.bisect_right(index, index[i], i)
+            self._offsets.extend(rows._offsets[i:end])
+            self._append_block(rows._block(index[i]), end - i)
+            i = end
+
+    def column(self, i):
+        "list of the values of i-th column"
+        get = self._codec.field_getter(i)
+        offsets = self._offsets[self._start:]
+        index = self._block_index[self._start:]
+        if self._file is None:
+            blocks = self._blocks
+            return [get(blocks[b], offset) for b, offset in zip(index, offsets)]
+        buf, starts = self._buffer(), self._starts
+        return [get(buf, starts[b] + offset) for b, offset in zip(index, offsets)]
+
+
+_qrydta_decoders = {}   # (QRYDSC bytes, endian, columnar, field modes, make_row) -> QRYDTA decoder
+
+_qrydta_compilers = {
+    False: _compile_qrydta_decoder,
+    True: _compile_column_decoder,
+    'numpy': _compile_numpy_decoder,
+    'numpy_unscaled': lambda qrydsc, endian, modes: _compile_numpy_decoder(qrydsc, endian, modes, True),
+    'packed': _PackedCodec,
+}
+
+
+def qrydta_decoder(qrydsc, endian, columnar=False, modes=None, make_row=None):
+    """
+    decoder of QRYDTA rows described by QRYDSC, compiled once for each descriptor.
+    return function(QRYDTA bytes, results) -> bytes of the row continued in the next query block
+    results is a list of Column if columnar is True,
+    NumpyColumns if columnar is 'numpy' or 'numpy_unscaled' (with unscaled decimals),
+    PackedRows if columnar is 'packed'.
+    modes: decoding mode of each field (see field_modes())
+    make_row: function(list of values) -> row of tuple and packed rows (see named_row())
+    """
+    key = (b''.join([bytes([t]) + bytes(ps) for t, ps in qrydsc]), endian, columnar, modes, make_row)
+    decode = _qrydta_decoders.get(key)
+    if decode is None:
+        if len(_qrydta_decoders) >= 256:
+            _qrydta_decoders.clear()
+        compile = _qrydta_compilers[columnar]
+        decode = compile(qrydsc, endian, modes, make_row) if make_row else compile(qrydsc, endian, modes)
+        _qrydta_decoders[key] = decode
+    return decode
+
+
+def parse_qrydta(qrydsc, b, endian, results, modes=None, make_row=None):
+    """
+    parse rows in QRYDTA bytes b and append them to results.
+    return bytes of the last row if it continues in the next query block.
+    """
+    return qrydta_decoder(qrydsc, endian, False, modes, make_row)(b, results)
+
+
+def parse_qrydta_columns(qrydsc, b, endian, columns, modes=None):
+    """
+    parse rows in QRYDTA bytes b and append their values to columns (list of Column or NumpyColumns).
+    return bytes of the last row if it continues in the next query block.
+    """
+    if isinstance(columns, NumpyColumns):
+        columnar = 'numpy_unscaled' if columns.unscaled_decimal else 'numpy'
+    else:
+        columnar = True
+    return qrydta_decoder(qrydsc, endian, columnar, modes)(b, columns)
+
+
+LOB_MODES = ('value', 'file', 'locator')
+LOB_SPOOL_SIZE = 1024 * 1024    # EXTDTA longer than it is spooled to a temporary file
+
+
+def new_lob_file():
+    "file to spool an EXTDTA object to"
+    import tempfile
+    return tempfile.SpooledTemporaryFile(LOB_SPOOL_SIZE)
+
+
+class LobReader(io.RawIOBase):
+    """
+    Binary file-like object of a LOB value in EXTDTA.
+    data is the EXTDTA bytes or the file it was spooled to, the value begins at start.
+    """
+    def __init__(self, data, start=0):
+        self._data = data
+        self._start = start
+        self._pos = 0
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            self.size = len(data) - start
+        else:
+            self.size = data.seek(0, io.SEEK_END) - start
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        n = max(min(len(b), self.size - self._pos), 0)
+        if n == 0:
+            return 0
+        pos = self._start + self._pos
+        if isinstance(self._data, (bytes, bytearray, memoryview)):
+            b[:n] = self._data[pos:pos + n]
+        else:
+            self._data.seek(pos)
+            n = self._data.readinto(memoryview(b)[:n])
+        self._pos += n
+        return n
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise ValueError("negative seek position %d" % offset)
+        self._pos = offset
+        return offset
+
+    def tell(self):
+        return self._pos
+
+    def close(self):
+        if not self.closed and not isinstance(self._data, (bytes, bytearray, memoryview)):
+            self._data.close()
+        super().close()
+
+
+def lob_value(data, t, encoding):
+    "bytes or str of the LOB value of DRDA type t in EXTDTA data"
+    if t in INLINE_LOB_TYPES:
+        # EXTDTA for inline LOBs has a leading status byte (0x00 = valid)
+        data = data[1:]
+    data = bytes(data)
+    if t not in CLOB_TYPES:
+        return data
+    return data.decode('utf-8' if t in INLINE_LOB_TYPES else encoding)
+
+
+def lob_reader(data, t, encoding):
+    """
+    file-like object of the LOB value of DRDA type t in EXTDTA data (bytes or spooled file).
+    LobReader for binary LOBs, text file for character LOBs.
+    """
+    if isinstance(data, memoryview):
+        data = bytes(data)
+    reader = LobReader(data, 1 if t in INLINE_LOB_TYPES else 0)
+    if t not in CLOB_TYPES:
+        return reader
+    return io.TextIOWrapper(io.BufferedReader(reader), 'utf-8' if t in INLINE_LOB_TYPES else encoding)
+
+
+# LOB columns are overridden to these locator types with lob_mode='locator'
+_LOCATOR_TYPES = {
+    DRDA_TYPE_LOBBYTES: DRDA_TYPE_LOBLOC,
+    DRDA_TYPE_NLOBBYTES: DRDA_TYPE_NLOBLOC,
+    DRDA_TYPE_LOBCSBCS: DRDA_TYPE_CLOBLOC,
+    DRDA_TYPE_NLOBCSBCS: DRDA_TYPE_NCLOBLOC,
+}
+
+
+def locator_qrydsc(qrydsc):
+    "qrydsc with the LOB columns returned as 4 bytes locators instead of EXTDTA"
+    return [(_LOCATOR_TYPES[t], b'\x00\x04') if t in _LOCATOR_TYPES else (t, ps) for t, ps in qrydsc]
+
+
+def _lob_sql_type(t):
+    return 'CLOB' if t in CLOB_TYPES else 'BLOB'
+
+
+def lob_length_sql(t):
+    "statement to get the length in bytes of the LOB value of the locator parameter"
+    return "VALUES LENGTH(CAST(? AS {}(2G)))".format(_lob_sql_type(t))
+
+
+def lob_substr_sql(t):
+    "statement to get bytes of the LOB value of the locator parameter, from the position and length parameters"
+    return "VALUES BLOB(SUBSTR(CAST(? AS {}(2G)), CAST(? AS INTEGER), CAST(? AS INTEGER)))".format(_lob_sql_type(t))
+
+
+class LobLocator(LobReader):
+    """
+    Binary file-like object of a LOB value referenced by a locator (lob_mode='locator').
+    The data is fetched from the server when it is read. The locator is valid until the end of the transaction.
+    It can be a BLOB or CLOB parameter of other statements, the value is not sent over the network then.
+    """
+    def __init__(self, connection, locator, t):
+        self._connection = connection
+        self.locator = bytes(locator)
+        self.type = t
+        self._pos = 0
+        self._size = None
+
+    @property
+    def size(self):
+        if self._size is None:
+            self._size = self._connection._lob_length(self)
+        return self._size
+
+    def readinto(self, b):
+        n = max(min(len(b), self.size - self._pos), 0)
+        if n == 0:
+            return 0
+        data = self._connection._lob_substr(self, self._pos, n)
+        n = len(data)
+        b[:n] = data
+        self._pos += n
+        return n
+
+    def close(self):
+        io.RawIOBase.close(self)
+
+    def __repr__(self):
+        return '<{} {} {}>'.format(self.__class__.__name__, _lob_sql_type(self.type), self.locator.hex())
+
+
+class AsyncLobLocator:
+    """
+    LobLocator of a drda.aio connection. length() and read() are coroutines.
+    read() returns bytes for BLOB and str for CLOB values.
+    """
+    def __init__(self, connection, locator, t, encoding):
+        self._connection = connection
+        self.locator = bytes(locator)
+        self.type = t
+        self._pos = 0
+        self._size = None
+        self._decoder = codecs.getincrementaldecoder(encoding)() if t in CLOB_TYPES else None
+
+    async def length(self):
+        "length of the value in bytes"
+        if self._size is None:
+            self._size = await self._connection._lob_length(self)
+        return self._size
+
+    async def read(self, size=-1):
+        rest = max(await self.length() - self._pos, 0)
+        n = rest if size is None or size < 0 else min(size, rest)
+        data = await self._connection._lob_substr(self, self._pos, n) if n else b''
+        self._pos += len(data)
+        if self._decoder is None:
+            return data
+        return self._decoder.decode(data, self._pos >= self._size)
+
+    def seek(self, offset):
+        self._pos = offset
+        if self._decoder:
+            self._decoder.reset()
+        return offset
+
+    def tell(self):
+        return self._pos
+
+    def __repr__(self):
+        return '<{} {} {}>'.format(self.__class__.__name__, _lob_sql_type(self.type), self.locator.hex())
+
+
+def lob_locator(connection, locator, t, encoding):
+    "LobLocator of a locator of DRDA type t, in a text file for character LOBs"
+    lob = LobLocator(connection, locator, t)
+    if t not in CLOB_TYPES:
+        return lob
+    return io.TextIOWrapper(io.BufferedReader(lob), encoding)
+
+
+class QueryOptions:
+    """
+    How a query is fetched and its rows are decoded, the attributes of the cursor executing it.
+    maxblkext, qryrowset: extra query blocks and rows per OPNQRY/CNTQRY request
+    decimal_mode, datetime_mode: see field_modes()
+    packed, spill_size: rows are kept in PackedRows, spill_size bytes of them in memory
+    row_factory: function(description) -> function(list of values) -> row (see named_row())
+    lob_mode: one of LOB_MODES
+    """
+    def __init__(
+        self, maxblkext=-1, qryrowset=None, decimal_mode=None, datetime_mode=None,
+        packed=False, spill_size=None, row_factory=None, lob_mode='value',
+    ):
+        self.maxblkext = maxblkext
+        self.qryrowset = qryrowset
+        self.decimal_mode = decimal_mode
+        self.datetime_mode = datetime_mode
+        self.packed = packed
+        self.spill_size = spill_size
+        self.row_factory = row_factory
+        self.lob_mode = lob_mode
 
 
 def escape_parameter(v):
@@ -25,6 +25,7 @@
 """Tests for db2 (asyncio)"""
 import unittest
 import asyncio
+import io
 import os
 import decimal
 import datetime
@@ -33,7 +34,8 @@ import drda.aio
 from drda import ddm
 from drda import codepoint as cp
 from drda.aio.stream import AsyncSocketStream
-from drda.aio.connection import _read_dss, _write_request_dss
+from drda.aio.connection import _read_dss, _write_request_dss, _write_request_chain
+from test_db2 import FakeSock, _build_dss_frame, _build_continued_dss_frame, _fake_connection
 
 HOST = os.environ.get("DB2_HOST", "localhost")
 DATABASE = os.environ.get("DB2_DATABASE", "testdb")
@@ -43,34 +45,6 @@ PORT = int(os.environ.get("DB2_PORT", 50000))
 SSL_CLIENT_CERT_PATH = os.environ.get("SSL_CLIENT_CERT_PATH")
 
 
-class FakeSock:
-    "Synchronous fake socket for comparison with the async stream"
-    def __init__(self, data=b''):
-        self.data = bytearray(data)
-        self.sent = bytearray()
-
-    def recv(self, nbytes):
-        r = bytes(self.data[:nbytes])
-        del self.data[:nbytes]
-        return r
-
-    def send(self, b):
-        self.sent += b
-
-
-def _build_dss_frame(code_point, obj, cur_id=1, flag=1):
-    obj_ln = len(obj) + 4
-    dss_ln = obj_ln + 6
-    return (
-        dss_ln.to_bytes(2, byteorder='big') +
-        bytes([0xD0, flag]) +
-        cur_id.to_bytes(2, byteorder='big') +
-        obj_ln.to_bytes(2, byteorder='big') +
-        code_point.to_bytes(2, byteorder='big') +
-        obj
-    )
-
-
 class TestAsyncDSS(unittest.TestCase):
     """DSS packet read/write parity tests (no database server required)."""
 
@@ -102,12 +76,52 @@ class TestAsyncDSS(unittest.TestCase):
 
         asyncio.run(run())
 
+    def test_write_request_chain(self):
+        "a request chain must be sent in one write with the same bytes as per-DSS writes"
+        async def run():
+            packets = [
+                (ddm.packPRPSQLSTT('SYSSH200', 'SYSLVL01', 65, 'testdb'), True),
+                (ddm.packSQLSTT('SELECT 1 FROM sysibm.sysdummy1'), False),
+                (ddm.packOPNQRY('SYSSH200', 'SYSLVL01', 65, 'testdb', 65535), False),
+            ]
+            expected = FakeSock()
+            cur_id = 1
+            for i, (packet, same_id) in enumerate(packets):
+                cur_id = ddm.write_request_dss(expected, packet, cur_id, same_id, i == len(packets) - 1)
+
+            chain = ddm.RequestChain()
+            for packet, same_id in packets:
+                chain.append(packet, same_id)
+            sent = FakeSock()
+            ddm.write_request_chain(sent, chain)
+            self.assertEqual(bytes(sent.sent), bytes(expected.sent))
+
+            received = []
+            done = asyncio.Event()
+
+            async def handle(reader, writer):
+                received.append(await reader.read(4096))
+                writer.close()
+                done.set()
+
+            server = await asyncio.start_server(handle, '127.0.0.1', 0)
+            port = server.sockets[0].getsockname()[1]
+            async with server:
+                stream = AsyncSocketStream('127.0.0.1', port)
+                await stream.connect()
+                await _write_request_chain(stream, chain)
+                await stream.close()
+                await asyncio.wait_for(done.wait(), timeout=5)
+            self.assertEqual(bytes(received[0]), bytes(expected.sent))
+
+        asyncio.run(run())
+
     def test_read_dss(self):
         "async _read_dss must parse the same result as ddm.read_dss"
         async def run():
             obj = b'\x01\x02\x03\x04\x05'
             frame = _build_dss_frame(cp.SQLCARD, obj)
-            expected = ddm.read_dss(FakeSock(frame))
+            expected = ddm.read_dss(ddm.ReceiveBuffer(FakeSock(frame)))
 
             async def handle(reader, writer):
                 writer.write(frame)
@@ -127,6 +141,59 @@ class TestAsyncDSS(unittest.TestCase):
 
         asyncio.run(run())
 
+    def test_read_continued_dss(self):
+        "DSS continuation segments of any count must be joined by both readers"
+        async def run():
+            obj = bytes(range(256)) * 1024   # 256 KB query block
+            frame = _build_continued_dss_frame(cp.QRYDTA, obj)
+            expected = ddm.read_dss(ddm.ReceiveBuffer(FakeSock(frame)))
+            self.assertEqual(expected[3], cp.QRYDTA)
+            self.assertEqual(expected[4], obj)
+
+            async def handle(reader, writer):
+                writer.write(frame)
+                await writer.drain()
+                writer.close()
+
+            server = await asyncio.start_server(handle, '127.0.0.1', 0)
+            port = server.sockets[0].getsockname()[1]
+            async with server:
+                stream = AsyncSocketStream('127.0.0.1', port)
+                await stream.connect()
+                result = await _read_dss(stream)
+                await stream.close()
+            self.assertEqual(result, expected)
+
+        asyncio.run(run())
+
+    def test_spool_extdta(self):
+        "EXTDTA longer than a DSS segment is written to the file by both readers"
+        async def run():
+            data = bytes(range(256)) * 512
+            obj = len(data).to_bytes(4, byteorder='big') + data + b'\x00' * 10
+            frame = _build_continued_dss_frame(cp.EXTDTA, obj)
+            # 4 bytes extended length field
+            frame = frame[:6] + (0x8008).to_bytes(2, byteorder='big') + frame[8:]
+            expected = ddm.read_dss(ddm.ReceiveBuffer(FakeSock(frame)), io.BytesIO)
+            self.assertEqual(expected[4].read(), data)
+
+            async def handle(reader, writer):
+                writer.write(frame)
+                await writer.drain()
+                writer.close()
+
+            server = await asyncio.start_server(handle, '127.0.0.1', 0)
+            port = server.sockets[0].getsockname()[1]
+            async with server:
+                stream = AsyncSocketStream('127.0.0.1', port)
+                await stream.connect()
+                result = await _read_dss(stream, io.BytesIO)
+                await stream.close()
+            self.assertEqual(result[3], cp.EXTDTA)
+            self.assertEqual(result[4].read(), data)
+
+        asyncio.run(run())
+
     def test_invalid_dss(self):
         "async _read_dss must reject invalid DSS packets"
         async def run():
@@ -147,6 +214,17 @@ class TestAsyncDSS(unittest.TestCase):
         asyncio.run(run())
 
 
+class TestAsyncCursor(unittest.IsolatedAsyncioTestCase):
+    async def test_falsy_rows(self):
+        "rows made by a row_factory may be falsy, only None ends the rows"
+        import collections
+        from drda.aio.cursor import AsyncCursor
+        cur = AsyncCursor(_fake_connection())
+        cur._rows = collections.deque([0, '', ()])
+        self.assertEqual(await cur.fetchmany(2), [0, ''])
+        self.assertEqual([r async for r in cur], [()])
+
+
 class TestAsyncBasic(unittest.IsolatedAsyncioTestCase):
 
     async def asyncSetUp(self):
@@ -228,6 +306,26 @@ class TestAsyncBasic(unittest.IsolatedAsyncioTestCase):
         with self.assertRaises(drda.OperationalError):
             await cur.execute("invalid query")
 
+    async def test_executemany(self):
+        cur = self.connection.cursor()
+        rows = [('s{}'.format(i), i, decimal.Decimal('1.5'), None) for i in range(5000)]
+        await cur.executemany("INSERT INTO test_basic (s, i, d1, d2) VALUES (?, ?, ?, ?)", rows)
+        await cur.execute("SELECT count(*), sum(i) FROM test_basic")
+        self.assertEqual(await cur.fetchone(), (5000, sum(range(5000))))
+
+    async def test_streaming(self):
+        cur = self.connection.cursor()
+        await cur.executemany(
+            "INSERT INTO test_basic (s, i) VALUES (?, ?)", [('s{}'.format(i), i) for i in range(10000)]
+        )
+        cur = self.connection.cursor(streaming=True)
+        await cur.execute("SELECT i FROM test_basic ORDER BY i")
+        self.assertEqual(await cur.fetchone(), (0,))
+        self.assertEqual(len(await cur.fetchall()), 9999)
+        await cur.execute("SELECT i FROM test_basic WHERE i >= ? ORDER BY i", [100])
+        self.assertEqual(await cur.fetchmany(2), [(100,), (101,)])
+        await cur.close()
+
     async def test_async_iterator(self):
         cur = self.connection.cursor()
         await cur.execute("""
@@ -29,6 +29,8 @@ import decimal
 import datetime
 import decimal
 import drda
+from drda import ddm
+from drda import codepoint as cp
 
 HOST = os.environ.get("DB2_HOST", "localhost")
 DATABASE = os.environ.get("DB2_DATABASE", "testdb")
@@ -37,6 +39,141 @@ PASSWORD = os.environ.get("DB2_PASSWORD", "password")
 PORT = int(os.environ.get("DB2_PORT", 50000))
 SSL_CLIENT_CERT_PATH = os.environ.get("SSL_CLIENT_CERT_PATH")
 
+
+class FakeSock:
+    "Fake socket replying data and recording what is sent"
+    def __init__(self, data=b''):
+        self.data = bytearray(data)
+        self.sent = bytearray()
+
+    def recv(self, nbytes):
+        r = bytes(self.data[:nbytes])
+        del self.data[:nbytes]
+        return r
+
+    def recv_into(self, buf):
+        r = self.recv(len(buf))
+        buf[:len(r)] = r
+        return len(r)
+
+    def send(self, b):
+        self.sent += b
+
+    def sendall(self, b):
+        self.sent += b
+
+    def setsockopt(self, *args):
+        pass
+
+    def settimeout(self, timeout):
+        pass
+
+    def connect(self, address):
+        pass
+
+    def close(self):
+        pass
+
+
+def _build_dss_frame(code_point, obj, cur_id=1, flag=1):
+    obj_ln = len(obj) + 4
+    dss_ln = obj_ln + 6
+    return (
+        dss_ln.to_bytes(2, byteorder='big') +
+        bytes([0xD0, flag]) +
+        cur_id.to_bytes(2, byteorder='big') +
+        obj_ln.to_bytes(2, byteorder='big') +
+        code_point.to_bytes(2, byteorder='big') +
+        obj
+    )
+
+
+def _build_continued_dss_frame(code_point, obj, cur_id=1, flag=1):
+    "DSS longer than 32767 bytes, split into continuation segments"
+    b = (0xFFFF).to_bytes(2, byteorder='big') + bytes([0xD0, flag]) + cur_id.to_bytes(2, byteorder='big')
+    b += (0x8004).to_bytes(2, byteorder='big') + code_point.to_bytes(2, byteorder='big')
+    b += obj[:0x7FFF - 10]
+    obj = obj[0x7FFF - 10:]
+    while obj:
+        page, obj = obj[:0x7FFF - 2], obj[0x7FFF - 2:]
+        ln = 0xFFFF if obj else len(page) + 2
+        b += ln.to_bytes(2, byteorder='big') + page
+    return b
+
+
+def _fake_connection(reply=b'', **kwargs):
+    """
+    Connection made by Connection.__init__ on a FakeSock, without a database server.
+    The socket replies to the connection handshake and then reply. kwargs: options of drda.connect()
+    """
+    from unittest import mock
+    from drda import consts
+    from drda.connection import Connection
+    # the server chooses user id and password authentication
+    handshake = _build_dss_frame(cp.ACCSECRD, ddm._pack_uint(cp.SECMEC, consts.SECMEC_USRIDPWD, 2), flag=2)
+    handshake += _build_dss_frame(cp.ACCRDBRM, b'', flag=2)
+    handshake += _build_dss_frame(cp.SQLCARD, b'\xff', flag=2)     # SET statements and commit
+    sock = FakeSock(handshake + reply)
+    with mock.patch('socket.socket', lambda *args: sock):
+        conn = Connection(HOST, DATABASE, PORT, USER, PASSWORD, False, None, None, **kwargs)
+    sock.sent = bytearray()
+    return conn
+
+
+class TestDSS(unittest.TestCase):
+    def test_read_dss_buffered(self):
+        "ddm.read_dss must return consecutive DSS packets from one buffer as memoryview"
+        objs = [b'\x01' * 10, b'\x02' * 100, b'\x03' * 1000]
+        data = b''.join(_build_dss_frame(cp.QRYDTA, obj) for obj in objs)
+        buf = ddm.ReceiveBuffer(FakeSock(data), bufsize=256)
+        for obj in objs:
+            result = ddm.read_dss(buf)
+            self.assertIsInstance(result[4], memoryview)
+            self.assertEqual(result[4], obj)
+        with self.assertRaises(ConnectionError):
+            ddm.read_dss(buf)
+
+    def test_reply_keeps_no_view(self):
+        "what a reply keeps of the query blocks does not reference the receive buffer"
+        from drda import utils
+        from drda.connection import _Reply
+        qrydsc = bytes([utils.DRDA_TYPE_NINTEGER, 0, 4, utils.DRDA_TYPE_NVARCHAR, 0, 0x20])
+        row = b'\xff\x00' + b'\x00\x01\x00\x00\x00' + b'\x00\x00\x03abc'
+        data = _build_dss_frame(cp.QRYDSC, bytes([len(qrydsc) + 3]) + b'\x76\xd0' + qrydsc)
+        data += _build_dss_frame(cp.QRYDTA, row + row[:7])
+        data += _build_dss_frame(cp.QRYDTA, row[7:] + b'\x00\x00')
+        buf = ddm.ReceiveBuffer(FakeSock(data))
+        reply = _Reply(_fake_connection())
+        reply.add(ddm.read_dss(buf))
+        reply.add(ddm.read_dss(buf))
+        self.assertIsInstance(reply.qrydsc[1][1], bytes)
+        self.assertIsInstance(reply.qrydta_rest, bytes)
+        reply.add(ddm.read_dss(buf))
+        self.assertEqual(list(reply.results), [(1, 'abc'), (1, 'abc')])
+
+    def test_lob_reader(self):
+        "EXTDTA longer than a DSS segment spooled to a file, read by chunks"
+        import io
+        from drda import utils
+        data = bytes(range(256)) * 512
+        obj = len(data).to_bytes(4, byteorder='big') + data + b'\x00' * 10
+        frame = _build_continued_dss_frame(cp.EXTDTA, obj)
+        # 4 bytes extended length field
+        frame = frame[:6] + (0x8008).to_bytes(2, byteorder='big') + frame[8:]
+        reader = utils.lob_reader(ddm.read_dss(ddm.ReceiveBuffer(FakeSock(frame)), utils.new_lob_file)[4],
+                                  utils.DRDA_TYPE_NLOBLOC, 'cp500')
+        self.assertEqual(reader.size, len(data))
+        buf = bytearray(50000)
+        self.assertEqual(reader.readinto(buf), 50000)
+        self.assertEqual(buf, data[:50000])
+        self.assertEqual(reader.read(), data[50000:])
+        reader.seek(-6, io.SEEK_END)
+        self.assertEqual(reader.read(100), data[-6:])
+        reader.close()
+        text = utils.lob_reader(b'\x00' + 'h\xe9llo'.encode('utf-8'), utils.DRDA_TYPE_NLOBCSBCS, 'cp500')
+        self.assertEqual(text.read(), 'h\xe9llo')
+
+
 class TestBasic(unittest.TestCase):
 
     def setUp(self):
@@ -141,6 +278,49 @@ class TestBasic(unittest.TestCase):
         with self.assertRaises(drda.OperationalError):
             cur.execute("invalid query"),
 
+    def test_autocommit(self):
+        self.connection.autocommit = False
+        cur = self.connection.cursor()
+        cur.execute("INSERT INTO test_basic (s, i) VALUES (?, ?)", ['A', 1])
+        cur.execute("INSERT INTO test_basic (s, i) VALUES ('B', 2)")
+        self.connection.rollback()
+        cur.execute("SELECT count(*) FROM test_basic")
+        self.assertEqual(cur.fetchone()[0], 0)
+
+        cur.execute("INSERT INTO test_basic (s, i) VALUES (?, ?)", ['A', 1])
+        self.connection.commit()
+        cur.execute("SELECT count(*) FROM test_basic")
+        self.assertEqual(cur.fetchone()[0], 1)
+
+        # begin() suspends autocommit until commit() or rollback()
+        self.connection.autocommit = True
+        self.connection.begin()
+        cur.execute("INSERT INTO test_basic (s, i) VALUES (?, ?)", ['B', 2])
+        self.connection.rollback()
+        cur.execute("SELECT count(*) FROM test_basic")
+        self.assertEqual(cur.fetchone()[0], 1)
+
+    def test_executemany(self):
+        cur = self.connection.cursor()
+        rows = [('s{}'.format(i), i, decimal.Decimal('1.5'), None) for i in range(5000)]
+        cur.executemany("INSERT INTO test_basic (s, i, d1, d2) VALUES (?, ?, ?, ?)", rows)
+        cur.execute("SELECT count(*), sum(i) FROM test_basic")
+        self.assertEqual(cur.fetchone(), (5000, sum(range(5000))))
+
+    def test_streaming(self):
+        cur = self.connection.cursor()
+        cur.executemany("INSERT INTO test_basic (s, i) VALUES (?, ?)", [('s{}'.format(i), i) for i in range(10000)])
+        cur = self.connection.cursor(streaming=True)
+        cur.execute("SELECT i FROM test_basic ORDER BY i")
+        self.assertEqual(cur.fetchone(), (0,))
+        self.assertEqual(len(list(cur)), 9999)
+        # close the query before all rows are fetched
+        cur.execute("SELECT i FROM test_basic WHERE i >= ? ORDER BY i", [100])
+        self.assertEqual(cur.fetchmany(2), [(100,), (101,)])
+        cur.execute("SELECT count(*) FROM test_basic")
+        self.assertEqual(cur.fetchone(), (10000,))
+        cur.close()
+
     def test_issue18(self):
         cur = self.connection.cursor()
         try:
@@ -492,6 +672,702 @@ class TestNewTypes(unittest.TestCase):
         self.assertEqual(row[0], 1)
 
 
+class TestMultiRowInput(unittest.TestCase):
+    def test_append_multi_row_execute(self):
+        from drda import ddm
+        from drda import codepoint as cp
+        from drda.connection import _Statement, _append_multi_row_execute
+        conn = _fake_connection()
+        desc = [('', 449, 20, 20, 0, 0, None)]
+        stmt = _Statement('INSERT INTO t VALUES (?)', 1, desc, None)
+        fdodsc = ddm.packFDODSC(desc)
+        fdodta_list = [ddm.packFDODTA(desc, ['x' * 100], 'little', fdodsc) for _ in range(1000)]
+        chain = ddm.RequestChain()
+        _append_multi_row_execute(chain, conn, stmt, fdodsc, fdodta_list)
+
+        # one SQLDTA of all the rows, sent in continued DSS segments
+        (excsqlstt, same_id), (sqldta, _) = chain.objects
+        self.assertTrue(same_id)
+        self.assertEqual(int.from_bytes(excsqlstt[2:4], 'big'), cp.EXCSQLSTT)
+        self.assertEqual(int.from_bytes(ddm.parse_reply(excsqlstt[4:])[cp.NBRROW], 'big'), 1000)
+        self.assertEqual(sqldta, ddm.packSQLDTA_rows(fdodsc, fdodta_list))
+        self.assertGreater(len(sqldta), 32767)
+        buf = ddm.ReceiveBuffer(FakeSock(b''.join(chain.buffers())))
+        self.assertEqual(ddm.read_dss(buf)[3], cp.EXCSQLSTT)
+        _, _, _, code_point, obj = ddm.read_dss(buf)
+        self.assertEqual(code_point, cp.SQLDTA)
+        self.assertEqual(bytes(obj), bytes(sqldta[8:]))
+
+    def test_params_encoder(self):
+        import datetime
+        from drda import consts, ddm
+        from drda.connection import _Statement
+        desc = [
+            ('', consts.DB2_SQLTYPE_NINTEGER, 4, 4, 10, 0, None),
+            ('', consts.DB2_SQLTYPE_NVARCHAR, 20, 20, 0, 0, None),
+            ('', consts.DB2_SQLTYPE_NBIGINT, 8, 8, 19, 0, None),
+            ('', consts.DB2_SQLTYPE_NFLOAT, 8, 8, 0, 0, None),
+            ('', consts.DB2_SQLTYPE_NDECIMAL, 5, 5, 7, 2, None),
+            ('', consts.DB2_SQLTYPE_NDATE, 10, 10, 0, 0, None),
+        ]
+        stmt = _Statement('INSERT INTO t VALUES (?, ?, ?, ?, ?, ?)', 1, desc, None)
+        # compiled once for the statement and byte order
+        encoder = stmt.params_encoder('little')
+        self.assertIs(stmt.params_encoder('little'), encoder)
+        self.assertIsNot(stmt.params_encoder('big'), encoder)
+        self.assertEqual(encoder.fdodsc, ddm.packFDODSC(desc))
+        for endian in ('little', 'big'):
+            encoder = stmt.params_encoder(endian)
+            for params in (
+                [1, 'abc', 2, 1.5, decimal.Decimal('12.34'), datetime.date(2024, 2, 29)],
+                [None, 'ab', None, None, None, None],
+                [-1, b'\x00\x01', 2**40, 0, 1, datetime.date(2024, 2, 29)],
+            ):
+                fdodta = ddm.packFDODTA(desc, params, endian, encoder.fdodsc)
+                self.assertEqual(encoder.fdodta(params), fdodta)
+                self.assertEqual(encoder.sqldta(params), ddm.packSQLDTA_rows(encoder.fdodsc, [fdodta]))
+                self.assertEqual(ddm.packSQLDTA(desc, params, endian), encoder.sqldta(params))
+        fdodta = stmt.params_encoder('big').fdodta([1, 'a', None, None, None, None])
+        self.assertEqual(fdodta[5:10], b'\x00\x00\x00\x00\x01')
+
+    def test_sqlcard_rowcount(self):
+        from drda import ddm
+        sqlcard = (
+            b'\x00' + (0).to_bytes(4, 'little') + b'00000' + b'SQLRI01F' + b'\x00' +
+            b''.join(n.to_bytes(4, 'little', signed=True) for n in (0, 0, 42, -1, 0, 0)) + b' ' * 11 +
+            b'\x00\x00\x00\x00\x00\x00\xff'
+        )
+        self.assertEqual(ddm.sqlcard_rowcount(sqlcard, 'little'), 42)
+        self.assertEqual(ddm.parse_sqlcard(sqlcard, 'utf-8', 'little')[0], None)
+        self.assertIsNone(ddm.sqlcard_rowcount(b'\xff', 'little'))
+
+    def test_executemany_long_row(self):
+        from drda.connection import _Statement
+        conn = _fake_connection(_build_dss_frame(cp.SQLCARD, b'\xff', flag=2), autocommit=False)
+        stmt = _Statement('INSERT INTO t VALUES (?)', 1, [('', 449, 65536, 65536, 0, 0, None)], None)
+        conn._prepare = lambda query: (stmt, True)
+        conn._release_statement = lambda stmt: None
+        # a row longer than a DSS is sent in continued DSS segments
+        conn._executemany(stmt.query, [['x' * 40000], ['y']])
+        buf = ddm.ReceiveBuffer(FakeSock(conn.sock.sent))
+        self.assertEqual(ddm.read_dss(buf)[3], cp.EXCSQLSTT)
+        _, _, _, code_point, obj = ddm.read_dss(buf)
+        self.assertEqual(code_point, cp.SQLDTA)
+        encoder = stmt.params_encoder(conn.endian)
+        self.assertEqual(
+            bytes(obj), bytes(ddm.packSQLDTA_rows(encoder.fdodsc, [encoder.fdodta(['x' * 40000]), encoder.fdodta(['y'])])[8:])
+        )
+
+
+class TestLobParams(unittest.TestCase):
+    def test_append_sqldta(self):
+        import io
+        from drda import consts, ddm
+        from drda import codepoint as cp
+        desc = [
+            ('', consts.DB2_SQLTYPE_NINTEGER, 4, 4, 10, 0, None),
+            ('', consts.DB2_SQLTYPE_NBLOB, 1048576, 1048576, 0, 0, None),
+            ('', consts.DB2_SQLTYPE_NCLOB, 1048576, 1048576, 0, 0, None),
+            ('', consts.DB2_SQLTYPE_NBLOB, 1048576, 1048576, 0, 0, None),
+        ]
+        blob = bytes(range(256)) * 400
+        clob = 'h\xe9llo' * 10000
+        chain = ddm.RequestChain()
+        chain.bufsize = 40000
+        chain.append(ddm.packEXCSQLSTT('SYSSH200', 'SYSLVL01', 1, 'testdb'), True)
+        ddm.append_sqldta(chain, desc, [1, io.BytesIO(blob), io.StringIO(clob), None], 'little')
+        self.assertFalse(ddm.has_lob_params(desc, [1, None, None, None]))
+        self.assertEqual(ddm.packFDODSC(desc)[-9:-6], bytes([0xC9, 0x80, 0x04]))
+
+        # the LOB values are sent in EXTDTA segments, in buffers of about chain.bufsize
+        buffers = list(chain.buffers())
+        self.assertGreater(len(buffers), 2)
+        sock = io.BytesIO(b''.join(buffers))
+        sock.recv_into = sock.readinto
+        buf = ddm.ReceiveBuffer(sock)
+        objects = [ddm.read_dss(buf) for _ in range(4)]
+        self.assertEqual([o[3] for o in objects], [cp.EXCSQLSTT, cp.SQLDTA, cp.EXTDTA, cp.EXTDTA])
+        self.assertEqual([o[2] for o in objects], [1, 1, 1, 1])
+        # FDODTA has the lengths of the LOB values
+        self.assertIn(b'\x00' + len(blob).to_bytes(4, 'big') + b'\x00' + len(clob.encode()).to_bytes(4, 'big'),
+                      bytes(objects[1][4]))
+        self.assertEqual(objects[2][4], b'\x00' + blob)
+        self.assertEqual(objects[3][4], b'\x00' + clob.encode('utf-8'))
+
+    def test_lob_locator(self):
+        import io
+        from drda import consts, ddm, utils
+        from drda import codepoint as cp
+
+        class Server:
+            "LOB values of the locators, and the requests for them"
+            values = {b'\x00\x00\x00\x01': bytes(range(256)) * 4, b'\x00\x00\x00\x02': 'h\xe9llo'.encode()}
+            requests = []
+
+            def _lob_length(self, lob):
+                self.requests.append(('length', lob.locator))
+                return len(self.values[lob.locator])
+
+            def _lob_substr(self, lob, pos, n):
+                self.requests.append(('substr', lob.locator, pos, n))
+                return self.values[lob.locator][pos:pos+n]
+
+        # LOB columns are overridden to locators
+        qrydsc = [(utils.DRDA_TYPE_NINTEGER, b'\x00\x04'), (utils.DRDA_TYPE_NLOBBYTES, b'\x80\x04'),
+                  (utils.DRDA_TYPE_NLOBCSBCS, b'\x80\x04')]
+        locator_qrydsc = utils.locator_qrydsc(qrydsc)
+        self.assertEqual(locator_qrydsc, [(utils.DRDA_TYPE_NINTEGER, b'\x00\x04'),
+                                          (utils.DRDA_TYPE_NLOBLOC, b'\x00\x04'),
+                                          (utils.DRDA_TYPE_NCLOBLOC, b'\x00\x04')])
+        self.assertEqual(bytes(ddm.packOUTOVR(locator_qrydsc))[2:],
+                         cp.OUTOVR.to_bytes(2, 'big') + bytes.fromhex('0c76d0030004190004 1b0004 0671e4d00001'))
+        results = []
+        utils.parse_qrydta(locator_qrydsc, b'\xff\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00\x00\x02',
+                           'little', results)
+        self.assertEqual(results, [(1, b'\x00\x00\x00\x01', b'\x00\x00\x00\x02')])
+
+        # LOB data is fetched when it is read
+        server = Server()
+        blob = utils.lob_locator(server, results[0][1], utils.DRDA_TYPE_NLOBLOC, 'utf-8')
+        clob = utils.lob_locator(server, results[0][2], utils.DRDA_TYPE_NCLOBLOC, 'utf-8')
+        self.assertEqual(server.requests, [])
+        self.assertEqual(blob.read(10), bytes(range(10)))
+        blob.seek(1020)
+        self.assertEqual(blob.read(), bytes(range(252, 256)))
+        self.assertEqual(server.requests, [('length', b'\x00\x00\x00\x01'), ('substr', b'\x00\x00\x00\x01', 0, 10),
+                                           ('substr', b'\x00\x00\x00\x01', 1020, 4)])
+        self.assertEqual(clob.read(), 'h\xe9llo')
+
+        # locators are sent as locator parameters, without their data
+        desc = [('', consts.DB2_SQLTYPE_NBLOB, 1048576, 1048576, 0, 0, None),
+                ('', consts.DB2_SQLTYPE_NCLOB, 1048576, 1048576, 0, 0, None)]
+        chain = ddm.RequestChain()
+        ddm.append_sqldta(chain, desc, [blob, clob], 'little')
+        self.assertEqual(len(chain.objects), 1)
+        sqldta = bytes(chain.objects[0][0])
+        self.assertIn(bytes.fromhex('76d0190004 1b0004'), sqldta)
+        self.assertTrue(sqldta.endswith(b'\x00\x00\x00\x00\x01\x00\x00\x00\x00\x02'))
+
+        # locators are valid until the end of the transaction
+        from drda import ProgrammingError, utils
+        conn = _fake_connection()
+        with self.assertRaises(ProgrammingError):
+            conn._query('SELECT doc FROM documents', [], utils.QueryOptions(lob_mode='locator'))
+
+
+class TestPrefetch(unittest.TestCase):
+    def test_pack_prefetch(self):
+        from drda import ddm
+        maxblkext = b'\x00\x06' + cp.MAXBLKEXT.to_bytes(2, 'big')
+        qryrowset = b'\x00\x08' + cp.QRYROWSET.to_bytes(2, 'big')
+        # MAXBLKEXT is signed, -1 (no limit) is 0xFFFF. QRYROWSET is sent only if it is set
+        self.assertEqual(ddm._pack_prefetch(-1, None), maxblkext + b'\xff\xff')
+        self.assertEqual(ddm._pack_prefetch(0, None), maxblkext + b'\x00\x00')
+        self.assertEqual(
+            ddm._pack_prefetch(16, 10000), maxblkext + b'\x00\x10' + qryrowset + (10000).to_bytes(4, 'big'),
+        )
+
+    def _params(self, packet, code_point):
+        self.assertEqual(int.from_bytes(packet[2:4], 'big'), code_point)
+        return ddm.parse_reply(packet[4:])
+
+    def test_opnqry(self):
+        for pack in (ddm.packOPNQRY, ddm.packOPNQRY_with_params):
+            params = self._params(pack('SYSSH200', 'SYSLVL01', 1, 'testdb', 65535), cp.OPNQRY)
+            self.assertEqual(params[cp.MAXBLKEXT], b'\xff\xff')
+            self.assertNotIn(cp.QRYROWSET, params)
+            params = self._params(pack('SYSSH200', 'SYSLVL01', 1, 'testdb', 65535, 16, 10000), cp.OPNQRY)
+            self.assertEqual(params[cp.MAXBLKEXT], b'\x00\x10')
+            self.assertEqual(params[cp.QRYROWSET], (10000).to_bytes(4, 'big'))
+            self.assertEqual(params[cp.QRYBLKSZ], (65535).to_bytes(4, 'big'))
+
+    def test_cntqry(self):
+        params = self._params(ddm.packCNTQRY('SYSSH200', 'SYSLVL01', 1, 'testdb', 65535, qryinsid=5), cp.CNTQRY)
+        self.assertNotIn(cp.MAXBLKEXT, params)
+        self.assertNotIn(cp.QRYROWSET, params)
+        self.assertEqual(params[cp.QRYINSID], (5).to_bytes(8, 'big'))
+        params = self._params(ddm.packCNTQRY('SYSSH200', 'SYSLVL01', 1, 'testdb', 65535, maxblkext=-1), cp.CNTQRY)
+        self.assertEqual(params[cp.MAXBLKEXT], b'\xff\xff')
+        self.assertNotIn(cp.QRYROWSET, params)
+        params = self._params(
+            ddm.packCNTQRY('SYSSH200', 'SYSLVL01', 1, 'testdb', 65535, maxblkext=0, qryrowset=100), cp.CNTQRY,
+        )
+        self.assertEqual(params[cp.MAXBLKEXT], b'\x00\x00')
+        self.assertEqual(params[cp.QRYROWSET], (100).to_bytes(4, 'big'))
+
+
+class TestRowDecoder(unittest.TestCase):
+    def test_parse_qrydta(self):
+        from drda import utils
+        qrydsc = [
+            (utils.DRDA_TYPE_NINTEGER, b'\x00\x04'),
+            (utils.DRDA_TYPE_NVARCHAR, b'\x00\x20'),
+            (utils.DRDA_TYPE_NDECIMAL, bytes([7, 2])),
+            (utils.DRDA_TYPE_NDATE, b'\x00\x0a'),
+        ]
+        row1 = b'\xff\x00' + b'\x00\x01\x00\x00\x00' + b'\x00\x00\x03abc' + b'\x00\x12\x34\x56\x7d' + b'\x00' + b'2024-02-29'
+        row2 = b'\xff\x00' + b'\x00\xfe\xff\xff\xff' + b'\xff' + b'\xff' + b'\xff'
+        results = []
+        rest = utils.parse_qrydta(qrydsc, row1 + row2 + row1[:7], 'little', results)
+        self.assertEqual(results, [
+            (1, 'abc', decimal.Decimal('-12345.67'), datetime.date(2024, 2, 29)),
+            (-2, None, None, None),
+        ])
+        self.assertEqual(rest, row1[:7])
+        # the descriptor is compiled once
+        self.assertIs(utils.qrydta_decoder(qrydsc, 'little'), utils.qrydta_decoder(list(qrydsc), 'little'))
+
+    def test_inline_lob(self):
+        from drda import codepoint as cp
+        from drda import ddm, utils
+        qrydsc = [(utils.DRDA_TYPE_NINTEGER, b'\x00\x04'), (utils.DRDA_TYPE_NLOBCSBCS, b'\x80\x04'),
+                  (utils.DRDA_TYPE_NLOBBYTES, b'\x80\x04')]
+        modes = utils.field_modes(qrydsc, [], lob_inline=True)
+        self.assertEqual(modes, (None, 'inline', 'inline'))
+        # small values are in QRYDTA, large ones in EXTDTA
+        row1 = b'\xff\x00' + b'\x00\x01\x00\x00\x00' + b'\x00\x01\x00\x00\x00\x03abc' + b'\x00\x02'
+        row2 = b'\xff\x00' + b'\x00\x02\x00\x00\x00' + b'\xff' + b'\x00\x01\x00\x00\x00\x00'
+        results = []
+        rest = utils.parse_qrydta(qrydsc, row1 + row2 + row1[:10], 'little', results, modes)
+        self.assertEqual(results, [(1, b'\x00abc', utils.EXTDTA_VALUE), (2, None, b'\x00')])
+        self.assertEqual(rest, row1[:10])
+        self.assertEqual(utils.lob_value(results[0][1], qrydsc[1][0], 'cp500'), 'abc')
+
+        opnqry = bytes(ddm.packOPNQRY('SYSSH200', 'SYSLVL01', 1, 'testdb', 65535, smldtasz=1024))
+        self.assertIn(cp.SMLDTASZ.to_bytes(2, 'big') + (1024).to_bytes(4, 'big'), opnqry)
+        self.assertNotIn(cp.DYNDTAFMT.to_bytes(2, 'big'), bytes(ddm.packOPNQRY('SYSSH200', 'SYSLVL01', 1, 'testdb', 65535)))
+
+    def test_packed_rows(self):
+        from drda import utils
+        qrydsc = [
+            (utils.DRDA_TYPE_NINTEGER, b'\x00\x04'),
+            (utils.DRDA_TYPE_NVARCHAR, b'\x00\x20'),
+            (utils.DRDA_TYPE_NDECIMAL, bytes([7, 2])),
+            (utils.DRDA_TYPE_NDATE, b'\x00\x0a'),
+        ]
+        row1 = b'\xff\x00' + b'\x00\x01\x00\x00\x00' + b'\x00\x00\x03abc' + b'\x00\x12\x34\x56\x7d' + b'\x00' + b'2024-02-29'
+        row2 = b'\xff\x00' + b'\x00\xfe\xff\xff\xff' + b'\xff' + b'\xff' + b'\xff'
+        values1 = (1, 'abc', decimal.Decimal('-12345.67'), datetime.date(2024, 2, 29))
+        values2 = (-2, None, None, None)
+        rows = utils.PackedRows(qrydsc, 'little')
+        rest = rows.append_qrydta(row1 + row2 + row1[:7])
+        self.assertEqual(rest, row1[:7])
+        self.assertEqual(rows.append_qrydta(rest + row1[7:] + row2), b'')
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(list(rows), [values1, values2, values1, values2])
+        self.assertEqual(rows[-1], values2)
+        self.assertEqual(rows[1:3], [values2, values1])
+        self.assertEqual(rows.column(1), ['abc', None, 'abc', None])
+        self.assertEqual(rows.column(3), [values1[3], None, values1[3], None])
+
+        self.assertEqual(rows.popleft(), values1)
+        more = utils.PackedRows(qrydsc, 'little')
+        more.append_qrydta(row2 + row1)
+        more.popleft()
+        rows.extend(more)
+        self.assertEqual(list(rows), [values2, values1, values2, values1])
+        self.assertEqual(rows.column(0), [-2, 1, -2, 1])
+        rows.clear()
+        self.assertEqual(len(rows), 0)
+        self.assertRaises(IndexError, rows.popleft)
+
+    def test_spilled_rows(self):
+        from drda import utils
+        qrydsc = [
+            (utils.DRDA_TYPE_NINTEGER, b'\x00\x04'),
+            (utils.DRDA_TYPE_NVARCHAR, b'\x00\x20'),
+        ]
+        row1 = b'\xff\x00' + b'\x00\x01\x00\x00\x00' + b'\x00\x00\x03abc'
+        row2 = b'\xff\x00' + b'\x00\xfe\xff\xff\xff' + b'\xff'
+        rows = utils.PackedRows(qrydsc, 'little', spill_size=len(row1 + row2))
+        rows.append_qrydta(row1 + row2)
+        self.assertFalse(rows.spilled)
+        # the blocks over spill_size are read from the temporary file
+        rows.append_qrydta(row2 + row1)
+        self.assertTrue(rows.spilled)
+        self.assertEqual(rows[-1], (1, 'abc'))
+        mapped = rows._mmap
+        rows.append_qrydta(row1)
+        self.assertEqual(list(rows), [(1, 'abc'), (-2, None), (-2, None), (1, 'abc'), (1, 'abc')])
+        # the file is mapped again for the appended block, and the previous mapping is closed
+        self.assertIsNot(rows._mmap, mapped)
+        self.assertTrue(mapped.closed)
+        self.assertEqual(rows.column(1), ['abc', None, None, 'abc', 'abc'])
+        self.assertEqual(rows.popleft(), (1, 'abc'))
+
+        more = utils.PackedRows(qrydsc, 'little')
+        more.extend(rows)
+        self.assertFalse(more.spilled)
+        self.assertEqual(more[:], [(-2, None), (-2, None), (1, 'abc'), (1, 'abc')])
+        rows.clear()
+        self.assertFalse(rows.spilled)
+        self.assertEqual(len(rows), 0)
+
+    def test_row_factory(self):
+        from drda import consts, utils
+        qrydsc = [
+            (utils.DRDA_TYPE_NINTEGER, b'\x00\x04'),
+            (utils.DRDA_TYPE_NDECIMAL, bytes([7, 2])),
+        ]
+        description = [
+            ('ID', consts.DB2_SQLTYPE_NINTEGER, 4, 4, 10, 0, None),
+            ('PRICE', consts.DB2_SQLTYPE_NDECIMAL, 7, 7, 7, 2, None),
+        ]
+        row1 = b'\xff\x00' + b'\x00\x01\x00\x00\x00' + b'\x00\x12\x34\x56\x7d'
+        row2 = b'\xff\x00' + b'\x00\x02\x00\x00\x00' + b'\xff'
+        row_class = utils.named_row(description)
+        self.assertIs(row_class, utils.named_row(list(description)))
+        for make_row in (row_class, None):
+            results = []
+            utils.parse_qrydta(qrydsc, row1 + row2, 'little', results, make_row=make_row)
+            self.assertEqual(results, [(1, decimal.Decimal('-12345.67')), (2, None)])
+        self.assertEqual([type(r) for r in results], [tuple, tuple])
+
+        rows = utils.PackedRows(qrydsc, 'little', make_row=row_class)
+        rows.append_qrydta(row1 + row2)
+        r = rows[0]
+        self.assertIsInstance(r, tuple)
+        self.assertEqual((r.ID, r.PRICE), (1, decimal.Decimal('-12345.67')))
+        self.assertEqual(r._asdict(), {'ID': 1, 'PRICE': decimal.Decimal('-12345.67')})
+        self.assertEqual(repr(rows[1]), "NamedRow(ID=2, PRICE=None)")
+
+        # a custom row factory
+        def dict_row(description):
+            names = [d[0] for d in description]
+            return lambda values: dict(zip(names, values))
+        results = []
+        utils.parse_qrydta(qrydsc, row1 + row2, 'little', results, make_row=dict_row(description))
+        self.assertEqual(results[1], {'ID': 2, 'PRICE': None})
+
+    def test_decimal_modes(self):
+        from drda import utils
+        qrydsc = [
+            (utils.DRDA_TYPE_NDECIMAL, bytes([7, 2])),
+            (utils.DRDA_TYPE_DECIMAL, bytes([3, 0])),
+        ]
+        b = b'\xff\x00' + b'\x00\x12\x34\x56\x7d' + b'\x12\x3f'
+        for decimal_mode, row in [
+            ('decimal', (decimal.Decimal('-12345.67'), decimal.Decimal('123'))),
+            ('int', (-1234567, 123)),
+            ('float', (-12345.67, 123.0)),
+            ({'N': 'int'}, (-1234567, decimal.Decimal('123'))),
+        ]:
+            results = []
+            modes = utils.field_modes(qrydsc, ['N', 'M'], decimal_mode)
+            utils.parse_qrydta(qrydsc, b, 'little', results, modes)
+            self.assertEqual(results, [row])
+            self.assertEqual([type(v) for v in results[0]], [type(v) for v in row])
+        self.assertIsNone(utils.field_modes(qrydsc, ['N', 'M'], {'X': 'int'}))
+
+    def test_datetime_modes(self):
+        from drda import utils
+        qrydsc = [
+            (utils.DRDA_TYPE_DATE, b'\x00\x0a'),
+            (utils.DRDA_TYPE_TIME, b'\x00\x08'),
+            (utils.DRDA_TYPE_TIMESTAMP, b'\x00\x20'),
+            (utils.DRDA_TYPE_TIMESTAMP, b'\x00\x13'),
+        ]
+        b = b'\xff\x00' + b'2024-02-29' + b'12:34:56' + b'1970-01-02-00.00.01.123456789012' + b'1969-12-31-23.59.59'
+        for datetime_mode, row in [
+            ('datetime', (
+                datetime.date(2024, 2, 29), datetime.time(12, 34, 56),
+                datetime.datetime(1970, 1, 2, 0, 0, 1, 123456), datetime.datetime(1969, 12, 31, 23, 59, 59),
+            )),
+            ('str', ('2024-02-29', '12:34:56', '1970-01-02-00.00.01.123456789012', '1969-12-31-23.59.59')),
+            ('epoch', (19782, 45296, 86401123456, -1000000)),
+        ]:
+            results = []
+            modes = utils.field_modes(qrydsc, [], datetime_mode=datetime_mode)
+            utils.parse_qrydta(qrydsc, b * 2, 'little', results, modes)
+            self.assertEqual(results, [row, row])
+        self.assertEqual(utils._decode_time(b'12.34.56'), datetime.time(12, 34, 56))
+
+    def test_decfloat(self):
+        from drda import utils
+        for v, n, b in [
+            ('1', 8, '2238000000000001'),
+            ('-123.45', 8, 'a2300000000049c5'),
+            ('9999999999999999', 8, '6e38ff3fcff3fcff'),
+            ('9.999999999999999E+384', 8, '77fcff3fcff3fcff'),
+            ('1', 16, '22080000000000000000000000000001'),
+            ('-0.00', 16, 'a2078000000000000000000000000000'),
+            ('-1234567890.123456789012345678901234', 16, 'a602134b9c1e28e56f3c127177823534'),
+            ('Infinity', 8, '7800000000000000'),
+        ]:
+            v = decimal.Decimal(v)
+            self.assertEqual(utils._encode_dfp(v, n).hex(), b)
+            self.assertEqual(str(utils._decode_dfp(bytes.fromhex(b))), str(v))
+        self.assertTrue(utils._decode_dfp(bytes.fromhex('7c00000000000000')).is_nan())
+        self.assertEqual(utils._encode_dfp(decimal.Decimal('NaN'), 8).hex(), '7c00000000000000')
+        # large leading digit: exponent top bits in G[2:1], the digit in G[0]
+        self.assertEqual(utils._decode_dfp(bytes.fromhex('6800000000000000')), decimal.Decimal('8E-127'))
+        self.assertEqual(utils._decode_dfp(bytes.fromhex('7400000000000000')), decimal.Decimal('9E+129'))
+
+    def test_decode_error(self):
+        from drda import utils
+        qrydsc = [
+            (utils.DRDA_TYPE_NINTEGER, b'\x00\x04'),
+            (utils.DRDA_TYPE_NDATE, b'\x00\x0a'),
+        ]
+        row = b'\xff\x00' + b'\x00\x01\x00\x00\x00' + b'\x00' + b'2024-02-29'
+        bad = b'\xff\x00' + b'\x00\x02\x00\x00\x00' + b'\x00' + b'2024-02-30'
+        null = b'\xff\x00' + b'\xff' + b'\x00' + b'2024-02-30'
+        description = [('i', 497, 4, 4, 10, 0, None), ('d', 385, 10, 10, 0, 0, None)]
+        try:
+            import numpy  # noqa: F401
+            numpy_columns = [lambda: utils.NumpyColumns(description)]
+        except ImportError:
+            numpy_columns = []
+        # an invalid value is an error, not the end of the rows
+        for b in (row + bad + b'\x00\x00', row + null + b'\x00\x00'):
+            self.assertRaises(ValueError, utils.parse_qrydta, qrydsc, b, 'little', [])
+            for new_columns in [lambda: utils.new_columns(description)] + numpy_columns:
+                self.assertRaises(ValueError, utils.parse_qrydta_columns, qrydsc, b, 'little', new_columns())
+        self.assertRaises(
+            ValueError, utils.PackedRows([(0x7F, b'\x00\x04')], 'little').append_qrydta, b'\xff\x00\x00\x00'
+        )
+
+    def test_parse_qrydta_fixed_width(self):
+        from drda import utils
+        qrydsc = [
+            (utils.DRDA_TYPE_NINTEGER, b'\x00\x04'),
+            (utils.DRDA_TYPE_FLOAT8, b'\x00\x08'),
+            (utils.DRDA_TYPE_NCHAR, b'\x00\x03'),
+        ]
+
+        def row(i, s):
+            return b'\xff\x00' + b'\x00' + i.to_bytes(4, 'little') + b'\x00' * 8 + (b'\x00' + s if s else b'\xff')
+
+        b = row(1, b'a  ') + row(2, None) + row(3, b'abc') + row(4, b'd  ')
+        results = []
+        rest = utils.parse_qrydta(qrydsc, b[:-3], 'little', results)
+        self.assertEqual(results, [(1, 0.0, 'a'), (2, 0.0, None), (3, 0.0, 'abc')])
+        self.assertEqual(rest, row(4, b'd  ')[:-3])
+        results = []
+        self.assertEqual(utils.parse_qrydta(qrydsc, b + b'\x00\x00', 'little', results), b'')
+        self.assertEqual(len(results), 4)
+
+    def test_parse_qrydta_columns(self):
+        from drda import utils
+        qrydsc = [
+            (utils.DRDA_TYPE_NINTEGER, b'\x00\x04'),
+            (utils.DRDA_TYPE_NVARCHAR, b'\x00\x20'),
+        ]
+        description = [
+            ('I', utils.consts.DB2_SQLTYPE_NINTEGER, 4, 4, 0, 0, None),
+            ('S', utils.consts.DB2_SQLTYPE_NVARCHAR, 32, 32, 0, 0, None),
+        ]
+        row1 = b'\xff\x00' + b'\x00\x01\x00\x00\x00' + b'\x00\x00\x03abc'
+        row2 = b'\xff\x00' + b'\xff' + b'\x00\x00\x00'
+        columns = utils.new_columns(description)
+        rest = utils.parse_qrydta_columns(qrydsc, row1 + row2 + row1[:4], 'little', columns)
+        self.assertEqual(rest, row1[:4])
+        self.assertEqual(columns[0].values.typecode, 'i')
+        self.assertEqual(columns[0].to_list(), [1, None])
+        self.assertEqual(columns[1].to_list(), ['abc', ''])
+        head, tail = columns[0].split(1)
+        self.assertEqual((head.to_list(), tail.to_list()), ([1], [None]))
+
+    def test_parse_qrydta_numpy(self):
+        try:
+            import numpy
+        except ImportError:
+            self.skipTest("numpy is not installed")
+        from drda import utils
+        qrydsc = [
+            (utils.DRDA_TYPE_NINTEGER8, b'\x00\x08'),
+            (utils.DRDA_TYPE_FLOAT8, b'\x00\x08'),
+            (utils.DRDA_TYPE_NDATE, b'\x00\x0a'),
+            (utils.DRDA_TYPE_NTIMESTAMP, b'\x00\x1a'),
+            (utils.DRDA_TYPE_NCHAR, b'\x00\x03'),
+        ]
+        description = [
+            ('I', utils.consts.DB2_SQLTYPE_NBIGINT, 8, 8, 0, 0, None),
+            ('F', utils.consts.DB2_SQLTYPE_FLOAT, 8, 8, 0, 0, None),
+            ('D', utils.consts.DB2_SQLTYPE_NDATE, 10, 10, 0, 0, None),
+            ('T', utils.consts.DB2_SQLTYPE_NTIMESTAMP, 26, 26, 0, 0, None),
+            ('S', utils.consts.DB2_SQLTYPE_NCHAR, 3, 3, 0, 0, None),
+        ]
+
+        def row(i, d):
+            b = b'\xff\x00\x00' + i.to_bytes(8, 'little') + numpy.float64(i / 2).tobytes()
+            if d is None:
+                return b + b'\xff\xff\xff'
+            return b + b'\x00' + d + b'\x00' + d + b'-12.34.56.000001\x00abc'
+
+        b = row(1, b'2024-02-29') + row(2, None) + row(3, b'1999-12-31') + row(4, b'2000-01-01')
+        columns = utils.NumpyColumns(description, capacity=1)
+        rest = utils.parse_qrydta_columns(qrydsc, b[:-5], 'little', columns)
+        self.assertEqual(rest, row(4, b'2000-01-01')[:-5])
+        arrays = columns.arrays()
+        self.assertEqual(arrays['I'].dtype, numpy.int64)
+        self.assertEqual(arrays['I'].tolist(), [1, 2, 3])
+        self.assertIsInstance(arrays['I'], numpy.ma.MaskedArray)
+        self.assertEqual(arrays['F'].tolist(), [0.5, 1.0, 1.5])
+        self.assertNotIsInstance(arrays['F'], numpy.ma.MaskedArray)
+        self.assertEqual(arrays['D'].dtype, numpy.dtype('datetime64[D]'))
+        self.assertEqual(arrays['D'].tolist(), [datetime.date(2024, 2, 29), None, datetime.date(1999, 12, 31)])
+        self.assertEqual(arrays['T'][2], numpy.datetime64('1999-12-31T12:34:56.000001'))
+        self.assertEqual(arrays['S'].tolist(), ['abc', None, 'abc'])
+
+    def test_parse_qrydta_numpy_unscaled_decimal(self):
+        try:
+            import numpy  # noqa: F401
+        except ImportError:
+            self.skipTest("numpy is not installed")
+        from drda import utils
+        qrydsc = [(utils.DRDA_TYPE_NDECIMAL, bytes([7, 2]))]
+        description = [('N', utils.consts.DB2_SQLTYPE_NDECIMAL, 0, 0, 7, 2, None)]
+        # sign nibbles 0xD and 0xB are negative, 0xC, 0xF, 0xA and 0xE are positive
+        b = b''.join(b'\xff\x00\x00\x12\x34\x56' + bytes([0x70 | sign]) for sign in (0xD, 0xC, 0xF, 0xB, 0xA, 0xE))
+        b += b'\xff\x00\x00\x00\x00\x12\x3f'
+        columns = utils.NumpyColumns(description, unscaled_decimal=True)
+        utils.parse_qrydta_columns(qrydsc, b, 'little', columns)
+        self.assertEqual(columns.arrays()['N'].tolist(), [-1234567, 1234567, 1234567, -1234567, 1234567, 1234567, 123])
+
+
+    def test_record_batch(self):
+        try:
+            import pyarrow
+        except ImportError:
+            self.skipTest("pyarrow is not installed")
+        from drda import utils
+        qrydsc = [
+            (utils.DRDA_TYPE_NDECIMAL, bytes([7, 2])),
+            (utils.DRDA_TYPE_NDATE, b'\x00\x0a'),
+        ]
+        description = [
+            ('N', utils.consts.DB2_SQLTYPE_NDECIMAL, 0, 0, 7, 2, None),
+            ('D', utils.consts.DB2_SQLTYPE_NDATE, 10, 10, 0, 0, None),
+        ]
+        b = b'\xff\x00' + b'\x00\x12\x34\x56\x7d' + b'\x00' + b'2024-02-29'
+        b += b'\xff\x00' + b'\xff' + b'\xff'
+        b += b'\xff\x00' + b'\x00\x00\x00\x10\x0c' + b'\x00' + b'1999-12-31'
+        columns = utils.NumpyColumns(description, unscaled_decimal=True)
+        utils.parse_qrydta_columns(qrydsc, b, 'little', columns)
+        batch = columns.record_batch()
+        self.assertEqual(batch.schema.field('N').type, pyarrow.decimal128(7, 2))
+        self.assertEqual(batch.schema.field('D').type, pyarrow.date32())
+        self.assertEqual(batch.to_pydict(), {
+            'N': [decimal.Decimal('-12345.67'), None, decimal.Decimal('1.00')],
+            'D': [datetime.date(2024, 2, 29), None, datetime.date(1999, 12, 31)],
+        })
+
+
+class TestStreamingQuery(unittest.TestCase):
+    """Fetch query blocks on demand (no database server required)."""
+
+    def _connection(self, reply):
+        from drda import utils
+        from drda.connection import _OpenQuery
+        conn = _fake_connection(reply)
+        query = _OpenQuery(conn._sections.allocate(), utils.QueryOptions())
+        query.qrydsc = [(utils.DRDA_TYPE_NINTEGER, b'\x00\x04')]
+        query.is_open = True
+        return conn, query
+
+    def _qrydta(self, values):
+        return b''.join(b'\xff\x00\x00' + v.to_bytes(4, 'little') for v in values)
+
+    def test_fetch_query(self):
+        chained = 0b01000000 | 2
+        reply = _build_dss_frame(cp.QRYDTA, self._qrydta([1, 2]), flag=2)
+        reply += _build_dss_frame(cp.QRYDTA, self._qrydta([3]) + b'\xff\x00\x00', flag=chained)
+        reply += _build_dss_frame(cp.QRYDTA, bytes(4) + b'\x00\x00', flag=chained)
+        reply += _build_dss_frame(cp.ENDQRYRM, bytes(), flag=chained)
+        reply += _build_dss_frame(cp.SQLCARD, b'\xff', flag=2)
+        conn, query = self._connection(reply)
+
+        self.assertEqual(list(conn._fetch_query(query)), [(1,), (2,)])
+        self.assertTrue(query.is_open)
+        self.assertEqual(len(conn._sections), 63)
+        self.assertEqual(int.from_bytes(conn.sock.sent[8:10], 'big'), cp.CNTQRY)
+
+        # a row continued in the next query block, then the end of the query
+        self.assertEqual(list(conn._fetch_query(query)), [(3,), (0,)])
+        self.assertFalse(query.is_open)
+        self.assertEqual(len(conn._sections), 64)
+
+    def test_arrow_batches(self):
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            self.skipTest("pyarrow is not installed")
+        import collections
+        from drda import consts
+        from drda.cursor import Cursor
+        chained = 0b01000000 | 2
+        reply = _build_dss_frame(cp.QRYDTA, self._qrydta([1, 2]), flag=2)
+        reply += _build_dss_frame(cp.QRYDTA, self._qrydta([3]) + b'\xff\x00\xff', flag=chained)
+        reply += _build_dss_frame(cp.ENDQRYRM, bytes(), flag=chained)
+        reply += _build_dss_frame(cp.SQLCARD, b'\xff', flag=2)
+        conn, query = self._connection(reply)
+        cur = Cursor(conn, streaming=True)
+        cur.description = [('I', consts.DB2_SQLTYPE_NINTEGER, 4, 4, 10, 0, None)]
+        cur._rows = collections.deque([(10,)])
+        cur._open_query = query
+
+        batches = list(cur.arrow_batches(2))
+        self.assertEqual([b.to_pydict() for b in batches], [
+            {'I': [10, 1]}, {'I': [2]}, {'I': [3, None]},
+        ])
+        self.assertEqual(str(batches[0].schema.field('I').type), 'int32')
+        self.assertIsNone(cur._open_query)
+
+    def test_packed_fetchall(self):
+        from drda import utils
+        from drda.cursor import Cursor
+        chained = 0b01000000 | 2
+        reply = _build_dss_frame(cp.QRYDTA, self._qrydta([1, 2]) + b'\xff\x00\x00', flag=2)
+        reply += _build_dss_frame(cp.QRYDTA, bytes(4), flag=chained)
+        reply += _build_dss_frame(cp.ENDQRYRM, bytes(), flag=chained)
+        reply += _build_dss_frame(cp.SQLCARD, b'\xff', flag=2)
+        conn, query = self._connection(reply)
+        query.options.packed = True
+        cur = Cursor(conn, streaming=True, packed=True)
+        cur._rows = utils.PackedRows(query.qrydsc, 'little')
+        cur._rows.append_qrydta(self._qrydta([10]))
+        cur._open_query = query
+
+        rows = cur.fetchall_packed()
+        self.assertIsInstance(rows, utils.PackedRows)
+        self.assertEqual(list(rows), [(10,), (1,), (2,), (0,)])
+        self.assertEqual(rows.column(0), [10, 1, 2, 0])
+        self.assertIsNone(cur._open_query)
+
+        cur._rows = utils.PackedRows(query.qrydsc, 'little')
+        cur._rows.append_qrydta(self._qrydta([10, 11]))
+        self.assertEqual(cur.fetchall(), [(10,), (11,)])
+        self.assertEqual(cur._rows, [])
+
+    def test_falsy_rows(self):
+        "rows made by a row_factory may be falsy, only None ends the rows"
+        import collections
+        from drda.cursor import Cursor
+        chained = 0b01000000 | 2
+        reply = _build_dss_frame(cp.QRYDTA, self._qrydta([0, 0, 1]), flag=2)
+        reply += _build_dss_frame(cp.QRYDTA, self._qrydta([0]), flag=chained)
+        reply += _build_dss_frame(cp.ENDQRYRM, bytes(), flag=chained)
+        reply += _build_dss_frame(cp.SQLCARD, b'\xff', flag=2)
+        conn, query = self._connection(reply)
+        row_factory = lambda description: lambda values: values[0]     # noqa: E731
+        query.make_row = row_factory([('I', 497, 4, 4, 10, 0, None)])
+        cur = Cursor(conn, streaming=True)
+        cur._rows = collections.deque()
+        cur._open_query = query
+
+        self.assertEqual(cur.fetchmany(2), [0, 0])
+        self.assertEqual(list(cur), [1, 0])
+
+    def test_close_query(self):
+        reply = _build_dss_frame(cp.SQLCARD, b'\xff', flag=2)
+        conn, query = self._connection(reply)
+        conn._close_query(query)
+        self.assertFalse(query.is_open)
+        self.assertEqual(int.from_bytes(conn.sock.sent[8:10], 'big'), cp.CLSQRY)
+        self.assertEqual(len(conn._sections), 64)
+
+
 class TestSecmec(unittest.TestCase):
     def test_secmec9(self):
         from drda import secmec9
@@ -505,6 +1381,132 @@ class TestSecmec(unittest.TestCase):
         )
 
 
+class TestSection(unittest.TestCase):
+    def _connection(self, stmt_cache_size, reply=b''):
+        from drda.connection import _SectionAllocator
+        conn = _fake_connection(reply, stmt_cache_size=stmt_cache_size)
+        conn._sections = _SectionAllocator(1, 3)
+        return conn
+
+    def _sqlcard(self, sqlcode, rowcount=0):
+        return (
+            b'\x00' + sqlcode.to_bytes(4, 'little', signed=True) + b'26501' + b'SQLRI01F' + b'\x00' +
+            b''.join(n.to_bytes(4, 'little', signed=True) for n in (0, 0, rowcount, 0, 0, 0)) + b' ' * 11 +
+            b'\x00\x00\x00\x00\x00\x00\xff'
+        )
+
+    def _params_sqldard(self):
+        "SQLDARD describing an INTEGER parameter"
+        from drda import consts
+        return b'\xff\xff' + (1).to_bytes(2, 'little') + (
+            (10).to_bytes(2, 'little') + bytes(2) + (4).to_bytes(8, 'little') +
+            consts.DB2_SQLTYPE_NINTEGER.to_bytes(2, 'little') + bytes(2) + bytes(29)
+        )
+
+    def _sent_code_points(self, sent):
+        code_points = []
+        while sent:
+            code_points.append(int.from_bytes(sent[8:10], 'big'))
+            sent = sent[int.from_bytes(sent[:2], 'big'):]
+        return code_points
+
+    def _invalidated_statement(self, reply):
+        "connection with a cached statement which the server no longer has, replying reply"
+        from drda.connection import _Statement
+        conn = self._connection(3, reply)
+        _, params_description = ddm.parse_sqldard(self._params_sqldard(), 'utf-8', 'little')
+        stmt = _Statement("INSERT INTO t VALUES (?)", conn._allocate_section(), params_description, None)
+        conn._cache_statement(stmt)
+        return conn, stmt
+
+    def test_reprepare_invalidated_statement(self):
+        reply = _build_dss_frame(cp.SQLCARD, self._sqlcard(-514), flag=2)
+        reply += _build_dss_frame(cp.SQLDARD, self._params_sqldard(), flag=2)
+        reply += _build_dss_frame(cp.SQLCARD, self._sqlcard(0, 1), flag=2)
+        conn, stmt = self._invalidated_statement(reply)
+
+        self.assertEqual(conn._execute(stmt.query, [1]), 1)
+        self.assertEqual(
+            self._sent_code_points(conn.sock.sent),
+            [cp.EXCSQLSTT, cp.SQLDTA, cp.RDBCMM, cp.PRPSQLSTT, cp.SQLSTT, cp.DSCSQLSTT, cp.EXCSQLSTT, cp.SQLDTA, cp.RDBCMM],
+        )
+        # the section of the invalidated statement is released, the statement prepared again is cached
+        new_stmt = conn._cached_statement(stmt.query)
+        self.assertNotEqual(new_stmt.pkgsn, stmt.pkgsn)
+        self.assertFalse(new_stmt.in_use)
+        self.assertIn(stmt.pkgsn, conn._sections._free)
+        self.assertEqual(len(conn._sections), 2)
+
+    def test_reprepare_fails_again(self):
+        from drda import OperationalError
+        reply = _build_dss_frame(cp.SQLCARD, self._sqlcard(-514), flag=2)
+        reply += _build_dss_frame(cp.SQLDARD, self._params_sqldard(), flag=2)
+        reply += _build_dss_frame(cp.SQLCARD, self._sqlcard(-518), flag=2)
+        conn, stmt = self._invalidated_statement(reply)
+
+        with self.assertRaises(OperationalError) as cm:
+            conn._query(stmt.query, [1])
+        self.assertEqual(cm.exception.sqlcode, -518)
+        # prepared once again, not retried on the statement just prepared
+        self.assertEqual(self._sent_code_points(conn.sock.sent).count(cp.PRPSQLSTT), 1)
+        self.assertEqual(self._sent_code_points(conn.sock.sent).count(cp.OPNQRY), 2)
+        self.assertIn(stmt.pkgsn, conn._sections._free)
+        self.assertFalse(conn._cached_statement(stmt.query).in_use)
+        self.assertEqual(len(conn._sections), 2)
+
+    def test_executemany_lob_row(self):
+        from drda import consts
+        from drda.connection import _Statement
+        reply = _build_dss_frame(cp.SQLCARD, self._sqlcard(0, 1), flag=2)
+        reply += _build_dss_frame(cp.SQLCARD, self._sqlcard(0, 1), flag=2)
+        reply += _build_dss_frame(cp.SQLCARD, b'\xff', flag=2)   # commit
+        conn = self._connection(3, reply)
+        desc = [('', consts.DB2_SQLTYPE_NBLOB, 1048576, 1048576, 0, 0, None)]
+        stmt = _Statement("INSERT INTO t VALUES (?)", conn._allocate_section(), desc, None)
+        conn._cache_statement(stmt)
+
+        self.assertEqual(conn._executemany(stmt.query, [[b'abc'], [b'def']]), 2)
+        # rows with LOB values are executed one by one on the cached statement, not prepared again
+        code_points = self._sent_code_points(conn.sock.sent)
+        self.assertEqual(code_points.count(cp.EXCSQLSTT), 2)
+        self.assertNotIn(cp.PRPSQLSTT, code_points)
+        self.assertIs(conn._cached_statement(stmt.query), stmt)
+        self.assertFalse(stmt.in_use)
+        self.assertEqual(len(conn._sections), 2)
+
+    def test_allocate_release(self):
+        from drda.connection import _Statement
+        conn = self._connection(0)
+        stmt = _Statement("SELECT 1", conn._allocate_section(), None, None)
+        stmt.in_use = True
+        conn._cache_statement(stmt)
+        self.assertEqual(len(conn._sections), 2)
+        conn._release_statement(stmt)
+        self.assertEqual(len(conn._sections), 3)
+
+    def test_evict_cached_statement(self):
+        from drda import OperationalError
+        from drda.connection import _Statement
+        conn = self._connection(3)
+        stmts = []
+        for i in range(3):
+            stmt = _Statement("SELECT {}".format(i), conn._allocate_section(), None, None)
+            conn._cache_statement(stmt)
+            stmts.append(stmt)
+        self.assertEqual(len(conn._sections), 0)
+        # sections of cached statements not in use are recycled (LRU first)
+        stmts[1].in_use = True
+        self.assertEqual(conn._allocate_section(), stmts[0].pkgsn)
+        self.assertEqual(conn._allocate_section(), stmts[2].pkgsn)
+        self.assertRaises(OperationalError, conn._allocate_section)
+        # a statement in use keeps its section until it is released
+        self.assertIsNone(conn._cached_statement("SELECT 0"))
+        conn._uncache_statement(stmts[1])
+        self.assertEqual(len(conn._sections), 0)
+        conn._release_statement(stmts[1])
+        self.assertEqual(conn._allocate_section(), stmts[1].pkgsn)
+
+
 class TestDb212(unittest.TestCase):
     """Tests for Db2 12.1 new data type features."""
 